@@ -14,7 +14,7 @@ from salt.models.task import (
     VertexingTask,
 )
 from salt.stypes import Vars
-from salt.utils.array_utils import join_structured_arrays, maybe_pad
+from salt.utils.array_utils import join_structured_arrays, maybe_pad, pad_last
 
 
 class PredictionWriter(Callback):
@@ -206,19 +206,23 @@ class PredictionWriter(Callback):
             input_variables = self.extra_vars[name]
             if not input_variables:
                 input_variables = self.file[name].dtype.names
-            inputs = self.file[name].fields(input_variables)[: self.num]
+            selection = getattr(self.ds, "selection", None)
+            if selection is None:
+                inputs = self.file[name].fields(input_variables)[: self.num]
+            else:
+                inputs = self.file[name].fields(input_variables)[: selection[-1] + 1][selection]
 
             # get output variables
             this_outputs = [inputs]
             for preds in outputs.values():
-                x = np.concatenate(preds)  # concat test batches
-                maybe_pad(x, inputs)
+                # concat test batches, which may have been truncated to different lengths
+                x = np.concatenate([maybe_pad(p, inputs) for p in preds])
                 this_outputs.append(maybe_pad(x, inputs))
 
             # add mask if present
             if name in self.pad_masks:
                 pad_mask = np.concatenate([
-                    m.cpu() for m in self.pad_masks[name]
+                    maybe_pad(m.cpu().numpy(), inputs, value=True) for m in self.pad_masks[name]
                 ])  # concat test batches
                 pad_mask = u2s(np.expand_dims(pad_mask, -1), dtype=np.dtype([("mask", "?")]))
                 this_outputs.append(maybe_pad(pad_mask, inputs))
@@ -231,7 +235,13 @@ class PredictionWriter(Callback):
 
         if "objects" in self.outputs:
             objects = f.create_group("objects")
+            seq_len = self.file[self.input_map[self.ds.mf_config.constituent.name]].shape[1]
             for key, preds in self.outputs["objects"].items():
+                # re-pad truncated constituent masks to the width of the input file
+                if key == "mask_logits":
+                    preds = [pad_last(p, seq_len, np.finfo(p.dtype).min) for p in preds]  # noqa: PLW2901
+                elif key == "tgt_masks":
+                    preds = [pad_last(p, seq_len, False) for p in preds]  # noqa: PLW2901
                 x = np.concatenate(preds)
                 self.create_dataset(objects, x, key, self.half_precision)
 
@@ -5,7 +5,6 @@ import socket
 from contextlib import suppress
 from pathlib import Path
 
-import h5py
 import lightning as L
 import numpy as np
 import torch
@@ -151,8 +150,9 @@ class SaveConfigCallback(Callback):
 
         train_loader = trainer.datamodule.train_dataloader()
         val_loader = trainer.datamodule.val_dataloader()
-        train_dset = train_loader.dataset
-        val_dset = val_loader.dataset
+        # unwrap iterable datasets used for object-level shuffling
+        train_dset = getattr(train_loader.dataset, "dataset", train_loader.dataset)
+        val_dset = getattr(val_loader.dataset, "dataset", val_loader.dataset)
 
         global_object = self.plm.global_object
         if input_map := self.config["data"]["input_map"]:
@@ -164,16 +164,22 @@ class SaveConfigCallback(Callback):
         meta["val_file"] = str(val_dset.filename)
         meta["num_train"] = len(train_dset)
         meta["num_val"] = len(val_dset)
-        meta["available_train"] = len(train_dset.file[global_object])
-        meta["available_val"] = len(val_dset.file[global_object])
+        # sharded datasets are made up of several single-file datasets
+        train_shards = getattr(train_dset, "datasets", [train_dset])
+        val_shards = getattr(val_dset, "datasets", [val_dset])
+        meta["available_train"] = sum(len(ds.file[global_object]) for ds in train_shards)
+        meta["available_val"] = sum(len(ds.file[global_object]) for ds in val_shards)
         batch_size = train_loader.batch_size
-        batch_size = batch_size if batch_size else train_loader.sampler.batch_size
+        batch_size = batch_size or getattr(
+            train_loader.sampler, "batch_size", trainer.datamodule.batch_size
+        )
         meta["batch_size"] = batch_size
         params = sum(p.numel() for p in self.plm.parameters() if p.requires_grad)
         meta["trainable_params"] = params
         meta["num_gpus"] = trainer.num_devices
         meta["gpu_ids"] = trainer.device_ids
-        meta["num_workers"] = train_loader.num_workers
+        # device-resident datasets are iterated without workers
+        meta["num_workers"] = getattr(train_loader, "num_workers", 0)
 
         with contextlib.suppress(KeyError):
             # TODO: update UPP to call attribute objects instead of jets
@@ -200,14 +206,12 @@ class SaveConfigCallback(Callback):
             logger.log_hyperparams(meta)
 
         # save the object classes, which is stored as an attr in the training file
-        with h5py.File(meta["train_file"]) as file:
-            try:
-                object_classes = file[global_object].attrs["flavour_label"]
-            except KeyError:
-                object_classes = "not available"
-            meta["object_classes"] = dict(
-                zip(range(len(object_classes)), object_classes, strict=True)
-            )
+        # (use the dataset's file, which may be a zarr store or a remote file)
+        try:
+            object_classes = train_shards[0].file[global_object].attrs["flavour_label"]
+        except KeyError:
+            object_classes = "not available"
+        meta["object_classes"] = dict(zip(range(len(object_classes)), object_classes, strict=True))
 
         with contextlib.suppress(KeyError):
             meta["jet_counts_train"] = get_attr(train_dset.file, "jet_counts")
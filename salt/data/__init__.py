@@ -1,7 +1,24 @@
+from salt.data.batch_cache import BatchCache
 from salt.data.datamodules import SaltDataModule
-from salt.data.datasets import SaltDataset
+from salt.data.datasets import (
+    DeviceDataset,
+    SaltDataset,
+    ShardedSaltDataset,
+    ShardWorkerDataset,
+    ShuffleBufferDataset,
+)
+from salt.data.readahead import ReadaheadSampler
+from salt.data.samplers import BucketBatchSampler, RandomBatchSampler
 
 __all__ = [
+    "BatchCache",
+    "BucketBatchSampler",
+    "DeviceDataset",
+    "RandomBatchSampler",
+    "ReadaheadSampler",
     "SaltDataModule",
     "SaltDataset",
+    "ShardWorkerDataset",
+    "ShardedSaltDataset",
+    "ShuffleBufferDataset",
 ]
@@ -0,0 +1,258 @@
+"""Place dataloader workers on CPU cores.
+
+By default the dataloader workers of every rank on a node can run on any core, so they
+are scheduled across sockets, away from the memory and GPU of their rank, and compete
+with the main training processes. With an affinity policy, the cores available to the
+job are split between the ranks on the node, a few cores of each rank's share are
+kept free for its main process, and the workers are pinned to the rest. The main
+process itself is not pinned, so that torch's threads are not confined to a few cores.
+
+- `numa`: each rank's share is taken from the NUMA node its GPU is attached to. If this
+  is unknown, the ranks are assumed to be spread over the nodes in order. Each worker is
+  pinned to its own subset of the share.
+- `exclusive`: workers of all ranks share all cores, except those kept free for the main
+  processes.
+
+Independently of the policy, the number of threads used by torch in each worker is
+limited to the number of cores it can use, or to one thread without a policy, so that
+workers do not oversubscribe the cores. BLAS threads are only limited if threadpoolctl
+is installed, as BLAS libraries read their environment variables when they are loaded.
+"""
+
+import contextlib
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import torch
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+POLICIES = ("numa", "exclusive")
+
+
+def parse_cpulist(cpulist: str) -> list[int]:
+    """Parse a Linux cpu list, such as `0-3,8-11`."""
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus += range(int(first), int(last or first) + 1)
+    return cpus
+
+
+def format_cpulist(cpus: list[int]) -> str:
+    """Format cores as a Linux cpu list, the inverse of `parse_cpulist`."""
+    parts = []
+    for cpu in sorted(cpus):
+        if parts and cpu == parts[-1][1] + 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in parts)
+
+
+def get_available_cpus() -> list[int]:
+    """Return the cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_numa_nodes() -> list[list[int]]:
+    """Return the available cores of each NUMA node, or a single node if unknown."""
+    available = set(get_available_cpus())
+    nodes = []
+    for path in sorted(Path("/sys/devices/system/node").glob("node[0-9]*/cpulist")):
+        cpus = [c for c in parse_cpulist(path.read_text()) if c in available]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(available)]
+
+
+def set_affinity(cpus: list[int]) -> None:
+    """Pin all threads of this process to the given cores.
+
+    `os.sched_setaffinity(0, ...)` only pins the calling thread, so on Linux each thread
+    listed in `/proc/self/task` is pinned, including those already started by torch.
+    Threads started later inherit the affinity of the thread starting them.
+    """
+    tasks = Path("/proc/self/task")
+    tids = [int(p.name) for p in tasks.iterdir()] if tasks.is_dir() else [0]
+    for tid in tids:
+        # the thread may have exited in the meantime
+        with contextlib.suppress(ProcessLookupError):
+            os.sched_setaffinity(tid, cpus)
+
+
+def split(cpus: list[int], n: int) -> list[list[int]]:
+    """Split a list of cores into `n` contiguous parts, reusing cores if there are too few."""
+    if not n:
+        return []
+    if len(cpus) < n:
+        return [[cpus[i % len(cpus)]] for i in range(n)]
+    return [part.tolist() for part in np.array_split(cpus, n)]
+
+
+def get_device_node(device: int, nodes: list[list[int]]) -> int | None:
+    """Return the index in `nodes` of the NUMA node a CUDA device is attached to.
+
+    The node is found from the cores local to the device's PCI slot. Returns None if
+    these are unknown, e.g. with versions of torch which don't report the PCI location.
+    """
+    props = torch.cuda.get_device_properties(device)
+    if not hasattr(props, "pci_bus_id"):
+        return None
+    bus_id = f"{props.pci_domain_id:04x}:{props.pci_bus_id:02x}:{props.pci_device_id:02x}.0"
+    path = Path("/sys/bus/pci/devices", bus_id, "local_cpulist")
+    if not path.is_file():
+        return None
+    local = set(parse_cpulist(path.read_text()))
+    overlap = [len(local.intersection(node)) for node in nodes]
+    return overlap.index(max(overlap)) if max(overlap) else None
+
+
+def get_rank_cpus(
+    policy: str,
+    nodes: list[list[int]],
+    local_world_size: int,
+    rank_nodes: list[int] | None = None,
+) -> list[list[int]]:
+    """Return the share of cores of each rank on the node.
+
+    With the `numa` policy, the ranks are placed on `rank_nodes` if given, otherwise
+    they are spread over the nodes in order.
+    """
+    if policy != "numa":
+        return split(sorted(c for node in nodes for c in node), local_world_size)
+    # split each node between the ranks placed on it
+    node_of_rank = rank_nodes or [
+        r * len(nodes) // local_world_size for r in range(local_world_size)
+    ]
+    shares = []
+    for rank, node in enumerate(node_of_rank):
+        ranks = [r for r, n in enumerate(node_of_rank) if n == node]
+        shares.append(split(nodes[node], len(ranks))[ranks.index(rank)])
+    return shares
+
+
+def assign_cpus(
+    policy: str,
+    nodes: list[list[int]],
+    local_rank: int,
+    local_world_size: int,
+    num_workers: int,
+    main_cpus: int = 1,
+    rank_nodes: list[int] | None = None,
+) -> tuple[list[int], list[list[int]]]:
+    """Assign cores to the dataloader workers of a rank, keeping some free for its main process.
+
+    Parameters
+    ----------
+    policy : str
+        Either `numa` or `exclusive`, see `salt.data.affinity`
+    nodes : list[list[int]]
+        Available cores of each NUMA node
+    local_rank : int
+        Rank of the process on the node
+    local_world_size : int
+        Number of ranks on the node
+    num_workers : int
+        Number of dataloader workers of each rank
+    main_cpus : int, optional
+        Number of cores of each rank's share kept free for its main process, by default 1
+    rank_nodes : list[int] | None, optional
+        Index of the NUMA node of each rank, see `get_rank_cpus`, by default None
+
+    Returns
+    -------
+    tuple[list[int], list[list[int]]]
+        Cores kept free for the main process, and cores of each worker
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"worker_affinity must be one of {POLICIES}, not '{policy}'.")
+    shares = get_rank_cpus(policy, nodes, local_world_size, rank_nodes)
+    main = shares[local_rank][:main_cpus]
+    if policy == "numa":
+        # workers use the rest of the share, or all of it if it is too small
+        rest = shares[local_rank][main_cpus:] or shares[local_rank]
+        return main, split(rest, num_workers)
+    reserved = {c for share in shares for c in share[:main_cpus]}
+    rest = [c for share in shares for c in share if c not in reserved]
+    return main, [rest or sorted(reserved)] * num_workers
+
+
+def limit_threads(num_threads: int) -> None:
+    """Limit the number of threads used by torch and, if threadpoolctl is installed, BLAS."""
+    torch.set_num_threads(num_threads)
+    if threadpool_limits is not None:
+        threadpool_limits(num_threads)
+
+
+class WorkerInit:
+    def __init__(self, cpus: list[list[int]] | None, num_threads: list[int]):
+        """Pin each dataloader worker to its cores and limit its threads.
+
+        Used as the `worker_init_fn` of a `DataLoader`, and must be picklable.
+
+        Parameters
+        ----------
+        cpus : list[list[int]] | None
+            Cores of each worker, or None to leave them unpinned
+        num_threads : list[int]
+            Maximum number of threads of each worker
+        """
+        self.cpus = cpus
+        self.num_threads = num_threads
+
+    def __call__(self, worker_id: int) -> None:
+        if self.cpus is not None:
+            set_affinity(self.cpus[worker_id])
+        limit_threads(self.num_threads[worker_id])
+
+
+def get_worker_init(
+    policy: str | None,
+    local_rank: int,
+    local_world_size: int,
+    num_workers: int,
+    main_cpus: int = 1,
+    devices: list[int] | None = None,
+) -> WorkerInit:
+    """Return the worker init function of a rank.
+
+    Without a policy, or where affinity cannot be set, workers are not pinned, and each
+    is limited to a single thread, as torch does by default. With the `numa` policy, the
+    NUMA node of each rank is taken from its CUDA device in `devices` if possible.
+    """
+    if num_workers and threadpool_limits is None:
+        warnings.warn(
+            "threadpoolctl is not installed, so the BLAS threads of dataloader workers are"
+            " not limited. Install it with `pip install threadpoolctl`.",
+            stacklevel=2,
+        )
+    if policy is not None and not hasattr(os, "sched_setaffinity"):
+        print("CPU affinity is not supported on this platform, workers will not be pinned")
+        policy = None
+    if policy is None:
+        return WorkerInit(None, [1] * num_workers)
+    nodes = get_numa_nodes()
+    rank_nodes = None
+    if policy == "numa" and devices is not None:
+        rank_nodes = [get_device_node(d, nodes) for d in devices]
+        if None in rank_nodes:
+            print("NUMA nodes of the GPUs are unknown, assuming ranks are spread in order")
+            rank_nodes = None
+    _, cpus = assign_cpus(
+        policy, nodes, local_rank, local_world_size, num_workers, main_cpus, rank_nodes
+    )
+    if policy == "exclusive":
+        # workers of all ranks share the same cores
+        num_threads = [max(len(c) // (local_world_size * num_workers), 1) for c in cpus]
+        return WorkerInit(cpus, num_threads)
+    return WorkerInit(cpus, [len(c) for c in cpus])
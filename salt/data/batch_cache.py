@@ -0,0 +1,153 @@
+"""Replay the batches of an unshuffled dataloader from a cache.
+
+Validation batches are the same in every epoch, but are otherwise read from the input
+file and assembled by the dataloader workers each time the model is validated.
+`BatchCache` wraps the validation dataloader and keeps each batch as it is read, either
+in memory or in a memory-mapped file, and replays them in later passes.
+
+As `BatchCache` is not a `DataLoader`, Lightning does not add a distributed sampler to
+it. The batches are instead split between the ranks by `RankSampler`, so that each rank
+only reads and caches its own share of the validation set.
+"""
+
+import math
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+from salt.data.datasets import ShuffleBufferDataset, map_batch
+from salt.data.samplers import split_batches
+
+
+class RankSampler(Sampler):
+    def __init__(self, sampler: Sampler):
+        """Split the batches of a batch sampler between the distributed ranks.
+
+        As with `torch.utils.data.DistributedSampler`, the batches are padded by
+        repeating the first few, so that each rank runs the same number of batches.
+
+        Parameters
+        ----------
+        sampler : Sampler
+            Sampler yielding the batches of all ranks
+        """
+        super().__init__()
+        self.sampler = sampler
+
+    def __len__(self):
+        _, world = ShuffleBufferDataset._rank()  # noqa: SLF001
+        return math.ceil(len(self.sampler) / world)
+
+    def __iter__(self):
+        rank, world = ShuffleBufferDataset._rank()  # noqa: SLF001
+        yield from split_batches(list(self.sampler), rank, world)
+
+
+@dataclass
+class CachedTensor:
+    """Location of a tensor in the cache file."""
+
+    offset: int
+    nbytes: int
+    dtype: torch.dtype
+    shape: tuple
+
+
+class BatchCache:
+    def __init__(self, loader, cache_dir: str | Path | None = None):
+        """Cache the batches of a dataloader as they are read, and replay them later.
+
+        Each pass first replays the cached batches. Only if more batches are requested
+        is the loader iterated, skipping the batches which are already cached, so that
+        incomplete passes, such as the sanity check before training or passes limited
+        by `limit_val_batches`, are also cached. Once a pass over the loader has
+        completed, the loader is no longer used.
+
+        Parameters
+        ----------
+        loader
+            Unshuffled dataloader whose batches are cached. Under DDP, its sampler
+            should only yield the batches of this rank, see `RankSampler`
+        cache_dir : str | Path | None, optional
+            If set, each batch is appended to an unnamed temporary file in this directory
+            as it is read, which is memory-mapped to replay the batches. The file is
+            removed when the process exits. By default None, which keeps copies of the
+            batches in memory
+        """
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.cache_dir = cache_dir
+        self.batches: list = []
+        self.complete = False
+        self.file = None
+        self.offset = 0
+        self.buffer = None
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def cached(self) -> bool:
+        return self.complete
+
+    def __iter__(self):
+        yield from self.replay()
+        if self.complete:
+            return
+        for i, batch in enumerate(self.loader):
+            # batches cached by an earlier, incomplete pass are read again only once
+            if i < len(self.batches):
+                continue
+            self.store(batch)
+            yield batch
+        self.complete = True
+
+    def store(self, batch):
+        """Copy a batch into the cache."""
+        if self.cache_dir is None:
+            # batches from a loader with pin_memory are in scarce page-locked memory
+            def copy(x):
+                if not isinstance(x, torch.Tensor):
+                    return x
+                return torch.empty(x.shape, dtype=x.dtype, device=x.device).copy_(x)
+
+            self.batches.append(map_batch(copy, batch))
+            return
+        if self.file is None:
+            Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+            self.file = tempfile.TemporaryFile(
+                prefix="val_batches_", suffix=".bin", dir=self.cache_dir
+            )
+        self.batches.append(map_batch(self.write, batch))
+
+    def write(self, x):
+        """Append a tensor to the cache file, and return its location."""
+        if not isinstance(x, torch.Tensor):
+            return x
+        data = x.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy()
+        self.file.write(data.tobytes())
+        leaf = CachedTensor(self.offset, data.nbytes, x.dtype, tuple(x.shape))
+        self.offset += data.nbytes
+        return leaf
+
+    def replay(self):
+        """Yield copies of the cached batches, as the model may modify them in place."""
+        if self.offset and (self.buffer is None or len(self.buffer) < self.offset):
+            # map the batches appended since the last replay
+            self.file.flush()
+            self.buffer = np.memmap(self.file, dtype=np.uint8, mode="r", shape=(self.offset,))
+
+        def read(x):
+            if isinstance(x, torch.Tensor):
+                return x.clone()
+            if not isinstance(x, CachedTensor):
+                return x
+            data = torch.from_numpy(self.buffer[x.offset : x.offset + x.nbytes].copy())
+            return data.view(x.dtype).view(x.shape)
+
+        for batch in self.batches:
+            yield map_batch(read, batch)
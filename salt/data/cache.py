@@ -0,0 +1,181 @@
+"""Columnar memory-mapped cache of decoded inputs and labels."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+from numpy.lib.recfunctions import repack_fields
+from numpy.lib.recfunctions import structured_to_unstructured as s2u
+
+CACHE_DTYPES = {"float32", "float16"}
+
+
+def get_cache_key(
+    filename: str | Path,
+    dataset: str,
+    variables: list[str],
+    labels: list[str],
+    dtype: str,
+) -> str:
+    """Return a hash identifying a cached input type.
+
+    The key depends on the identity of the input file (resolved path, size and
+    modification time), the dataset name, the requested variables and labels and
+    the storage dtype, so any change to these produces a new cache entry.
+    """
+    path = Path(filename).resolve()
+    stat = path.stat()
+    info = [str(path), stat.st_size, stat.st_mtime_ns, dataset, variables, labels, dtype]
+    return hashlib.sha1(json.dumps(info).encode()).hexdigest()[:16]  # noqa: S324
+
+
+def build_cache(
+    ds: h5py.Dataset,
+    read_dtype: np.dtype,
+    variables: list[str],
+    labels: list[str],
+    inputs_path: Path,
+    labels_path: Path,
+    dtype: str = "float32",
+    chunk_size: int = 100_000,
+    zero_padded: bool = True,
+) -> None:
+    """Decode a structured dataset into contiguous column arrays on disk.
+
+    Inputs are written as a single unstructured array of shape
+    `(num_objects, [num_constituents,] num_variables)`, and any remaining fields
+    (labels and the `valid` flag) are written as a packed structured array.
+    Files are written under a temporary name and moved into place once complete,
+    so concurrent builders never see a partially written cache.
+
+    Parameters
+    ----------
+    ds : h5py.Dataset
+        Structured dataset to cache
+    read_dtype : np.dtype
+        Structured dtype containing all the fields to cache
+    variables : list[str]
+        Input variables, stored in the unstructured inputs array
+    labels : list[str]
+        Labels, stored in the structured labels array along with any field
+        which is not an input variable
+    inputs_path : Path
+        Output path for the inputs array
+    labels_path : Path
+        Output path for the labels array
+    dtype : str, optional
+        Floating point type used to store the inputs, by default "float32"
+    chunk_size : int, optional
+        Number of objects to decode at once, by default 100_000
+    zero_padded : bool, optional
+        Set padded constituent inputs to zero, by default True
+    """
+    if dtype not in CACHE_DTYPES:
+        raise ValueError(f"Cache dtype must be one of {CACHE_DTYPES}, not '{dtype}'.")
+
+    label_names = [n for n in read_dtype.names if n in labels or n not in variables]
+    label_dtype = np.dtype([(n, read_dtype[n]) for n in label_names])
+    shape = ds.shape
+    suffix = f".{os.getpid()}.tmp"
+
+    inputs_tmp = inputs_path.with_name(inputs_path.name + suffix)
+    labels_tmp = labels_path.with_name(labels_path.name + suffix)
+    inputs = None
+    if variables:
+        inputs = np.lib.format.open_memmap(
+            inputs_tmp, mode="w+", dtype=dtype, shape=(*shape, len(variables))
+        )
+    labels = None
+    if label_names:
+        labels = np.lib.format.open_memmap(labels_tmp, mode="w+", dtype=label_dtype, shape=shape)
+
+    batch = np.array(0, dtype=read_dtype)
+    for start in range(0, shape[0], chunk_size):
+        stop = min(start + chunk_size, shape[0])
+        batch.resize((stop - start, *shape[1:]), refcheck=False)
+        ds.read_direct(batch, np.s_[start:stop])
+        if inputs is not None:
+            flat_array = s2u(batch[variables], dtype=dtype)
+            if zero_padded and "valid" in batch.dtype.names:
+                flat_array[~batch["valid"]] = 0
+            inputs[start:stop] = flat_array
+        if labels is not None:
+            labels[start:stop] = repack_fields(batch[label_names])
+
+    if inputs is not None:
+        inputs.flush()
+        del inputs
+        inputs_tmp.replace(inputs_path)
+    if labels is not None:
+        labels.flush()
+        del labels
+        labels_tmp.replace(labels_path)
+
+
+def load_cache(
+    cache_dir: str | Path,
+    filename: str | Path,
+    ds: h5py.Dataset,
+    read_dtype: np.dtype,
+    variables: list[str],
+    labels: list[str],
+    dtype: str = "float32",
+    zero_padded: bool = True,
+) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """Load the cached columns for a dataset, building them on first use.
+
+    Arrays are memory-mapped copy-on-write, so slices of them can be passed to
+    `torch.from_numpy` without copying the underlying data.
+
+    Parameters
+    ----------
+    cache_dir : str | Path
+        Directory in which to store the cache files
+    filename : str | Path
+        Path to the h5 file containing `ds`, used to key the cache
+    ds : h5py.Dataset
+        Structured dataset to cache
+    read_dtype : np.dtype
+        Structured dtype containing all the fields to cache
+    variables : list[str]
+        Input variables, stored in the unstructured inputs array
+    labels : list[str]
+        Labels, stored in the structured labels array
+    dtype : str, optional
+        Floating point type used to store the inputs, by default "float32"
+    zero_padded : bool, optional
+        Set padded constituent inputs to zero, by default True
+
+    Returns
+    -------
+    tuple[np.ndarray | None, np.ndarray | None]
+        The memory-mapped inputs and labels, or None if there are no input variables
+        or no remaining fields respectively
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    label_names = [n for n in read_dtype.names if n in labels or n not in variables]
+    key = get_cache_key(filename, ds.name, variables, label_names, f"{dtype}-{zero_padded}")
+    stem = f"{Path(filename).stem}_{ds.name.strip('/').replace('/', '_')}_{key}"
+    inputs_path = cache_dir / f"{stem}_inputs.npy"
+    labels_path = cache_dir / f"{stem}_labels.npy"
+
+    if (label_names and not labels_path.exists()) or (variables and not inputs_path.exists()):
+        print(f"Caching '{ds.name}' from {filename} to {cache_dir}")
+        build_cache(
+            ds,
+            read_dtype,
+            variables,
+            labels,
+            inputs_path,
+            labels_path,
+            dtype=dtype,
+            zero_padded=zero_padded,
+        )
+
+    inputs = np.load(inputs_path, mmap_mode="c") if variables else None
+    labels = np.load(labels_path, mmap_mode="c") if label_names else None
+    return inputs, labels
@@ -0,0 +1,140 @@
+"""Estimate the hit rate of the HDF5 raw data chunk cache."""
+
+import math
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+# default size of the HDF5 raw data chunk cache
+DEFAULT_RDCC_NBYTES = 1024**2
+
+
+class ChunkCacheStats:
+    def __init__(self, ds: h5py.Dataset, rdcc_nbytes: int | None = None):
+        """Track chunk accesses to a dataset using a model of the HDF5 chunk cache.
+
+        HDF5 does not expose statistics for its chunk cache, so accesses are replayed
+        through a least-recently-used cache of the same size. The model assumes there
+        are enough hash slots (`rdcc_nslots`) to avoid collisions. Chunks larger than
+        the cache are never cached, and will be decompressed on every access.
+
+        Parameters
+        ----------
+        ds : h5py.Dataset
+            Dataset to track
+        rdcc_nbytes : int | None, optional
+            Size of the chunk cache in bytes, by default the HDF5 default of 1 MiB
+        """
+        self.name = ds.name
+        self.chunk_len = ds.chunks[0] if ds.chunks is not None else None
+        self.capacity = 0
+        if self.chunk_len is not None:
+            # all chunks containing a given row are read together
+            blocks = math.prod(math.ceil(s / c) for s, c in zip(ds.shape, ds.chunks, strict=True))
+            blocks //= math.ceil(ds.shape[0] / self.chunk_len)
+            chunk_nbytes = math.prod(ds.chunks) * ds.dtype.itemsize * blocks
+            nbytes = rdcc_nbytes if rdcc_nbytes is not None else DEFAULT_RDCC_NBYTES
+            self.capacity = nbytes // chunk_nbytes
+        self.lru: OrderedDict = OrderedDict()
+        self.requested = 0
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, object_idx) -> None:
+        """Record a read of a slice or sorted array of rows."""
+        if self.chunk_len is None:
+            return
+        if isinstance(object_idx, slice):
+            self.requested += object_idx.stop - object_idx.start
+            chunks = range(
+                object_idx.start // self.chunk_len, (object_idx.stop - 1) // self.chunk_len + 1
+            )
+        else:
+            self.requested += len(object_idx)
+            chunks = np.unique(np.asarray(object_idx) // self.chunk_len).tolist()
+        for chunk in chunks:
+            if chunk in self.lru:
+                self.hits += 1
+                self.lru.move_to_end(chunk)
+                continue
+            self.misses += 1
+            if self.capacity:
+                self.lru[chunk] = None
+                if len(self.lru) > self.capacity:
+                    self.lru.popitem(last=False)
+
+    def __iadd__(self, other: "ChunkCacheStats"):
+        self.requested += other.requested
+        self.hits += other.hits
+        self.misses += other.misses
+        return self
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of chunk accesses served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else float("nan")
+
+    @property
+    def amplification(self) -> float:
+        """Number of rows decompressed per row requested."""
+        if not self.requested:
+            return float("nan")
+        return self.misses * self.chunk_len / self.requested
+
+
+def format_report(stats: dict[str, ChunkCacheStats]) -> str:
+    """Format chunk cache statistics for each input type as a table."""
+    lines = [
+        f"{'input':<12} {'chunk rows':>10} {'cached':>8} {'accesses':>10} {'hit rate':>9}"
+        f" {'read amp.':>10}"
+    ]
+    for input_name, s in stats.items():
+        if s.chunk_len is None:
+            lines.append(f"{input_name:<12} {'contiguous dataset, no chunk cache':>50}")
+            continue
+        lines.append(
+            f"{input_name:<12} {s.chunk_len:>10} {s.capacity:>8} {s.hits + s.misses:>10}"
+            f" {s.hit_rate:>9.1%} {s.amplification:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def simulate_chunk_cache(dataset, batches: list, num_workers: int = 0) -> dict:
+    """Replay the reads for an epoch of batches through a model of the chunk cache.
+
+    Batches are assigned to DataLoader workers in turn, and each worker has its
+    own cache. No data is read from disk.
+
+    Parameters
+    ----------
+    dataset : SaltDataset | ShardedSaltDataset
+        Dataset the batches are read from
+    batches : list
+        Slices or sorted index arrays of each batch, e.g. from a batch sampler
+    num_workers : int, optional
+        Number of DataLoader workers, by default 0
+
+    Returns
+    -------
+    dict
+        Combined `ChunkCacheStats` for each input type which is read from the h5 file
+    """
+    shards = getattr(dataset, "datasets", [dataset])
+    workers: dict = {}
+    for i, object_idx in enumerate(batches):
+        shard, local_idx = dataset.locate(object_idx) if len(shards) > 1 else (0, object_idx)
+        key = (i % max(num_workers, 1), shard)
+        if key not in workers:
+            workers[key] = shards[shard].new_chunk_stats()
+        for s in workers[key].values():
+            s.record(local_idx)
+
+    combined: dict = {}
+    for worker_stats in workers.values():
+        for input_name, s in worker_stats.items():
+            if input_name not in combined:
+                combined[input_name] = shards[0].new_chunk_stats()[input_name]
+            combined[input_name] += s
+    return combined
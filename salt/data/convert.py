@@ -0,0 +1,149 @@
+"""Convert an h5 input file to a columnar zarr store, and compare their read throughput.
+
+Each structured dataset is written to a group containing one array per variable,
+chunked along the first axis and compressed with Blosc. The variable names and the
+number of dimensions of the dataset are stored in the group attributes, and are used
+by `salt.data.readers.ZarrDataset` to read the group back as a structured array.
+"""
+
+import argparse
+import shutil
+from pathlib import Path
+
+import h5py
+import numpy as np
+import yaml
+
+from salt.data.readers import import_zarr
+from salt.data.rechunk import get_config_variables, read_throughput
+
+
+def to_json(value):
+    """Convert an h5 attribute to a JSON serialisable value."""
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, np.ndarray | np.generic):
+        return to_json(value.tolist())
+    if isinstance(value, list):
+        return [to_json(v) for v in value]
+    return value
+
+
+def to_zarr(
+    input_file: str | Path,
+    output_file: str | Path,
+    variables: dict | None = None,
+    chunk_size: int = 1000,
+    cname: str = "zstd",
+    clevel: int = 3,
+) -> Path:
+    """Write the structured datasets of an h5 file to a zarr store.
+
+    Parameters
+    ----------
+    input_file : str | Path
+        Input h5 file
+    output_file : str | Path
+        Output zarr store, which should end in `.zarr`
+    variables : dict | None, optional
+        Variables to keep for each dataset, by default all variables of all datasets
+    chunk_size : int, optional
+        Number of objects in each chunk, by default 1000
+    cname : str, optional
+        Blosc compressor, by default "zstd"
+    clevel : int, optional
+        Compression level, by default 3
+
+    Returns
+    -------
+    Path
+        Path to the zarr store
+    """
+    zarr = import_zarr()
+    from numcodecs import Blosc
+
+    output_file = Path(output_file)
+    tmp = output_file.with_name(f".{output_file.name}.tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    compressor = Blosc(cname=cname, clevel=clevel, shuffle=Blosc.SHUFFLE)
+    with h5py.File(input_file, "r") as src:
+        root = zarr.open_group(str(tmp), mode="w")
+        root.attrs.update({k: to_json(v) for k, v in src.attrs.items()})
+        for name, ds in src.items():
+            if not isinstance(ds, h5py.Dataset) or ds.dtype.names is None:
+                continue
+            if variables is not None and name not in variables:
+                continue
+            names = list(ds.dtype.names)
+            if variables is not None:
+                keep = set(variables[name]) | {"valid"}
+                names = [n for n in names if n in keep]
+            group = root.create_group(name)
+            group.attrs.update({
+                "fields": names,
+                "ndim": ds.ndim,
+                "attrs": {k: to_json(v) for k, v in ds.attrs.items()},
+            })
+            columns = {}
+            for n in names:
+                shape = ds.shape + ds.dtype[n].shape
+                columns[n] = group.create_dataset(
+                    n,
+                    shape=shape,
+                    chunks=(chunk_size, *shape[1:]),
+                    dtype=ds.dtype[n].base,
+                    compressor=compressor,
+                )
+            # write whole chunks, a few at a time
+            step = chunk_size * 16
+            for start in range(0, len(ds), step):
+                batch = ds.fields(names)[start : start + step]
+                for n, column in columns.items():
+                    column[start : start + len(batch)] = batch[n]
+    if output_file.exists():
+        shutil.rmtree(output_file)
+    tmp.replace(output_file)
+    return output_file
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a salt input file to a columnar zarr store."
+    )
+    parser.add_argument("input_file", help="Input h5 file.")
+    parser.add_argument("output_file", help="Output zarr store, ending in .zarr.")
+    parser.add_argument("-c", "--config", help="Only keep the variables used by a salt config.")
+    parser.add_argument("-b", "--chunk_size", type=int, default=1000)
+    parser.add_argument("--cname", default="zstd", help="Blosc compressor.")
+    parser.add_argument("--clevel", type=int, default=3, help="Compression level.")
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare the read throughput of the two files for the kept variables.",
+    )
+    parser.add_argument("-n", "--num_threads", type=int, default=0)
+    args = parser.parse_args(args)
+
+    variables = None
+    batch_size = args.chunk_size
+    if args.config:
+        with open(args.config) as f:
+            config = yaml.safe_load(f)
+        inputs, labels = get_config_variables(config)
+        variables = {k: inputs.get(k, []) + labels.get(k, []) for k in {*inputs, *labels}}
+        batch_size = config["data"]["batch_size"]
+    to_zarr(args.input_file, args.output_file, variables, args.chunk_size, args.cname, args.clevel)
+    print(f"Wrote {args.output_file}")
+
+    if args.benchmark:
+        zarr = import_zarr()
+        group = zarr.open_group(args.output_file, mode="r")
+        fields = {name: list(group[name].attrs["fields"]) for name in group.group_keys()}
+        for filename in [args.input_file, args.output_file]:
+            rate = read_throughput(filename, fields, batch_size, num_threads=args.num_threads)
+            print(f"Read throughput for {filename}: {rate:,.0f} objects/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,68 @@
+import glob
+from pathlib import Path
+
 import lightning as L
 from torch.utils.data import DataLoader
 
 import salt.utils.file_utils as fu
-from salt.data.datasets import SaltDataset
-from salt.data.samplers import RandomBatchSampler
+from salt.data.affinity import POLICIES, format_cpulist, get_worker_init
+from salt.data.batch_cache import BatchCache, RankSampler
+from salt.data.chunk_cache import format_report, simulate_chunk_cache
+from salt.data.datasets import (
+    DeviceDataset,
+    SaltDataset,
+    ShardedSaltDataset,
+    ShardWorkerDataset,
+    ShuffleBufferDataset,
+)
+from salt.data.readahead import ReadaheadSampler
+from salt.data.samplers import (
+    BucketBatchSampler,
+    RandomBatchSampler,
+    align_batch_size,
+    get_chunk_lengths,
+)
+from salt.utils.mask_utils import add_target_masks
+from salt.utils.staging import StagingCache
 
 
 class SaltDataModule(L.LightningDataModule):
     def __init__(
         self,
-        train_file: str,
-        val_file: str,
+        train_file: str | list[str],
+        val_file: str | list[str],
         batch_size: int,
         num_workers: int,
         num_train: int,
         num_val: int,
         num_test: int,
         move_files_temp: str | None = None,
+        shm_dir: str | None = None,
         class_dict: str | None = None,
         test_file: str | None = None,
         test_suff: str | None = None,
         pin_memory: bool = True,
         config_S3: dict | None = None,
+        shuffle_mode: str = "batch",
+        buffer_batches: int = 64,
+        max_tokens: int | None = None,
+        bucket_input: str = "tracks",
+        num_buckets: int = 8,
+        pin_shards: bool = False,
+        chunk_cache_report: bool = False,
+        align_chunks: bool = False,
+        align_max_reduction: float = 0.05,
+        background_staging: bool = False,
+        stage_columns: bool = False,
+        shared_staging: bool = False,
+        staging_nbytes: int | None = None,
+        retain_staged: bool = False,
+        readahead: int = 0,
+        worker_affinity: str | None = None,
+        main_cpus: int = 1,
+        device_data: bool = False,
+        val_cache: bool = False,
+        val_cache_dir: str | None = None,
         **kwargs,
     ):
         """Datamodule wrapping a [`salt.data.SaltDataset`][salt.data.SaltDataset] for training,
@@ -36,10 +77,11 @@ class SaltDataModule(L.LightningDataModule):
 
         Parameters
         ----------
-        train_file : str
-            Training file path
-        val_file : str
-            Validation file path
+        train_file : str | list[str]
+            Training file path. A glob pattern or a list of paths will load a
+            [`salt.data.ShardedSaltDataset`][salt.data.ShardedSaltDataset]
+        val_file : str | list[str]
+            Validation file path, or a glob pattern or list of paths
         batch_size : int
             Number of samples to process in each training step
         num_workers : int
@@ -53,6 +95,12 @@ class SaltDataModule(L.LightningDataModule):
         move_files_temp : str
             Directory to move training files to, default is None,
             which will result in no copying of files
+        shm_dir : str, optional
+            Directory on a shared-memory filesystem, e.g. `/dev/shm/<username>`. If set,
+            the required training and validation inputs are decoded once per node into
+            arrays in this directory, which are then memory-mapped by all ranks and workers
+            on the node without copying. The arrays are removed at the end of training.
+            By default None
         class_dict : str
             Path to umami preprocessing scale dict file
         test_file : str
@@ -63,6 +111,83 @@ class SaltDataModule(L.LightningDataModule):
             Pin memory for faster GPU transfer, default is True
         config_S3: dict, optional
             Some parameters for the S3 access
+        shuffle_mode : str, optional
+            How to shuffle the training data. "batch" shuffles the order of contiguous
+            batches, "buffer" shuffles objects within large contiguous blocks and
+            "exact" uses a full random permutation of the objects, see
+            [`salt.data.ShuffleBufferDataset`][salt.data.ShuffleBufferDataset].
+            By default "batch"
+        buffer_batches : int, optional
+            Number of batches in each shuffled block when using `shuffle_mode="buffer"`,
+            by default 64
+        max_tokens : int | None, optional
+            If set, group training objects into buckets of similar constituent multiplicity
+            and batch them with this approximate total number of valid constituents, see
+            [`salt.data.BucketBatchSampler`][salt.data.BucketBatchSampler].
+            The `batch_size` is ignored for training. Requires `dynamic_truncation`.
+            By default None
+        bucket_input : str, optional
+            Input type used to count constituents when `max_tokens` is set,
+            by default "tracks"
+        num_buckets : int, optional
+            Number of multiplicity buckets when `max_tokens` is set, by default 8
+        pin_shards : bool, optional
+            When reading several files, assign each worker to a subset of the files, see
+            [`salt.data.ShardWorkerDataset`][salt.data.ShardWorkerDataset], by default False
+        chunk_cache_report : bool, optional
+            Before training, print the estimated HDF5 chunk cache hit rate and read
+            amplification for one epoch of training batches, by default False
+        align_chunks : bool, optional
+            With `shuffle_mode="batch"`, reduce the batch size so that batches line up with
+            the HDF5 chunks of the input files, see
+            [`salt.data.RandomBatchSampler`][salt.data.RandomBatchSampler], by default False
+        align_max_reduction : float, optional
+            Largest fraction by which `align_chunks` may reduce the batch size. Larger
+            reductions change the optimisation, and must be allowed explicitly.
+            By default 0.05
+        background_staging : bool, optional
+            With `move_files_temp`, copy the training and validation files in parallel
+            background threads, and start training from the original files. Each dataset
+            switches to its copy once it is complete. By default False
+        stage_columns : bool, optional
+            With `background_staging`, only copy the variables and labels which are read
+            for training, with one chunk per batch. By default False
+        shared_staging : bool, optional
+            Use `move_files_temp` as a node-local cache shared by all jobs and ranks on
+            the node, see `salt.utils.staging.StagingCache`. Each file is copied once,
+            and removed when the last job using it finishes. By default False
+        staging_nbytes : int | None, optional
+            Maximum total size of the files in the shared staging cache, by default None
+        retain_staged : bool, optional
+            Keep files in the shared staging cache after the last job using them has
+            finished, evicting the least recently used when space is needed.
+            By default False
+        readahead : int, optional
+            Number of upcoming batches whose HDF5 chunks are read into the page cache
+            in the background, see [`salt.data.ReadaheadSampler`][salt.data.ReadaheadSampler].
+            Not used with the shuffle buffer or `pin_shards`. By default 0, which disables
+            readahead
+        worker_affinity : str | None, optional
+            Pin the dataloader workers to CPU cores, see `salt.data.affinity`. With `numa`,
+            the workers of each rank use cores on the NUMA node of its GPU, and each worker
+            has its own cores. With `exclusive`, workers may use any core except those
+            kept free for the main processes. The threads of each worker are limited to
+            its cores. The main processes are not pinned. By default None, which does not
+            pin the workers and limits them to one thread
+        main_cpus : int, optional
+            Number of cores kept free of workers for the main process of each rank when
+            `worker_affinity` is set, by default 1
+        device_data : bool, optional
+            Load the training and validation sets once onto the training device, and
+            serve shuffled batches from there without DataLoader workers, see
+            [`salt.data.DeviceDataset`][salt.data.DeviceDataset]. Only for models which
+            use nothing but the global object. By default False
+        val_cache : bool, optional
+            Keep the validation batches as they are read and replay them in later passes,
+            see [`salt.data.BatchCache`][salt.data.BatchCache]. By default False
+        val_cache_dir : str | None, optional
+            With `val_cache`, append the validation batches to a memory-mapped file in this
+            directory instead of keeping them in memory, by default None
         **kwargs
             Keyword arguments for [`salt.data.SaltDataset`][salt.data.SaltDataset]
         """
@@ -78,45 +203,120 @@ class SaltDataModule(L.LightningDataModule):
         self.num_test = num_test
         self.class_dict = class_dict
         self.move_files_temp = move_files_temp
+        self.shm_dir = shm_dir
         self.pin_memory = pin_memory
         self.config_S3 = config_S3
+        self.shuffle_mode = shuffle_mode
+        self.buffer_batches = buffer_batches
+        self.max_tokens = max_tokens
+        self.bucket_input = bucket_input
+        self.num_buckets = num_buckets
+        self.pin_shards = pin_shards
+        self.chunk_cache_report = chunk_cache_report
+        self.align_chunks = align_chunks
+        self.align_max_reduction = align_max_reduction
+        self.background_staging = background_staging
+        self.stage_columns = stage_columns
+        self.stager = None
+        self.shared_staging = shared_staging
+        self.staging_nbytes = staging_nbytes
+        self.retain_staged = retain_staged
+        self.staging_cache = None
+        self.readahead = readahead
+        self.readaheads: dict = {}
+        self.worker_affinity = worker_affinity
+        self.main_cpus = main_cpus
+        self.worker_init = None
+        self.device_data = device_data
+        self.device_dsets: dict = {}
+        self.val_cache = val_cache
+        self.val_cache_dir = val_cache_dir
+        self.val_loader = None
         self.kwargs = kwargs
 
+        if self.shuffle_mode not in {"batch", "buffer", "exact"}:
+            raise ValueError(
+                f"shuffle_mode must be one of 'batch', 'buffer' or 'exact', not '{shuffle_mode}'."
+            )
+        if self.worker_affinity is not None and self.worker_affinity not in POLICIES:
+            raise ValueError(
+                f"worker_affinity must be one of {POLICIES}, not '{self.worker_affinity}'."
+            )
+        if self.max_tokens is not None and self.shuffle_mode != "batch":
+            raise ValueError("max_tokens can only be used with shuffle_mode='batch'.")
+        if self.max_tokens is not None and not self.kwargs.get("dynamic_truncation"):
+            # otherwise the largest batches are padded to the full constituent width
+            raise ValueError("max_tokens requires dynamic_truncation=true.")
+        if is_sharded(self.train_file) or is_sharded(self.val_file):
+            if self.shuffle_mode != "batch" or self.max_tokens is not None:
+                raise ValueError(
+                    "Sharded inputs can only be used with shuffle_mode='batch' and without"
+                    " max_tokens."
+                )
+            if self.move_files_temp:
+                raise ValueError("move_files_temp is not supported for sharded inputs.")
+            if self.device_data:
+                raise ValueError("device_data is not supported for sharded inputs.")
+        if self.shared_staging and self.background_staging:
+            raise ValueError("shared_staging cannot be combined with background_staging.")
+        if self.shm_dir and (self.move_files_temp or self.kwargs.get("cache_dir")):
+            raise ValueError("shm_dir cannot be combined with move_files_temp or cache_dir.")
+
     def prepare_data(self):
-        if self.move_files_temp and not self.trainer.fast_dev_run:
+        copy_files = not (self.background_staging or self.shared_staging)
+        if self.move_files_temp and not self.trainer.fast_dev_run and copy_files:
             print("-" * 100)
             print(f"Moving train files to {self.move_files_temp} ")
             print("-" * 100)
             fu.move_files_temp(self.move_files_temp, self.train_file, self.val_file)
+        if self.shm_dir and not self.trainer.fast_dev_run:
+            # decode the inputs once on each node, other ranks attach in setup
+            print("-" * 100)
+            print(f"Decoding train and validation inputs into {self.shm_dir}")
+            print("-" * 100)
+            self.get_dataset(self.train_file, self.num_train, "fit")
+            self.get_dataset(self.val_file, self.num_val, "fit")
 
     def setup(self, stage: str):
         if self.trainer is not None and self.trainer.is_global_zero:
             print("-" * 100)
+        self.setup_workers()
 
-        if stage == "fit" and self.move_files_temp and not self.trainer.fast_dev_run:
+        staging = stage == "fit" and self.move_files_temp and not self.trainer.fast_dev_run
+        if staging and self.shared_staging:
+            # each rank takes a lease on the shared copy, the first one stages it
+            self.staging_cache = StagingCache(
+                self.move_files_temp, self.staging_nbytes, self.retain_staged
+            )
+            self.train_file = str(self.staging_cache.acquire(self.train_file))
+            self.val_file = str(self.staging_cache.acquire(self.val_file))
+        elif staging and not self.background_staging:
             # Set the training/validation file to the temp path
             self.train_file = fu.get_temp_path(self.move_files_temp, self.train_file)
             self.val_file = fu.get_temp_path(self.move_files_temp, self.val_file)
 
         # create training and validation datasets
         if stage == "fit":
-            self.train_dset = SaltDataset(
-                filename=self.train_file,
-                num=self.num_train,
-                stage=stage,
-                **self.kwargs,
-            )
-            self.val_dset = SaltDataset(
-                filename=self.val_file,
-                num=self.num_val,
-                stage=stage,
-                **self.kwargs,
-            )
+            self.train_dset = self.get_dataset(self.train_file, self.num_train, stage)
+            self.val_dset = self.get_dataset(self.val_file, self.num_val, stage)
+        if staging and self.background_staging:
+            self.start_staging()
+        if stage == "fit" and self.device_data:
+            self.load_device_data()
 
         # Only print train/val dataset details when actually training
         if stage == "fit" and self.trainer.is_global_zero:
             print(f"Created training dataset with {len(self.train_dset):,} entries")
             print(f"Created validation dataset with {len(self.val_dset):,} entries")
+            batch_sampler = self.shuffle_mode == "batch" and self.max_tokens is None
+            if self.align_chunks and batch_sampler and "train" not in self.device_dsets:
+                chunk_lengths = get_chunk_lengths(self.train_dset)
+                batch_size = align_batch_size(
+                    self.batch_size, chunk_lengths, self.align_max_reduction
+                )
+                print(f"Using a chunk-aligned batch size of {batch_size} for training")
+            if self.chunk_cache_report:
+                self.print_chunk_cache_report()
 
         if stage == "test":
             assert self.test_file is not None, "No test file specified, see --data.test_file"
@@ -131,35 +331,226 @@ class SaltDataModule(L.LightningDataModule):
         if self.trainer.is_global_zero:
             print("-" * 100, "\n")
 
-    def get_dataloader(self, stage: str, dataset: SaltDataset, shuffle: bool):
+    def setup_workers(self):
+        """Assign CPU cores to the dataloader workers of this rank, see `worker_affinity`."""
+        cuda = self.trainer.strategy.root_device.type == "cuda"
+        self.worker_init = get_worker_init(
+            self.worker_affinity,
+            self.trainer.local_rank,
+            self.trainer.num_devices,
+            self.num_workers,
+            self.main_cpus,
+            devices=self.trainer.device_ids if cuda else None,
+        )
+        if self.worker_affinity and self.trainer.is_global_zero and self.worker_init.cpus:
+            cpus = " | ".join(format_cpulist(c) for c in self.worker_init.cpus)
+            print(f"Pinned dataloader workers with the '{self.worker_affinity}' policy: {cpus}")
+
+    def load_device_data(self):
+        """Load the training and validation sets onto the training device."""
+        device = self.trainer.strategy.root_device
+        self.device_dsets = {
+            "train": DeviceDataset(self.train_dset, self.batch_size, device, True, True),
+            "val": DeviceDataset(self.val_dset, self.batch_size, device),
+        }
+        if self.trainer.is_global_zero:
+            train, val = self.device_dsets["train"], self.device_dsets["val"]
+            print(f"Loaded {train.num:,} training and {val.num:,} validation objects to {device}")
+
+    def start_staging(self):
+        """Stage the training and validation files in the background, see `move_files_temp`."""
+        dsets = [self.train_dset, self.val_dset]
+        for dset in dsets:
+            dset.staged_file = str(fu.get_temp_path(self.move_files_temp, dset.filename))
+        if self.trainer.local_rank != 0:
+            return
+        columns = None
+        if self.stage_columns:
+            columns = {}
+            for name, arr in self.train_dset.arrays.items():
+                columns.setdefault(self.train_dset.input_map[name], set()).update(arr.dtype.names)
+            columns = {k: sorted(v) for k, v in columns.items()}
+        files = [(Path(d.filename), Path(d.staged_file)) for d in dsets]
+        print(f"Staging training and validation files to {self.move_files_temp} in the background")
+        self.stager = fu.BackgroundStager(files, columns, self.batch_size)
+        self.stager.start()
+
+    def print_chunk_cache_report(self):
+        sampler = getattr(self.train_dataloader(), "sampler", None)
+        sampler = getattr(sampler, "sampler", sampler)
+        if not isinstance(sampler, RandomBatchSampler | BucketBatchSampler):
+            print("Chunk cache report is only available with shuffle_mode='batch'")
+            return
+        stats = simulate_chunk_cache(self.train_dset, list(sampler), self.num_workers)
+        print("Estimated chunk cache usage for one training epoch:")
+        print(format_report(stats))
+
+    def get_dataset(self, filename: str | list[str], num: int, stage: str):
+        kwargs = self.kwargs
+        if self.shm_dir and stage == "fit" and not self.trainer.fast_dev_run:
+            kwargs = {**kwargs, "cache_dir": self.shm_dir}
+        dataset_class = ShardedSaltDataset if is_sharded(filename) else SaltDataset
+        return dataset_class(filename=filename, num=num, stage=stage, **kwargs)
+
+    def get_dataloader(
+        self, stage: str, dataset: SaltDataset, shuffle: bool, split_ranks: bool = False
+    ):
         drop_last = stage == "fit"
+        if self.pin_shards and isinstance(dataset, ShardedSaltDataset):
+            return DataLoader(
+                dataset=ShardWorkerDataset(
+                    dataset, self.batch_size, shuffle=shuffle, drop_last=drop_last
+                ),
+                batch_size=None,
+                collate_fn=None,
+                num_workers=self.num_workers,
+                worker_init_fn=self.worker_init,
+                pin_memory=self.pin_memory,
+            )
+        if shuffle and self.shuffle_mode != "batch":
+            return DataLoader(
+                dataset=ShuffleBufferDataset(
+                    dataset,
+                    self.batch_size,
+                    buffer_batches=self.buffer_batches,
+                    exact=self.shuffle_mode == "exact",
+                    drop_last=drop_last,
+                ),
+                batch_size=None,
+                collate_fn=None,
+                num_workers=self.num_workers,
+                worker_init_fn=self.worker_init,
+                pin_memory=self.pin_memory,
+            )
+        if shuffle and self.max_tokens is not None:
+            sampler = BucketBatchSampler(
+                dataset.get_multiplicity(self.bucket_input),
+                self.max_tokens,
+                num_buckets=self.num_buckets,
+                shuffle=shuffle,
+            )
+        else:
+            sampler = RandomBatchSampler(
+                dataset,
+                self.batch_size,
+                shuffle,
+                drop_last=drop_last,
+                align_chunks=self.align_chunks,
+                max_reduction=self.align_max_reduction,
+            )
+        if split_ranks:
+            sampler = RankSampler(sampler)
+        if self.readahead:
+            # Lightning splits the batches between ranks with a DistributedSampler
+            dist = {} if split_ranks else self.trainer.distributed_sampler_kwargs or {}
+            sampler = ReadaheadSampler(
+                sampler,
+                dataset,
+                self.readahead,
+                prefetch=2 * self.num_workers,
+                **dist,
+            )
         return DataLoader(
             dataset=dataset,
             batch_size=None,
             collate_fn=None,
-            sampler=RandomBatchSampler(dataset, self.batch_size, shuffle, drop_last=drop_last),
+            sampler=sampler,
             num_workers=self.num_workers,
+            worker_init_fn=self.worker_init,
             shuffle=False,
             pin_memory=self.pin_memory,
         )
 
+    def track_readahead(self, name: str, loader: DataLoader) -> DataLoader:
+        """Keep the readahead sampler of a dataloader, to follow the batches it yields."""
+        if isinstance(loader.sampler, ReadaheadSampler):
+            if name in self.readaheads:
+                self.readaheads[name].close()
+            self.readaheads[name] = loader.sampler
+        return loader
+
     def train_dataloader(self):
-        return self.get_dataloader(dataset=self.train_dset, stage="fit", shuffle=True)
+        if "train" in self.device_dsets:
+            return self.device_dsets["train"]
+        loader = self.get_dataloader(dataset=self.train_dset, stage="fit", shuffle=True)
+        return self.track_readahead("train", loader)
 
     def val_dataloader(self):
-        return self.get_dataloader(dataset=self.val_dset, stage="test", shuffle=False)
+        if "val" in self.device_dsets:
+            return self.device_dsets["val"]
+        if not self.val_cache:
+            loader = self.get_dataloader(dataset=self.val_dset, stage="test", shuffle=False)
+            return self.track_readahead("val", loader)
+        # reuse the cache between calls, it is filled as the validation batches are read
+        if self.val_loader is None or self.val_loader.dataset is not self.val_dset:
+            # not a DataLoader, so Lightning won't split the batches between ranks
+            loader = self.get_dataloader(
+                dataset=self.val_dset, stage="test", shuffle=False, split_ranks=True
+            )
+            self.track_readahead("val", loader)
+            self.val_loader = BatchCache(loader, self.val_cache_dir)
+        return self.val_loader
 
     def test_dataloader(self):
-        return self.get_dataloader(dataset=self.test_dset, stage="test", shuffle=False)
+        loader = self.get_dataloader(dataset=self.test_dset, stage="test", shuffle=False)
+        return self.track_readahead("test", loader)
+
+    def on_before_batch_transfer(self, batch, dataloader_idx: int):  # noqa: ARG002
+        """Let the readahead of the current dataloader follow its progress."""
+        name = "train" if self.trainer.training else "test" if self.trainer.testing else "val"
+        if name in self.readaheads:
+            self.readaheads[name].advance()
+        return batch
+
+    def on_after_batch_transfer(self, batch, dataloader_idx: int):  # noqa: ARG002
+        """Build the MaskFormer truth masks on the device, see `compact_masks` in
+        [`salt.data.SaltDataset`][salt.data.SaltDataset].
+        """
+        mf_config = self.kwargs.get("mf_config")
+        if mf_config and self.kwargs.get("compact_masks"):
+            add_target_masks(batch[2], mf_config)
+        return batch
 
     def teardown(self, stage: str | None = None):
-        if (
+        if "train" in self.readaheads and self.trainer.is_global_zero:
+            print(self.readaheads["train"].report())
+        for readahead in self.readaheads.values():
+            readahead.close()
+        if self.stager is not None:
+            self.stager.stop()
+        if self.staging_cache is not None:
+            self.staging_cache.release(self.train_file)
+            self.staging_cache.release(self.val_file)
+            self.staging_cache = None
+        elif (
             stage == "fit"
             and self.move_files_temp
             and not self.trainer.fast_dev_run
             and self.trainer.is_global_zero
         ):
+            train_file, val_file = self.train_file, self.val_file
+            if self.background_staging:
+                train_file = fu.get_temp_path(self.move_files_temp, train_file)
+                val_file = fu.get_temp_path(self.move_files_temp, val_file)
+            print("-" * 100)
+            print(f"Removing training files: \n\t{train_file}\n\t{val_file}")
+            fu.remove_files_temp(train_file, val_file)
+            print("-" * 100)
+        if (
+            stage == "fit"
+            and self.shm_dir
+            and not self.trainer.fast_dev_run
+            and self.trainer.local_rank == 0
+        ):
+            # existing memory maps remain valid after the files are unlinked
             print("-" * 100)
-            print(f"Removing training files: \n\t{self.train_file}\n\t{self.val_file}")
-            fu.remove_files_temp(self.train_file, self.val_file)
+            print(f"Removing decoded inputs from {self.shm_dir}")
+            for dset in [self.train_dset, self.val_dset]:
+                for ds in getattr(dset, "datasets", [dset]):
+                    fu.remove_cache_files(ds.cache)
             print("-" * 100)
+
+
+def is_sharded(filename: str | list[str]) -> bool:
+    """Return True if the input is a list of files or a glob pattern."""
+    return not isinstance(filename, str) or glob.has_magic(filename)
@@ -1,17 +1,33 @@
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 import h5py
 import numpy as np
 import torch
+import yaml
 from numpy.lib.recfunctions import structured_to_unstructured as s2u
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
-from salt.data.edge_features import get_dtype_edge, get_inputs_edge
+from salt.data.cache import load_cache
+from salt.data.chunk_cache import ChunkCacheStats
+from salt.data.edge_features import get_dtype_edge, get_inputs_edge, get_inputs_edge_nodes
+from salt.data.index import load_index
+from salt.data.parallel_read import submit_read
+from salt.data.readers import ZarrDataset, ZarrFile, expand_shards, is_dataset, open_file
+from salt.data.remote import is_remote
+from salt.data.selection import load_selection
 from salt.stypes import Vars
 from salt.utils.array_utils import maybe_copy
 from salt.utils.configs import MaskformerConfig
+from salt.utils.file_utils import is_staged
 from salt.utils.inputs import as_half
-from salt.utils.mask_utils import build_target_masks
+from salt.utils.mask_utils import add_target_masks
+
+# numpy type used to decode the inputs for each input_dtype, bfloat16 is converted in torch
+INPUT_DTYPES = {"float32": np.float32, "float16": np.float16, "bfloat16": np.float32}
 
 
 class SaltDataset(Dataset):
@@ -29,14 +45,33 @@ class SaltDataset(Dataset):
         nan_to_num: bool = False,
         global_object: str = "jets",
         PARAMETERS: dict | None = None,
+        cache_dir: str | None = None,
+        cache_dtype: str = "float32",
+        input_dtype: str = "float32",
+        dynamic_truncation: bool = False,
+        rdcc_nbytes: int | None = None,
+        rdcc_nslots: int | None = None,
+        rdcc_w0: float | None = None,
+        lazy_edges: bool = False,
+        compact_masks: bool = False,
+        read_threads: int = 0,
+        index_file: str | None = None,
+        cuts: list[str] | None = None,
+        block_cache_dir: str | None = None,
+        block_cache_nbytes: int = 10 * 1024**3,
+        block_size: int = 4 * 1024**2,
+        staged_file: str | None = None,
     ):
         """An efficient map-style dataset for loading data from an H5 file containing structured
         arrays.
 
+        Zarr stores (with a `.zarr` suffix) written by `to_zarr` can be used in place of
+        h5 files, see `salt.data.readers`.
+
         Parameters
         ----------
         filename : str
-            Input h5 filepath containing structured arrays
+            Input h5 filepath containing structured arrays, or a zarr store
         norm_dict : str
             Path to file containing normalisation parameters
         variables : Vars
@@ -61,6 +96,79 @@ class SaltDataset(Dataset):
             inputs
         PARAMETERS: dict
             Variables used to parameterise the network, by default None.
+        cache_dir : str, optional
+            If set, decode the requested inputs and labels for each input type once
+            into contiguous memory-mapped arrays in this directory, and serve batches
+            as slices of these arrays. The cache is keyed by the input file and the
+            requested variables, and is reused across epochs and runs.
+        cache_dtype : str, optional
+            Floating point type used to store cached inputs, either "float32" or
+            "float16", by default "float32"
+        input_dtype : str, optional
+            Floating point type of the returned inputs, one of "float32", "float16" or
+            "bfloat16". Half precision inputs halve the size of each batch through the
+            workers, pinned memory and host-to-device copy, and are upcast to the model
+            precision by [`salt.models.InputNorm`][salt.models.InputNorm]. `EDGE` and
+            `PARAMETERS` inputs, which are not normalised, are always returned at single
+            precision. By default "float32"
+        dynamic_truncation : bool, optional
+            Truncate the constituent dimension of each batch to the longest valid
+            sequence in that batch, after any truncation from `num_inputs`.
+            Test outputs are re-padded to the width of the input file by the
+            `PredictionWriter` callback. By default False
+        rdcc_nbytes : int, optional
+            Size in bytes of the HDF5 raw data chunk cache for each dataset. This should
+            be large enough to hold at least one uncompressed chunk of each input type.
+            By default None, which uses the HDF5 default of 1 MiB
+        rdcc_nslots : int, optional
+            Number of hash slots in the chunk cache, ideally a prime around 100 times
+            the number of chunks which fit in the cache. By default None
+        rdcc_w0 : float, optional
+            Chunk preemption policy, between 0 and 1. Values closer to 1 evict fully
+            read chunks first. By default None
+        lazy_edges : bool, optional
+            Instead of the dense `(batch, N, N, F)` edge features, return only the
+            per-node columns needed to compute them for the `EDGE` input, with shape
+            `(batch, N, 4)`. The edge features are then computed on device by the
+            `EDGE` [`salt.models.InitNet`][salt.models.InitNet]. By default False
+        compact_masks : bool, optional
+            With `mf_config`, don't build the dense `(batch, num_objects, num_constituents)`
+            truth masks, which can be large. They are instead built on the device from the
+            object and constituent id labels by
+            [`salt.data.SaltDataModule`][salt.data.SaltDataModule]. By default False
+        read_threads : int, optional
+            Number of threads used to read each batch. If set, the reads for all input
+            types are issued concurrently, and each read is split into chunk-aligned
+            parts. Chunks compressed with gzip (and optionally shuffle) are decompressed
+            in parallel, other datasets are read through HDF5 one part at a time.
+            Only used for contiguous batches. For zarr stores, the variables of each input
+            type are instead read concurrently. By default 0, which reads sequentially
+        index_file : str, optional
+            Path to an index of the input file written by `build_index`. The index is
+            used to skip the per-batch check for non-finite inputs for input types which
+            are known to be finite, and provides constituent multiplicities. By default
+            None, which uses `<filename>.index` if it exists and is up to date
+        cuts : list[str], optional
+            Only use objects passing these cuts on global object variables, in the format
+            used by `ftag.Cuts.from_list`, e.g. `["pt > 250e3", "n_tracks <= 40"]`.
+            The selected indices are computed once and cached in `cache_dir`, or next
+            to the input file. Batches are then read as gathers over the selected objects.
+            By default None
+        block_cache_dir : str, optional
+            If the input file is a URL, such as `s3://bucket/file.h5`, it is streamed with
+            ranged reads instead of being downloaded. Fetched blocks are stored in this
+            directory, which is shared by all workers on the node, and reused by later
+            epochs. By default None, which only caches recently used blocks in memory
+        block_cache_nbytes : int, optional
+            Maximum size of the block cache in bytes, after which the least recently used
+            blocks are removed, by default 10 GiB
+        block_size : int, optional
+            Size in bytes of the blocks fetched from remote files, by default 4 MiB
+        staged_file : str, optional
+            Path of a copy of the input file which is being staged in the background,
+            see `salt.utils.file_utils.BackgroundStager`. Once the copy is complete, the
+            file is reopened from there. This is set by
+            [`salt.data.SaltDataModule`][salt.data.SaltDataModule]. By default None
         """
         super().__init__()
         # check labels have been configured
@@ -78,10 +186,35 @@ class SaltDataset(Dataset):
 
         self.input_map = input_map
         self.filename = filename
-        self.file = h5py.File(self.filename, "r")
+        self.rdcc = {
+            k: v
+            for k, v in {
+                "rdcc_nbytes": rdcc_nbytes,
+                "rdcc_nslots": rdcc_nslots,
+                "rdcc_w0": rdcc_w0,
+            }.items()
+            if v is not None
+        }
+        self.remote_options = {
+            "cache_dir": block_cache_dir,
+            "cache_nbytes": block_cache_nbytes,
+            "block_size": block_size,
+        }
+        if is_remote(filename) and (cuts or cache_dir or index_file):
+            raise ValueError("cuts, cache_dir and index_file require a local input file.")
+        self.staged_file = staged_file
+        self._staged_check = 0.0
+        self._file = None
+        self._file_pid = None
+        self._dss = None
+        self._pool = None
+        self.read_threads = read_threads
         self.num_inputs = num_inputs
         self.nan_to_num = nan_to_num
         self.global_object = global_object
+        self.dynamic_truncation = dynamic_truncation
+        self.lazy_edges = lazy_edges
+        self.compact_masks = compact_masks
 
         # If MaskFormer matching is enabled, extract the relevent labels
         self.mf_config = deepcopy(mf_config)
@@ -114,11 +247,9 @@ class SaltDataset(Dataset):
             for idx, param_key in enumerate(self.PARAMETERS.keys()):
                 assert self.input_variables["PARAMETERS"][idx] == param_key
 
-        # setup datasets and accessor arrays
-        self.dss = {}
+        # setup accessor arrays
         self.arrays = {}
         for internal, external in self.input_map.items():
-            self.dss[internal] = self.file[external]
             this_vars = self.labels[internal].copy() if internal in self.labels else []
             this_vars += self.input_variables.get(internal, [])
             if internal == "EDGE":
@@ -126,23 +257,118 @@ class SaltDataset(Dataset):
             else:
                 dtype = get_dtype(self.file[external], this_vars)
             self.arrays[internal] = np.array(0, dtype=dtype)
-        if self.global_object not in self.dss:
-            self.dss[self.global_object] = self.file[self.global_object]
+
+        # select objects passing the cuts
+        self.cuts = cuts
+        self.selection = None
+        if self.cuts:
+            self.selection = load_selection(
+                self.filename, self.dss[self.global_object], self.cuts, cache_dir
+            )
+            if not len(self.selection):
+                raise ValueError(f"No objects in {self.filename} pass the cuts {self.cuts}.")
 
         # set number of objects
         self.num = self.get_num(num)
+        if self.selection is not None:
+            self.selection = self.selection[: self.num]
+
+        self.index = load_index(self.filename, index_file)
+        if input_dtype not in INPUT_DTYPES:
+            raise ValueError(
+                f"input_dtype must be one of {sorted(INPUT_DTYPES)}, not '{input_dtype}'."
+            )
+        self.input_dtype = input_dtype
+        if self.input_dtype == "float16":
+            check_half_range(self.input_variables, self.input_map, self.index, self.norm_dict)
+
+        # decode inputs into memory-mapped column arrays
+        self.cache_dir = cache_dir
+        self.cache_dtype = cache_dtype
+        self.cache: dict = {}
+        self.multiplicity: dict = {}
+        if self.cache_dir is not None:
+            for internal in self.input_map:
+                if internal in {"EDGE", "PARAMETERS"}:
+                    continue
+                self.cache[internal] = load_cache(
+                    self.cache_dir,
+                    self.filename,
+                    self.dss[internal],
+                    self.arrays[internal].dtype,
+                    self.input_variables.get(internal) or [],
+                    self.labels.get(internal, []),
+                    dtype=self.cache_dtype,
+                    zero_padded=internal not in {self.global_object, "GLOBAL"},
+                )
+
+        # use the index to skip checks for inputs which are known to be finite
+        self.finite_inputs = self.get_finite_inputs()
 
     def __len__(self):
         """Return the number of samples in the dataset."""
         return int(self.num)
 
+    def __getstate__(self):
+        # open h5 handles can't be pickled, they are reopened on first use
+        state = self.__dict__.copy()
+        state.update({"_file": None, "_file_pid": None, "_dss": None, "_pool": None})
+        return state
+
+    @property
+    def file(self) -> h5py.File | ZarrFile:
+        """The input file, opened lazily by each process which reads from it."""
+        self.check_staged()
+        if self._file is None or self._file_pid != os.getpid():
+            self._file = open_file(
+                self.filename, self.read_threads, self.remote_options, **self.rdcc
+            )
+            self._file_pid = os.getpid()
+            self._dss = None
+            self._pool = None
+        return self._file
+
+    def check_staged(self, interval: float = 10.0):
+        """Switch to the staged copy of the input file once it is complete.
+
+        The staging marker is checked at most once every `interval` seconds.
+        """
+        if self.staged_file is None or self.filename == self.staged_file:
+            return
+        now = time.monotonic()
+        if now - self._staged_check < interval:
+            return
+        self._staged_check = now
+        if is_staged(self.staged_file):
+            self.filename = self.staged_file
+            self._file = None
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        """Thread pool used for reads, created lazily by each process."""
+        _ = self.file
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.read_threads, thread_name_prefix="salt-read")
+        return self._pool
+
+    @property
+    def dss(self) -> dict[str, h5py.Dataset | ZarrDataset]:
+        """The h5 dataset for each input type, and for the global object."""
+        file = self.file
+        if self._dss is None:
+            self._dss = {internal: file[external] for internal, external in self.input_map.items()}
+            if self.global_object not in self._dss:
+                self._dss[self.global_object] = file[self.global_object]
+        return self._dss
+
     def __getitem__(self, object_idx):
         """Return on sample or batch from the dataset.
 
         Parameters
         ----------
         object_idx
-            A numpy slice corresponding to a batch of objects.
+            A numpy slice corresponding to a batch of objects, or a sorted array of
+            object indices.
 
         Returns
         -------
@@ -150,28 +376,101 @@ class SaltDataset(Dataset):
             Dict of tensor for each of the inputs, pad_masks, and labels.
             Each tensor will contain a batch of samples.
         """
+        return self.process_batch(self.read_batch(object_idx))
+
+    def read_batch(self, object_idx) -> dict:
+        """Read the raw inputs and labels for each input type.
+
+        Parameters
+        ----------
+        object_idx
+            A numpy slice corresponding to a batch of objects, or a sorted array of
+            object indices.
+
+        Returns
+        -------
+        dict
+            Tuple of structured array and unstructured input array (see
+            [`read_inputs`][salt.data.SaltDataset.read_inputs]) for each input type.
+        """
+        # map positions in the selection to rows in the file
+        if self.selection is not None:
+            object_idx = self.selection[object_idx]
+
+        is_hdf5 = isinstance(self.file, h5py.File)
+        if self.read_threads and is_hdf5 and isinstance(object_idx, slice):
+            raw = self.read_batch_threaded(object_idx)
+        else:
+            raw = {name: self.read_inputs(name, object_idx) for name in self.input_map}
+
+        # hack to handle the old umami train file format
+        if "/" in self.labels:
+            raw["/"] = (self.file["labels"][object_idx], None)
+
+        return raw
+
+    def read_batch_threaded(self, object_idx: slice) -> dict:
+        """Read a contiguous batch, issuing the reads for all input types concurrently.
+
+        See [`read_batch`][salt.data.SaltDataset.read_batch] for details.
+        """
+        pending = {}
+        for input_name in self.input_map:
+            if input_name in self.cache:
+                continue
+            pending[input_name] = submit_read(
+                self.pool,
+                self.dss[input_name],
+                self.arrays[input_name].dtype,
+                object_idx,
+                self.read_threads,
+            )
+
+        raw = {}
+        for input_name in self.input_map:
+            if input_name not in pending:
+                raw[input_name] = self.read_inputs(input_name, object_idx)
+                continue
+            batch, futures = pending[input_name]
+            for future in futures:
+                future.result()
+            raw[input_name] = self.truncate_inputs(input_name, batch, None)
+        return raw
+
+    def process_batch(self, raw: dict) -> tuple:
+        """Convert raw arrays returned by [`read_batch`][salt.data.SaltDataset.read_batch]
+        into a batch of tensors.
+
+        Parameters
+        ----------
+        raw : dict
+            Raw arrays for each input type
+
+        Returns
+        -------
+        tuple
+            Dict of tensor for each of the inputs, pad_masks, and labels.
+        """
         inputs = {}
         labels = {}
         pad_masks = {}
 
+        if self.dynamic_truncation:
+            raw = self.truncate_batch(raw)
+
         # loop over input types
         for input_name in self.input_map:
             # load data (inputs + labels) for this input type
-            batch = self.arrays[input_name]
-            shape = (object_idx.stop - object_idx.start,) + self.dss[input_name].shape[1:]
-            batch.resize(shape, refcheck=False)
-            self.dss[input_name].read_direct(batch, object_idx)
-
-            # truncate track-like inputs
-            if self.num_inputs is not None and input_name in self.num_inputs:
-                assert int(self.num_inputs[input_name]) <= batch.shape[1]
-                batch = batch[:, : int(self.num_inputs[input_name])]
+            batch, flat_array = raw[input_name]
 
             # load edge inputs for this input type
             if input_name == "EDGE":
-                inputs[input_name] = torch.from_numpy(
-                    get_inputs_edge(batch, self.input_variables[input_name])
-                )
+                if self.lazy_edges:
+                    inputs[input_name] = torch.from_numpy(get_inputs_edge_nodes(batch))
+                else:
+                    inputs[input_name] = torch.from_numpy(
+                        get_inputs_edge(batch, self.input_variables[input_name])
+                    )
 
             # load PARAMETERS for this input type
             elif input_name == "PARAMETERS":
@@ -201,23 +500,34 @@ class SaltDataset(Dataset):
 
             # load standard inputs for this input type
             elif self.input_variables.get(input_name):
-                flat_array = s2u(batch[self.input_variables[input_name]], dtype=np.float32)
+                dtype = INPUT_DTYPES[self.input_dtype]
+                if flat_array is None:
+                    flat_array = s2u(batch[self.input_variables[input_name]], dtype=dtype)
+                elif flat_array.dtype != dtype:
+                    flat_array = flat_array.astype(dtype)
                 if self.nan_to_num:
                     flat_array = np.nan_to_num(flat_array)
                 inputs[input_name] = torch.from_numpy(maybe_copy(flat_array))
+                if self.input_dtype == "bfloat16":
+                    inputs[input_name] = inputs[input_name].to(torch.bfloat16)
 
-                # apply the input padding mask
-                if "valid" in batch.dtype.names and input_name not in {
+                # apply the input padding mask (cached inputs are already zero padded)
+                has_valid = batch is not None and "valid" in batch.dtype.names
+                if has_valid and input_name not in {
                     "EDGE",
                     "PARAMETERS",
                     self.global_object,
                     "GLOBAL",
                 }:
                     pad_masks[input_name] = ~torch.from_numpy(batch["valid"])
-                    inputs[input_name][pad_masks[input_name]] = 0
+                    if input_name not in self.cache:
+                        inputs[input_name][pad_masks[input_name]] = 0
 
                 # check inputs are finite
-                if not torch.isfinite(inputs[input_name]).all():
+                if (
+                    input_name not in self.finite_inputs
+                    and not torch.isfinite(inputs[input_name]).all()
+                ):
                     raise ValueError(f"Non-finite inputs for '{input_name}' in {self.filename}.")
             # process labels for this input type
             if input_name in self.labels:
@@ -238,24 +548,179 @@ class SaltDataset(Dataset):
                     if self.global_object not in labels:
                         labels[self.global_object] = {}
                     for label in self.labels["/"]:
-                        labels[input_name][label] = torch.as_tensor(
-                            self.file["labels"][object_idx], dtype=torch.long
-                        )
-        if self.mf_config:
-            labels["objects"]["masks"] = build_target_masks(
-                labels["objects"][self.mf_config.object.id_label],
-                labels[self.mf_config.constituent.name][self.mf_config.constituent.id_label],
-            )
+                        labels[input_name][label] = torch.as_tensor(raw["/"][0], dtype=torch.long)
+        if self.mf_config and not self.compact_masks:
+            add_target_masks(labels, self.mf_config)
         return inputs, pad_masks, labels
 
+    def truncate_batch(self, raw: dict) -> dict:
+        """Trim constituent-level inputs to the longest valid sequence in the batch.
+
+        Parameters
+        ----------
+        raw : dict
+            Raw arrays for each input type, see
+            [`read_batch`][salt.data.SaltDataset.read_batch]
+
+        Returns
+        -------
+        dict
+            Raw arrays with the constituent dimension of each input type trimmed
+        """
+        trimmed = {}
+        for input_name, (batch, flat_array) in raw.items():
+            if (
+                batch is None
+                or batch.ndim != 2
+                or "valid" not in batch.dtype.names
+                or input_name in {self.global_object, "GLOBAL", "PARAMETERS", "objects"}
+            ):
+                trimmed[input_name] = (batch, flat_array)
+                continue
+            # keep at least one constituent to avoid empty sequences
+            valid = np.flatnonzero(batch["valid"].any(0))
+            seq_len = int(valid[-1]) + 1 if len(valid) else 1
+            trimmed[input_name] = (
+                batch[:, :seq_len],
+                None if flat_array is None else flat_array[:, :seq_len],
+            )
+        return trimmed
+
+    def read_inputs(self, input_name: str, object_idx) -> tuple:
+        """Read a batch of inputs and labels for a single input type.
+
+        Parameters
+        ----------
+        input_name : str
+            Internal name of the input type
+        object_idx
+            A numpy slice corresponding to a batch of objects, or a sorted array of
+            object indices.
+
+        Returns
+        -------
+        tuple
+            The structured array containing labels (and inputs, if not cached), and the
+            unstructured input array if it was loaded from the cache, otherwise None.
+        """
+        if input_name in self.cache:
+            flat_array, batch = self.cache[input_name]
+            flat_array = flat_array[object_idx] if flat_array is not None else None
+            batch = batch[object_idx] if batch is not None else None
+        elif isinstance(object_idx, np.ndarray):
+            flat_array = None
+            batch = read_chunked(self.dss[input_name], self.arrays[input_name], object_idx)
+        else:
+            flat_array = None
+            batch = self.arrays[input_name]
+            shape = (object_idx.stop - object_idx.start,) + self.dss[input_name].shape[1:]
+            batch.resize(shape, refcheck=False)
+            self.dss[input_name].read_direct(batch, object_idx)
+
+        return self.truncate_inputs(input_name, batch, flat_array)
+
+    def truncate_inputs(self, input_name: str, batch, flat_array) -> tuple:
+        """Truncate constituent-level inputs to the configured `num_inputs`."""
+        if self.num_inputs is not None and input_name in self.num_inputs:
+            num_inputs = int(self.num_inputs[input_name])
+            assert num_inputs <= self.dss[input_name].shape[1]
+            if batch is not None:
+                batch = batch[:, :num_inputs]
+            if flat_array is not None:
+                flat_array = flat_array[:, :num_inputs]
+
+        return batch, flat_array
+
+    def new_chunk_stats(self) -> dict[str, ChunkCacheStats]:
+        """Return empty chunk cache statistics for each input type read from the file."""
+        # zarr stores have no chunk cache, so each chunk access is a miss
+        nbytes = self.rdcc.get("rdcc_nbytes") if isinstance(self.file, h5py.File) else 0
+        return {
+            input_name: ChunkCacheStats(self.dss[input_name], nbytes)
+            for input_name in self.input_map
+            if input_name not in self.cache
+        }
+
+    def get_multiplicity(self, input_name: str, chunk_size: int = 100_000) -> np.ndarray:
+        """Return the number of valid constituents in each object for an input type.
+
+        The result is taken from the index if available, otherwise it is computed from
+        the `valid` field on first use. In both cases it is then stored.
+
+        Parameters
+        ----------
+        input_name : str
+            Internal name of a constituent-level input type
+        chunk_size : int, optional
+            Number of objects to read at once, by default 100_000
+
+        Returns
+        -------
+        np.ndarray
+            Number of valid constituents for each of the `len(self)` objects
+        """
+        if input_name in self.multiplicity:
+            return self.multiplicity[input_name]
+        ds = self.dss[input_name]
+        if ds.dtype.names is None or "valid" not in ds.dtype.names or ds.ndim != 2:
+            raise ValueError(f"Input type '{input_name}' has no per-constituent 'valid' field.")
+
+        # number of rows of the file needed to cover the selected objects
+        num_rows = len(self) if self.selection is None else int(self.selection[-1]) + 1
+        index = (self.index or {}).get(self.input_map[input_name], {})
+        if "multiplicity" in index:
+            multiplicity = index["multiplicity"][:num_rows]
+        else:
+            multiplicity = np.empty(num_rows, dtype=np.int32)
+            for start in range(0, num_rows, chunk_size):
+                stop = min(start + chunk_size, num_rows)
+                if self.cache.get(input_name, (None, None))[1] is not None:
+                    valid = self.cache[input_name][1]["valid"][start:stop]
+                else:
+                    valid = ds.fields("valid")[start:stop]
+                multiplicity[start:stop] = valid.sum(-1)
+        if self.selection is not None:
+            multiplicity = multiplicity[self.selection]
+
+        if self.num_inputs is not None and input_name in self.num_inputs:
+            multiplicity = np.minimum(multiplicity, int(self.num_inputs[input_name]))
+
+        self.multiplicity[input_name] = multiplicity
+        return multiplicity
+
+    def get_finite_inputs(self) -> set[str]:
+        """Return the input types which the index shows to be finite for all valid entries."""
+        finite: set[str] = set()
+        if self.index is None:
+            return finite
+        for input_name, variables in self.input_variables.items():
+            if input_name in {"EDGE", "PARAMETERS"} or not variables:
+                continue
+            stats = self.index.get(self.input_map[input_name], {}).get("stats", {})
+            if not set(variables).issubset(stats):
+                continue
+            limit = np.inf
+            cached_half = input_name in self.cache and self.cache_dtype == "float16"
+            if cached_half or self.input_dtype == "float16":
+                limit = np.finfo(np.float16).max
+            if all(
+                stats[v]["nonfinite"] == 0 and max(-stats[v]["min"], stats[v]["max"]) <= limit
+                for v in variables
+            ):
+                finite.add(input_name)
+        return finite
+
     def get_num(self, num_requested: int):
         num_available = len(self.dss[self.global_object])
+        if self.selection is not None:
+            num_available = len(self.selection)
 
         # not enough objects
         if num_requested > num_available:
             raise ValueError(
                 f"Requested {num_requested:,} from {self.global_object}, but only"
-                f" {num_available:,} are available in the file {self.filename}."
+                f" {num_available:,} are available in the file {self.filename}"
+                + (" after cuts." if self.selection is not None else ".")
             )
 
         # use all objects
@@ -281,7 +746,7 @@ class SaltDataset(Dataset):
             if k == "GLOBAL":
                 k = self.global_object  # noqa: PLW2901
             name = self.input_map[k]
-            if not isinstance(self.file[name], h5py.Dataset):
+            if not is_dataset(self.file[name]):
                 raise KeyError(f"The object '{name}' in file '{self.filename}' is not a dataset.")
             if missing := set(v) - set(self.file[name].dtype.names):
                 raise KeyError(
@@ -290,6 +755,437 @@ class SaltDataset(Dataset):
                 )
 
 
+class ShuffleBufferDataset(IterableDataset):
+    def __init__(
+        self,
+        dataset: SaltDataset,
+        batch_size: int,
+        buffer_batches: int = 64,
+        exact: bool = False,
+        drop_last: bool = False,
+    ):
+        """Iterable dataset which shuffles individual objects between batches.
+
+        In the default buffer mode, large contiguous blocks of `buffer_batches`
+        batches are read in a random order, and the objects within each block are
+        shuffled in memory before being split into batches. This keeps the
+        sequential read pattern of [`salt.data.RandomBatchSampler`][salt.data.RandomBatchSampler]
+        while changing the composition of each batch every epoch.
+
+        In exact mode, a random permutation of all objects is split into batches,
+        and the objects in each batch are gathered from the file with each
+        required chunk decompressed once.
+        This gives a true random shuffle, but reads many more chunks per batch.
+
+        Work is split between DataLoader workers and distributed ranks, with all
+        of them sharing the same random seed for a given epoch.
+
+        Parameters
+        ----------
+        dataset : SaltDataset
+            Dataset to load batches from
+        batch_size : int
+            Number of objects in each batch
+        buffer_batches : int, optional
+            Number of batches in each shuffled block, by default 64
+        exact : bool, optional
+            Use an exact permutation of all objects instead of a shuffle buffer,
+            by default False
+        drop_last : bool, optional
+            Drop incomplete batches, by default False
+        """
+        super().__init__()
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.buffer_batches = buffer_batches
+        self.exact = exact
+        self.drop_last = drop_last
+
+    def __getattr__(self, name: str):
+        # expose the wrapped dataset's attributes, e.g. for callbacks
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def _num_batches(self, num: int) -> int:
+        if self.drop_last:
+            return num // self.batch_size
+        return math.ceil(num / self.batch_size)
+
+    @staticmethod
+    def _rank() -> tuple[int, int]:
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def _units(self, rng: np.random.Generator | None = None) -> list:
+        """Return the blocks (or batches, in exact mode) to be read on this rank."""
+        num = len(self.dataset)
+        if self.exact:
+            perm = np.arange(num) if rng is None else rng.permutation(num)
+            n_batches = self._num_batches(num)
+            units = [
+                perm[i * self.batch_size : (i + 1) * self.batch_size] for i in range(n_batches)
+            ]
+        else:
+            block = self.batch_size * self.buffer_batches
+            units = [np.s_[start : min(start + block, num)] for start in range(0, num, block)]
+            if rng is not None:
+                units = [units[i] for i in rng.permutation(len(units))]
+
+        # ensure each rank processes the same number of batches
+        rank, world = self._rank()
+        if world > 1:
+            if not self.exact:
+                units = [u for u in units if u.stop - u.start == block]
+            units = units[: len(units) // world * world]
+        return units[rank::world]
+
+    def __len__(self):
+        if self.exact:
+            return len(self._units())
+        return sum(self._num_batches(u.stop - u.start) for u in self._units())
+
+    def __iter__(self):
+        info = get_worker_info()
+        if info is None:
+            worker_id, num_workers = 0, 1
+            seed = int(torch.randint(2**62, ()))
+        else:
+            # the base seed is shared by all workers for a given epoch
+            worker_id, num_workers = info.id, info.num_workers
+            seed = info.seed - info.id
+        rng = np.random.default_rng(seed)
+
+        for i, unit in enumerate(self._units(rng)):
+            if i % num_workers != worker_id:
+                continue
+            if self.exact:
+                yield self.dataset[np.sort(unit)]
+                continue
+
+            # read a whole block, then serve shuffled batches from memory
+            raw = self.dataset.read_batch(unit)
+            perm = np.random.default_rng([seed, i]).permutation(unit.stop - unit.start)
+            for j in range(self._num_batches(len(perm))):
+                idx = perm[j * self.batch_size : (j + 1) * self.batch_size]
+                subset = {
+                    k: tuple(None if a is None else a[idx] for a in v) for k, v in raw.items()
+                }
+                yield self.dataset.process_batch(subset)
+
+
+class ShardedSaltDataset(Dataset):
+    def __init__(self, filename: str | list[str], num: int = -1, **kwargs):
+        """Dataset spanning several h5 files with the same structure.
+
+        Each shard is loaded as a [`salt.data.SaltDataset`][salt.data.SaltDataset], and
+        objects are addressed with a global index built from the cumulative number of
+        objects in each shard. Shards are used in sorted order until `num` objects
+        have been collected.
+
+        Batches must not straddle a shard boundary. This is ensured by
+        [`salt.data.RandomBatchSampler`][salt.data.RandomBatchSampler] and
+        [`salt.data.ShardWorkerDataset`][salt.data.ShardWorkerDataset].
+        Attributes which are not defined here, such as `file` and `input_map`,
+        are taken from the first shard.
+
+        Parameters
+        ----------
+        filename : str | list[str]
+            Glob pattern, or list of paths or glob patterns, of the input h5 files
+        num : int, optional
+            Total number of objects to use. If `-1`, use all objects in all shards
+        **kwargs
+            Keyword arguments for [`salt.data.SaltDataset`][salt.data.SaltDataset]
+        """
+        super().__init__()
+        self.filename = expand_shards(filename)
+        self.datasets: list[SaltDataset] = []
+        for fname in self.filename:
+            remaining = num - sum(len(ds) for ds in self.datasets)
+            if num >= 0 and remaining <= 0:
+                break
+            ds = SaltDataset(filename=fname, **kwargs)
+            if num >= 0:
+                ds.num = min(len(ds), remaining)
+            self.datasets.append(ds)
+        self.offsets = np.cumsum([0] + [len(ds) for ds in self.datasets])
+
+        if num > len(self):
+            raise ValueError(
+                f"Requested {num:,} objects, but only {len(self):,} are available in"
+                f" {len(self.filename)} files matching {filename}."
+            )
+        self.filename = [ds.filename for ds in self.datasets]
+
+    def __getattr__(self, name: str):
+        # expose the attributes of the first shard, e.g. for callbacks
+        if name == "datasets":
+            raise AttributeError(name)
+        return getattr(self.datasets[0], name)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def shard_bounds(self) -> list[tuple[int, int]]:
+        """The global `(start, stop)` indices of each shard."""
+        return [(int(a), int(b)) for a, b in zip(self.offsets[:-1], self.offsets[1:], strict=True)]
+
+    def locate(self, object_idx) -> tuple[int, slice | np.ndarray]:
+        """Return the shard containing a batch, and the indices within that shard.
+
+        Parameters
+        ----------
+        object_idx
+            A numpy slice corresponding to a batch of objects, or a sorted array of
+            object indices.
+
+        Returns
+        -------
+        tuple[int, slice | np.ndarray]
+            The shard index and the batch indices relative to the start of the shard
+
+        Raises
+        ------
+        IndexError
+            If the batch straddles a shard boundary
+        """
+        if isinstance(object_idx, slice):
+            first, last = object_idx.start, object_idx.stop - 1
+        else:
+            first, last = object_idx[0], object_idx[-1]
+        shard = int(np.searchsorted(self.offsets, first, side="right")) - 1
+        if last >= self.offsets[shard + 1]:
+            raise IndexError(f"Batch {object_idx} straddles the boundary of shard {shard}.")
+        offset = int(self.offsets[shard])
+        if isinstance(object_idx, slice):
+            return shard, np.s_[object_idx.start - offset : object_idx.stop - offset]
+        return shard, object_idx - offset
+
+    def __getitem__(self, object_idx):
+        shard, local_idx = self.locate(object_idx)
+        return self.datasets[shard][local_idx]
+
+    def read_batch(self, object_idx) -> dict:
+        shard, local_idx = self.locate(object_idx)
+        return self.datasets[shard].read_batch(local_idx)
+
+    def process_batch(self, raw: dict) -> tuple:
+        return self.datasets[0].process_batch(raw)
+
+
+class ShardWorkerDataset(IterableDataset):
+    def __init__(
+        self,
+        dataset: ShardedSaltDataset,
+        batch_size: int,
+        shuffle: bool = False,
+        drop_last: bool = False,
+    ):
+        """Iterable dataset which pins DataLoader workers to shards.
+
+        Batches are formed within each shard as in
+        [`salt.data.RandomBatchSampler`][salt.data.RandomBatchSampler].
+        Each worker then only reads batches from its own subset of the shards, so that
+        it keeps a small number of file handles and a warm chunk cache.
+        If there are more workers than shards, the batches of each shard are split
+        between the workers assigned to it.
+        Batches are first split between distributed ranks, with each rank receiving
+        the same number of batches.
+
+        Parameters
+        ----------
+        dataset : ShardedSaltDataset
+            Dataset to load batches from
+        batch_size : int
+            Number of objects in each batch
+        shuffle : bool, optional
+            Shuffle the batches within each worker, by default False
+        drop_last : bool, optional
+            Drop the incomplete last batch of each shard, by default False
+        """
+        super().__init__()
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __getattr__(self, name: str):
+        # expose the wrapped dataset's attributes, e.g. for callbacks
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def _batches(self) -> list[tuple[int, slice]]:
+        """Return the `(shard, batch)` pairs to be read on this rank."""
+        batches = []
+        for shard, (start, stop) in enumerate(self.dataset.shard_bounds):
+            for i in range(start, stop, self.batch_size):
+                if self.drop_last and i + self.batch_size > stop:
+                    continue
+                batches.append((shard, np.s_[i : min(i + self.batch_size, stop)]))
+
+        # ensure each rank processes the same number of batches
+        rank, world = ShuffleBufferDataset._rank()  # noqa: SLF001
+        return batches[: len(batches) // world * world][rank::world]
+
+    def __len__(self):
+        return len(self._batches())
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, num_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        num_shards = len(self.dataset.datasets)
+
+        # assign shards to workers, and share a shard's batches between its workers
+        if num_workers >= num_shards:
+            shards = {worker_id % num_shards}
+            stride = len(range(worker_id % num_shards, num_workers, num_shards))
+            offset = worker_id // num_shards
+        else:
+            shards = set(range(worker_id, num_shards, num_workers))
+            stride, offset = 1, 0
+        batches = [b for shard, b in self._batches() if shard in shards][offset::stride]
+
+        order = torch.randperm(len(batches)) if self.shuffle else torch.arange(len(batches))
+        for i in order:
+            yield self.dataset[batches[i]]
+
+
+def map_batch(fn, batch):
+    """Apply a function to each tensor in a batch of nested tuples and dicts."""
+    if isinstance(batch, dict):
+        return {k: map_batch(fn, v) for k, v in batch.items()}
+    if isinstance(batch, tuple | list):
+        return type(batch)(map_batch(fn, v) for v in batch)
+    return fn(batch)
+
+
+class DeviceDataset(IterableDataset):
+    def __init__(
+        self,
+        dataset: SaltDataset,
+        batch_size: int,
+        device: torch.device | str = "cpu",
+        shuffle: bool = False,
+        drop_last: bool = False,
+        chunk_size: int = 100_000,
+    ):
+        """Dataset held in memory on the training device, for models with only global inputs.
+
+        For models such as DL1, which only use a few variables of the global object,
+        reading, collating and transferring each batch in DataLoader workers costs
+        more than the training step itself. This dataset instead reads all inputs and
+        labels once, stores each in a single contiguous tensor on the device, and
+        serves batches by indexing these tensors with a random permutation each epoch.
+        It is iterated directly in the training process, without a DataLoader.
+
+        Each distributed rank only loads its own contiguous part of the dataset, with
+        the same number of objects on each rank.
+
+        Parameters
+        ----------
+        dataset : SaltDataset
+            Dataset to load, with only the global object as input type
+        batch_size : int
+            Number of objects in each batch
+        device : torch.device | str, optional
+            Device to hold the data on, by default "cpu"
+        shuffle : bool, optional
+            Shuffle the objects each epoch, by default False
+        drop_last : bool, optional
+            Drop the incomplete last batch, by default False
+        chunk_size : int, optional
+            Number of objects read from the dataset at once while loading,
+            by default 100_000
+        """
+        super().__init__()
+        groups = set(dataset.input_map.values())
+        groups |= {dataset.input_map.get(k, k) for k in dataset.labels}
+        if groups - {dataset.global_object}:
+            raise ValueError(
+                "Device-resident data can only be used with inputs and labels of the global"
+                f" object '{dataset.global_object}', not {sorted(groups)}."
+            )
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+        # ensure each rank processes the same number of batches
+        rank, world = ShuffleBufferDataset._rank()  # noqa: SLF001
+        self.num = len(dataset) // world
+        start, stop = rank * self.num, (rank + 1) * self.num
+        chunks = [
+            dataset[np.s_[i : min(i + chunk_size, stop)]] for i in range(start, stop, chunk_size)
+        ]
+        self.data = self.concat(chunks)
+
+    def __getattr__(self, name: str):
+        # expose the wrapped dataset's attributes, e.g. for callbacks
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def concat(self, chunks: list):
+        """Concatenate the batches read while loading, and move them to the device."""
+        first = chunks[0]
+        if isinstance(first, dict):
+            return {k: self.concat([c[k] for c in chunks]) for k in first}
+        if isinstance(first, tuple | list):
+            return type(first)(self.concat([c[i] for c in chunks]) for i in range(len(first)))
+        return torch.cat(chunks).to(self.device).contiguous()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num // self.batch_size
+        return math.ceil(self.num / self.batch_size)
+
+    def __iter__(self):
+        perm = torch.randperm(self.num, device=self.device) if self.shuffle else None
+        for i in range(len(self)):
+            idx = np.s_[i * self.batch_size : (i + 1) * self.batch_size]
+            if perm is not None:
+                idx = perm[idx]
+            yield map_batch(lambda x, idx=idx: x[idx], self.data)
+
+
+def check_half_range(
+    input_variables: Vars, input_map: dict[str, str], index: dict | None, norm_dict: str
+) -> None:
+    """Check that all input variables fit in the float16 range.
+
+    The range of each variable is taken from the index if available. Otherwise, it
+    is estimated as five standard deviations around the mean from the norm dict.
+    """
+    limit = np.finfo(np.float16).max
+    with open(norm_dict) as f:
+        norm = yaml.safe_load(f)
+    too_large = []
+    for input_name, variables in input_variables.items():
+        if input_name in {"EDGE", "PARAMETERS"} or not variables:
+            continue
+        name = input_map[input_name]
+        stats = (index or {}).get(name, {}).get("stats", {})
+        for v in variables:
+            if v in stats:
+                largest = max(-stats[v]["min"], stats[v]["max"])
+            elif (params := norm.get(name, {}).get(v)) is not None:
+                largest = abs(params["mean"]) + 5 * params["std"]
+            else:
+                continue
+            if largest > limit:
+                too_large.append(f"{name}.{v}")
+    if too_large:
+        raise ValueError(
+            f"Variables {too_large} exceed the float16 range of {limit:.0f}. Use"
+            " input_dtype='bfloat16', which has the range of float32, or rescale them."
+        )
+
+
 def get_dtype(ds, variables=None) -> np.dtype:
     """Return a dtype based on an existing dataset and requested variables."""
     if variables is None:
@@ -305,3 +1201,57 @@ def get_dtype(ds, variables=None) -> np.dtype:
             variables_flat.append(item)
 
     return np.dtype([(n, as_half(x)) for n, x in ds.dtype.descr if n in variables])
+
+
+def read_chunked(
+    ds: h5py.Dataset, buffer: np.ndarray, idx: np.ndarray, max_chunks: int = 64
+) -> np.ndarray:
+    """Gather a sorted set of rows from a chunked dataset.
+
+    Requested rows are grouped by the chunk they are stored in, and runs of
+    neighbouring chunks are read with a single contiguous read, such that each
+    chunk is decompressed at most once.
+
+    Parameters
+    ----------
+    ds : h5py.Dataset
+        Dataset to read from
+    buffer : np.ndarray
+        Structured array used as a read buffer, which also sets the output dtype
+    idx : np.ndarray
+        Sorted array of row indices to read
+    max_chunks : int, optional
+        Maximum number of neighbouring chunks to read at once, by default 64
+
+    Returns
+    -------
+    np.ndarray
+        Structured array containing the requested rows
+    """
+    # contiguous datasets can be read row by row without any read amplification
+    chunk_len = ds.chunks[0] if ds.chunks is not None else 1
+    out = np.empty((len(idx),) + ds.shape[1:], dtype=buffer.dtype)
+    if len(idx) == 0:
+        return out
+
+    # split the requested chunks into runs of at most max_chunks neighbouring chunks
+    chunk_ids = np.unique(idx // chunk_len)
+    run_starts = [0]
+    for i in range(1, len(chunk_ids)):
+        gap = chunk_ids[i] - chunk_ids[i - 1] > 1
+        if gap or chunk_ids[i] - chunk_ids[run_starts[-1]] >= max_chunks:
+            run_starts.append(i)
+    run_stops = [*run_starts[1:], len(chunk_ids)]
+
+    # read each run of chunks and select the requested rows
+    pos = 0
+    for first, last in zip(run_starts, run_stops, strict=True):
+        start = int(chunk_ids[first]) * chunk_len
+        stop = min((int(chunk_ids[last - 1]) + 1) * chunk_len, len(ds))
+        buffer.resize((stop - start,) + ds.shape[1:], refcheck=False)
+        ds.read_direct(buffer, np.s_[start:stop])
+        rows = idx[pos : pos + np.searchsorted(idx[pos:], stop)]
+        out[pos : pos + len(rows)] = buffer[rows - start]
+        pos += len(rows)
+
+    return out
@@ -4,6 +4,9 @@ import numpy as np
 
 from salt.utils.inputs import as_half
 
+# per-node columns used to compute edge features on device, see `salt.models.EdgeFeatures`
+EDGE_NODE_VARIABLES = ["eta", "phi", "pt", "subjetIndex", "valid"]
+
 
 def get_dtype_edge(ds, variables) -> np.dtype:
     """Return a dtype based on derived edge variables."""
@@ -81,3 +84,17 @@ def get_inputs_edge(batch, variables):
                 ebatch[:, :, :, i] = np.logical_and(np.equal(sji1, sji2), sji1 >= 0)
 
     return np.nan_to_num(ebatch, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def get_inputs_edge_nodes(batch):
+    """Return the per-node columns needed to compute edge features.
+
+    Columns which are not required for the requested edge features are set to zero,
+    and all nodes are treated as valid if there is no `valid` column.
+    """
+    nodes = np.zeros((*batch.shape, len(EDGE_NODE_VARIABLES)), dtype=np.float32)
+    nodes[..., EDGE_NODE_VARIABLES.index("valid")] = 1
+    for i, variable in enumerate(EDGE_NODE_VARIABLES):
+        if variable in batch.dtype.names:
+            nodes[..., i] = batch[variable]
+    return nodes
@@ -0,0 +1,227 @@
+"""Sidecar index of per-file statistics, built once by scanning an input file.
+
+The index records for each structured dataset in the file:
+
+- `multiplicity`: number of valid constituents for each object (2D datasets only)
+- `nonfinite_rows`: objects with a non-finite value in a valid entry of any field
+- `stats`: per-variable minimum, maximum and number of non-finite valid entries
+- `counts/<variable>`: value counts for integer variables of 1D datasets, such as
+  class labels, if they take at most `MAX_CLASSES` distinct values
+"""
+
+import argparse
+import itertools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+MAX_CLASSES = 256
+STATS_DTYPE = np.dtype([("variable", "S64"), ("min", "f8"), ("max", "f8"), ("nonfinite", "i8")])
+
+
+def get_index_path(filename: str | Path) -> Path:
+    """Return the default index path for an input file."""
+    return Path(f"{filename}.index")
+
+
+def scan_chunk(filename: str, name: str, start: int, stop: int) -> dict:
+    """Compute partial statistics for a range of objects in a dataset."""
+    with h5py.File(filename, "r") as f:
+        batch = f[name][start:stop]
+
+    valid = batch["valid"] if "valid" in batch.dtype.names else np.ones(batch.shape, bool)
+    result: dict = {"min": {}, "max": {}, "nonfinite": {}, "counts": {}}
+    bad_rows = np.zeros(len(batch), dtype=bool)
+    for var in batch.dtype.names:
+        x = batch[var]
+        if x.dtype.kind not in "biuf" or x.ndim != batch.ndim:
+            continue
+        if x.dtype.kind == "f":
+            bad = ~np.isfinite(x) & valid
+            bad_rows |= bad.reshape(len(batch), -1).any(-1)
+            result["nonfinite"][var] = int(bad.sum())
+            x = x[valid & ~bad]
+        else:
+            result["nonfinite"][var] = 0
+            x = x[valid]
+            if batch.ndim == 1 and x.dtype.kind in "iu":
+                values, counts = np.unique(x, return_counts=True)
+                if len(values) <= MAX_CLASSES:
+                    result["counts"][var] = dict(zip(values.tolist(), counts.tolist(), strict=True))
+                else:
+                    result["counts"][var] = None
+        result["min"][var] = float(x.min()) if x.size else np.inf
+        result["max"][var] = float(x.max()) if x.size else -np.inf
+
+    result["nonfinite_rows"] = start + np.flatnonzero(bad_rows)
+    if batch.ndim == 2 and "valid" in batch.dtype.names:
+        result["multiplicity"] = valid.sum(-1).astype(np.int32)
+    return result
+
+
+def merge_chunks(parts: list[dict]) -> dict:
+    """Combine the partial statistics of consecutive chunks of a dataset."""
+    merged: dict = {"min": {}, "max": {}, "nonfinite": {}, "counts": {}}
+    for part in parts:
+        for var, value in part["min"].items():
+            merged["min"][var] = min(merged["min"].get(var, np.inf), value)
+            merged["max"][var] = max(merged["max"].get(var, -np.inf), part["max"][var])
+            merged["nonfinite"][var] = merged["nonfinite"].get(var, 0) + part["nonfinite"][var]
+        for var, counts in part["counts"].items():
+            total = merged["counts"].setdefault(var, {})
+            if counts is None or total is None:
+                merged["counts"][var] = None
+                continue
+            for value, count in counts.items():
+                total[value] = total.get(value, 0) + count
+    merged["counts"] = {
+        k: v for k, v in merged["counts"].items() if v is not None and len(v) <= MAX_CLASSES
+    }
+    merged["nonfinite_rows"] = np.concatenate([p["nonfinite_rows"] for p in parts])
+    if parts and "multiplicity" in parts[0]:
+        merged["multiplicity"] = np.concatenate([p["multiplicity"] for p in parts])
+    return merged
+
+
+def build_index(
+    filename: str | Path,
+    output: str | Path | None = None,
+    chunk_size: int = 100_000,
+    num_workers: int = 1,
+) -> Path:
+    """Scan an input file once and write its statistics to a sidecar index file.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Input h5 file
+    output : str | Path | None, optional
+        Output path, by default `<filename>.index`
+    chunk_size : int, optional
+        Number of objects to read at once, by default 100_000
+    num_workers : int, optional
+        Number of processes used to scan the file, by default 1
+
+    Returns
+    -------
+    Path
+        Path to the index file
+    """
+    filename = Path(filename)
+    output = Path(output) if output is not None else get_index_path(filename)
+    with h5py.File(filename, "r") as f:
+        names = [
+            k
+            for k, ds in f.items()
+            if isinstance(ds, h5py.Dataset) and ds.dtype.names is not None and ds.ndim in {1, 2}
+        ]
+        lengths = {name: len(f[name]) for name in names}
+
+    tasks = [
+        (str(filename), name, start, min(start + chunk_size, length))
+        for name, length in lengths.items()
+        for start in range(0, length, chunk_size)
+    ]
+    if num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as pool:
+            results = list(pool.map(scan_chunk, *zip(*tasks, strict=True)))
+    else:
+        results = list(itertools.starmap(scan_chunk, tasks))
+
+    tmp = output.with_name(f".{output.name}.tmp")
+    stat = filename.stat()
+    with h5py.File(tmp, "w") as f:
+        f.attrs["source"] = str(filename.resolve())
+        f.attrs["size"] = stat.st_size
+        f.attrs["mtime_ns"] = stat.st_mtime_ns
+        for name in names:
+            merged = merge_chunks([r for t, r in zip(tasks, results, strict=True) if t[1] == name])
+            g = f.create_group(name)
+            g.attrs["length"] = lengths[name]
+            g.create_dataset("nonfinite_rows", data=merged["nonfinite_rows"].astype(np.int64))
+            if "multiplicity" in merged:
+                g.create_dataset("multiplicity", data=merged["multiplicity"])
+            stats = np.array(
+                [
+                    (var, merged["min"][var], merged["max"][var], merged["nonfinite"][var])
+                    for var in merged["min"]
+                ],
+                dtype=STATS_DTYPE,
+            )
+            g.create_dataset("stats", data=stats)
+            counts = g.create_group("counts")
+            for var, values in merged["counts"].items():
+                data = np.array(sorted(values.items()), dtype=[("value", "i8"), ("count", "i8")])
+                counts.create_dataset(var, data=data)
+    tmp.replace(output)
+    return output
+
+
+def load_index(filename: str | Path, index_file: str | Path | None = None) -> dict | None:
+    """Load the sidecar index for an input file.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Input h5 file
+    index_file : str | Path | None, optional
+        Path to the index, by default `<filename>.index`
+
+    Returns
+    -------
+    dict | None
+        For each dataset, a dict with the `multiplicity` (if present), `nonfinite_rows`,
+        `stats` and `counts` arrays. None if there is no index, or if it is out of date
+        with respect to the input file.
+    """
+    path = Path(index_file) if index_file is not None else get_index_path(filename)
+    if not path.exists():
+        if index_file is not None:
+            raise FileNotFoundError(f"Index file {path} does not exist.")
+        return None
+
+    stat = Path(filename).stat()
+    with h5py.File(path, "r") as f:
+        if (f.attrs["size"], f.attrs["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            warnings.warn(
+                f"Ignoring index {path}, which is out of date with {filename}. Rebuild it"
+                " with `build_index`.",
+                stacklevel=2,
+            )
+            return None
+        index = {}
+        for name, g in f.items():
+            stats = g["stats"][:]
+            index[name] = {
+                "nonfinite_rows": g["nonfinite_rows"][:],
+                "stats": {
+                    v.decode(): {"min": lo, "max": hi, "nonfinite": n} for v, lo, hi, n in stats
+                },
+                "counts": {k: dict(v[:].tolist()) for k, v in g["counts"].items()},
+            }
+            if "multiplicity" in g:
+                index[name]["multiplicity"] = g["multiplicity"][:]
+    return index
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Scan salt input files once and write a sidecar index of their statistics."
+    )
+    parser.add_argument("files", nargs="+", help="Input h5 files to index.")
+    parser.add_argument("-o", "--output", help="Output path, only for a single input file.")
+    parser.add_argument("-c", "--chunk_size", type=int, default=100_000)
+    parser.add_argument("-n", "--num_workers", type=int, default=1)
+    args = parser.parse_args(args)
+    if args.output and len(args.files) > 1:
+        parser.error("--output can only be used with a single input file")
+    for fname in args.files:
+        path = build_index(fname, args.output, args.chunk_size, args.num_workers)
+        print(f"Wrote index for {fname} to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Compute normalisation and class weight dictionaries directly from input files.
+
+Means and standard deviations are accumulated over valid, finite entries of each
+numeric variable, chunk by chunk, and partial results are combined with the parallel
+variance algorithm of Chan et al. The results of each file are saved alongside the
+output in a state file, so that new files can be added later without reprocessing old
+ones, and files which have been modified since are scanned again and replace their
+earlier results.
+"""
+
+import argparse
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import h5py
+import numpy as np
+import yaml
+
+from salt.data.readers import expand_shards
+
+
+def scan_chunk(
+    filename: str, name: str, start: int, stop: int, class_labels: list[str]
+) -> tuple[dict, dict]:
+    """Return running moments of each variable and class label counts for a chunk.
+
+    Returns
+    -------
+    tuple[dict, dict]
+        Dict of `[count, mean, m2]` for each variable, where `m2` is the sum of
+        squared deviations from the mean, and dict of per-class counts for each label
+    """
+    with h5py.File(filename, "r") as f:
+        batch = f[name][start:stop]
+    valid = batch["valid"] if "valid" in batch.dtype.names else np.ones(batch.shape, bool)
+
+    moments = {}
+    for var in batch.dtype.names:
+        x = batch[var]
+        if var == "valid" or x.dtype.kind not in "biuf" or x.ndim != batch.ndim:
+            continue
+        x = x[valid].astype(np.float64)
+        x = x[np.isfinite(x)]
+        mean = float(x.mean()) if x.size else 0.0
+        moments[var] = [int(x.size), mean, float(np.square(x - mean).sum())]
+
+    counts = {}
+    for label in class_labels:
+        x = batch[label][valid]
+        if x.size and x.min() < 0:
+            raise ValueError(f"Negative values found for class label {name}.{label}.")
+        counts[label] = np.bincount(x.astype(np.int64)).tolist()
+    return moments, counts
+
+
+def merge_moments(a: list, b: list) -> list:
+    """Merge two sets of `[count, mean, m2]` running moments."""
+    n = a[0] + b[0]
+    if n == 0:
+        return [0, 0.0, 0.0]
+    delta = b[1] - a[1]
+    mean = a[1] + delta * b[0] / n
+    m2 = a[2] + b[2] + delta**2 * a[0] * b[0] / n
+    return [n, mean, m2]
+
+
+def merge_counts(a: list, b: list) -> list:
+    """Add two lists of per-class counts."""
+    length = max(len(a), len(b))
+    return (np.pad(a, (0, length - len(a))) + np.pad(b, (0, length - len(b)))).tolist()
+
+
+def merge_into(totals: dict, values: dict, merge) -> None:
+    """Merge the moments or counts of each variable in `values` into `totals`."""
+    for var, v in values.items():
+        totals[var] = merge(totals[var], v) if var in totals else v
+
+
+def file_id(filename: str) -> list:
+    """Identify a file by its resolved path, size and modification time."""
+    path = Path(filename).resolve()
+    stat = path.stat()
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+def build_norm_dict(
+    files: list[str],
+    norm_dict: str | Path,
+    class_dict: str | Path | None = None,
+    class_labels: list[str] | None = None,
+    datasets: list[str] | None = None,
+    chunk_size: int = 100_000,
+    num_workers: int = 1,
+) -> dict:
+    """Compute the normalisation and class weight dictionaries for a set of files.
+
+    If a state file from a previous run exists (`<norm_dict>.state.json`), files which
+    have already been processed are skipped, and the new files are added to the totals.
+    Files which have been modified since they were processed are scanned again, and
+    their new results replace the old ones.
+
+    Parameters
+    ----------
+    files : list[str]
+        Input h5 files or glob patterns
+    norm_dict : str | Path
+        Output path for the normalisation dictionary
+    class_dict : str | Path | None, optional
+        Output path for the class weight dictionary, by default None
+    class_labels : list[str] | None, optional
+        Labels to compute class weights for, as `<dataset>.<label>`, by default None
+    datasets : list[str] | None, optional
+        Datasets to process, by default all structured datasets in each file
+    chunk_size : int, optional
+        Number of objects to read at once, by default 100_000
+    num_workers : int, optional
+        Number of processes used to read the files, by default 1
+
+    Returns
+    -------
+    dict
+        The accumulated state, containing the running moments and class counts of each
+        processed file, and their totals for each dataset
+    """
+    norm_dict = Path(norm_dict)
+    state_path = norm_dict.with_name(f"{norm_dict.name}.state.json")
+    config = {"class_labels": sorted(class_labels or []), "datasets": datasets}
+    state: dict = {"config": config, "files": {}, "moments": {}, "counts": {}}
+    if state_path.exists():
+        with open(state_path) as f:
+            state = json.load(f)
+        if state["config"] != config or not isinstance(state["files"], dict):
+            raise ValueError(
+                f"The datasets and class labels {config} don't match those used to create"
+                f" {state_path}: {state['config']}, or it was created by an earlier version."
+                " Remove it to start from scratch."
+            )
+
+    labels: dict = {}
+    for label in class_labels or []:
+        ds_name, var = label.split(".", 1)
+        labels.setdefault(ds_name, []).append(var)
+    if datasets is not None and (missing := set(labels) - set(datasets)):
+        raise ValueError(f"Datasets {missing} used for class labels are not being processed.")
+
+    filenames = [file_id(fname)[0] for pattern in files for fname in expand_shards(pattern)]
+    filenames = list(dict.fromkeys(filenames))
+    # files which are new, or have been modified since they were processed
+    new_files = [
+        fname
+        for fname in filenames
+        if fname not in state["files"] or state["files"][fname]["id"] != file_id(fname)
+    ]
+    tasks = []
+    for fname in new_files:
+        with h5py.File(fname, "r") as f:
+            names = datasets
+            if names is None:
+                names = [k for k, v in f.items() if isinstance(v, h5py.Dataset) and v.dtype.names]
+            for name in names:
+                n = len(f[name])
+                tasks += [
+                    (fname, name, s, min(s + chunk_size, n), labels.get(name, []))
+                    for s in range(0, n, chunk_size)
+                ]
+
+    if tasks and num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as pool:
+            results = list(pool.map(scan_chunk, *zip(*tasks, strict=True)))
+    else:
+        results = list(itertools.starmap(scan_chunk, tasks))
+
+    for fname in new_files:
+        state["files"][fname] = {"id": file_id(fname), "moments": {}, "counts": {}}
+    for (fname, name, *_), (moments, counts) in zip(tasks, results, strict=True):
+        merge_into(state["files"][fname]["moments"].setdefault(name, {}), moments, merge_moments)
+        merge_into(state["files"][fname]["counts"].setdefault(name, {}), counts, merge_counts)
+
+    # rebuild the totals from the results of each file
+    state["moments"], state["counts"] = {}, {}
+    for fname in sorted(state["files"]):
+        for key, merge in (("moments", merge_moments), ("counts", merge_counts)):
+            for name, values in state["files"][fname][key].items():
+                merge_into(state[key].setdefault(name, {}), values, merge)
+
+    # write outputs, using the same layout as the preprocessing. Variables without values
+    # or without variance are given a unit std, which InputNorm accepts
+    nd = {
+        name: {
+            var: {"mean": m[1], "std": float(np.sqrt(m[2] / m[0])) if m[0] and m[2] else 1.0}
+            for var, m in moments.items()
+        }
+        for name, moments in state["moments"].items()
+    }
+    with open(norm_dict, "w") as f:
+        yaml.dump(nd, f, sort_keys=False)
+    if class_dict is not None:
+        cd = {
+            name: {var: get_class_weights(c) for var, c in counts.items()}
+            for name, counts in state["counts"].items()
+            if counts
+        }
+        with open(class_dict, "w") as f:
+            yaml.dump(cd, f, sort_keys=False)
+    with open(state_path, "w") as f:
+        json.dump(state, f)
+    return state
+
+
+def get_class_weights(counts: list) -> list[float]:
+    """Weight each class by the inverse of its frequency, relative to the most common class.
+
+    Classes which do not appear are given a weight of zero.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if not counts.size:
+        return []
+    weights = np.divide(counts.max(), counts, out=np.zeros_like(counts), where=counts > 0)
+    return weights.tolist()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Compute the norm_dict and class_dict for a set of salt input files."
+    )
+    parser.add_argument("files", nargs="+", help="Input h5 files or glob patterns.")
+    parser.add_argument("-n", "--norm_dict", required=True, help="Output norm_dict path.")
+    parser.add_argument("-c", "--class_dict", help="Output class_dict path.")
+    parser.add_argument(
+        "-l",
+        "--class_labels",
+        nargs="+",
+        default=[],
+        help="Labels to compute class weights for, e.g. jets.flavour_label.",
+    )
+    parser.add_argument("-d", "--datasets", nargs="+", help="Datasets to process.")
+    parser.add_argument("--chunk_size", type=int, default=100_000)
+    parser.add_argument("--num_workers", type=int, default=1)
+    args = parser.parse_args(args)
+    if args.class_labels and not args.class_dict:
+        parser.error("--class_labels requires --class_dict")
+    state = build_norm_dict(
+        args.files,
+        args.norm_dict,
+        args.class_dict,
+        args.class_labels,
+        args.datasets,
+        args.chunk_size,
+        args.num_workers,
+    )
+    print(f"Wrote {args.norm_dict} using {len(state['files'])} files")
+
+
+if __name__ == "__main__":
+    main()
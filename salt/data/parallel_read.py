@@ -0,0 +1,134 @@
+"""Read slices of chunked h5 datasets with a pool of threads."""
+
+import itertools
+import math
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+# filters which can be decoded outside of HDF5
+SUPPORTED_FILTERS = {h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE}
+
+
+def has_native_layout(ds: h5py.Dataset) -> bool:
+    """Return whether the stored elements of a dataset are laid out as its native dtype.
+
+    Raw chunk bytes are in the stored layout, which may differ from the native, packed
+    dtype in byte order or in the offsets of compound fields.
+    """
+    native = ds.dtype.newbyteorder("=")
+    if native.names is not None:
+        native = np.dtype([(name, native[name]) for name in native.names])
+    return ds.id.get_type().equal(h5py.h5t.py_create(native))
+
+
+def get_filters(ds: h5py.Dataset) -> list[int] | None:
+    """Return the filter pipeline of a dataset if its chunks can be decoded directly.
+
+    Returns None for contiguous datasets, for datasets using unsupported filters and for
+    datasets which are not stored in their native layout, which must be read through
+    HDF5.
+    """
+    if ds.chunks is None or ds.dtype.hasobject or not has_native_layout(ds):
+        return None
+    plist = ds.id.get_create_plist()
+    filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+    if not set(filters).issubset(SUPPORTED_FILTERS):
+        return None
+    return filters
+
+
+def decode_chunk(ds: h5py.Dataset, offset: tuple, filters: list[int]) -> np.ndarray:
+    """Read a single raw chunk and undo the filter pipeline.
+
+    Only the raw read holds the h5py lock, decompression runs without the GIL.
+    """
+    filter_mask, data = ds.id.read_direct_chunk(offset)
+    itemsize = ds.dtype.itemsize
+    for i, f in reversed(list(enumerate(filters))):
+        if filter_mask & (1 << i):
+            continue
+        if f == h5py.h5z.FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif f == h5py.h5z.FILTER_SHUFFLE and itemsize > 1:
+            data = np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.tobytes()
+    return np.frombuffer(data, dtype=ds.dtype).reshape(ds.chunks)
+
+
+def read_slice(ds: h5py.Dataset, out: np.ndarray, sel: slice, start: int) -> None:
+    """Read rows `sel` of a dataset into `out`, where `out[0]` corresponds to row `start`.
+
+    Only the fields of `out` are copied. Chunks are decoded directly where possible,
+    otherwise the read goes through HDF5.
+    """
+    dest = np.s_[sel.start - start : sel.stop - start]
+    filters = get_filters(ds)
+    if filters is None:
+        ds.read_direct(out, sel, dest)
+        return
+
+    # loop over all chunks overlapping the selection, including along inner dimensions
+    first = sel.start - sel.start % ds.chunks[0]
+    ranges = [range(first, sel.stop, ds.chunks[0])]
+    ranges += [range(0, n, c) for n, c in zip(ds.shape[1:], ds.chunks[1:], strict=True)]
+    for offset in itertools.product(*ranges):
+        try:
+            chunk = decode_chunk(ds, offset, filters)
+        except RuntimeError:
+            # unallocated chunk, let HDF5 fill it
+            ds.read_direct(out, sel, dest)
+            return
+        rows = slice(max(sel.start, offset[0]), min(sel.stop, offset[0] + ds.chunks[0]))
+        src = (slice(rows.start - offset[0], rows.stop - offset[0]),)
+        dst = (slice(rows.start - start, rows.stop - start),)
+        for o, c, n in zip(offset[1:], ds.chunks[1:], ds.shape[1:], strict=True):
+            src += (slice(0, min(c, n - o)),)
+            dst += (slice(o, o + c),)
+        for name in out.dtype.names:
+            out[name][dst] = chunk[name][src]
+
+
+def split_slice(ds: h5py.Dataset, sel: slice, num: int) -> list[slice]:
+    """Split a slice into at most `num` parts, aligned to chunk boundaries."""
+    chunk_len = ds.chunks[0] if ds.chunks is not None else 1
+    first, last = sel.start // chunk_len, (sel.stop - 1) // chunk_len + 1
+    per_part = math.ceil((last - first) / num)
+    bounds = [sel.start]
+    bounds += [c * chunk_len for c in range(first + per_part, last, per_part)]
+    bounds += [sel.stop]
+    return list(itertools.starmap(slice, itertools.pairwise(bounds)))
+
+
+def submit_read(
+    pool: ThreadPoolExecutor, ds: h5py.Dataset, dtype: np.dtype, sel: slice, num_parts: int
+) -> tuple[np.ndarray, list[Future]]:
+    """Schedule a read of a slice of a dataset, split into chunk-aligned parts.
+
+    Parameters
+    ----------
+    pool : ThreadPoolExecutor
+        Pool used to read and decode the parts
+    ds : h5py.Dataset
+        Dataset to read from
+    dtype : np.dtype
+        Structured dtype of the output, containing a subset of the dataset fields
+    sel : slice
+        Rows to read
+    num_parts : int
+        Maximum number of parts to split the read into
+
+    Returns
+    -------
+    tuple[np.ndarray, list[Future]]
+        Output array, which is filled once all of the futures have completed
+    """
+    out = np.empty((sel.stop - sel.start,) + ds.shape[1:], dtype=dtype)
+    if sel.stop <= sel.start:
+        return out, []
+    futures = [
+        pool.submit(read_slice, ds, out, part, sel.start)
+        for part in split_slice(ds, sel, num_parts)
+    ]
+    return out, futures
@@ -0,0 +1,265 @@
+"""Warm the page cache with the chunks of upcoming batches.
+
+The batch sampler is iterated in the main process, which sends each batch to a worker.
+`ReadaheadSampler` wraps a sampler and, in a background thread, advises the kernel
+to read the HDF5 chunks of the next few batches into the page cache before the
+workers request them. The thread follows the batches received from the dataloader,
+as the sampler itself may be iterated ahead of the workers, or all at once.
+On cold-cache epochs, particularly on network filesystems, this overlaps the disk
+reads with training.
+"""
+
+import itertools
+import math
+import os
+import threading
+
+import h5py
+import numpy as np
+from torch.utils.data import Sampler
+
+from salt.data.readers import get_format
+from salt.data.remote import is_remote
+from salt.data.samplers import split_batches
+
+
+class ChunkRanges:
+    def __init__(self, dataset):
+        """Find the byte ranges of the chunks read for a batch.
+
+        Parameters
+        ----------
+        dataset
+            A [`salt.data.SaltDataset`][salt.data.SaltDataset] or
+            [`salt.data.ShardedSaltDataset`][salt.data.ShardedSaltDataset]
+        """
+        self.dataset = dataset
+        self.files: dict = {}
+
+    def open(self, ds) -> tuple | None:
+        """Return the h5 file and file descriptor of a shard, or None if it is not local."""
+        filename = ds.filename
+        if is_remote(filename) or get_format(filename) != "hdf5":
+            return None
+        if filename not in self.files:
+            self.files[filename] = (h5py.File(filename, "r"), os.open(filename, os.O_RDONLY))
+        return self.files[filename]
+
+    def locate(self, object_idx) -> tuple:
+        """Return the shard and the rows in its file read for a batch."""
+        if hasattr(self.dataset, "locate"):
+            shard, object_idx = self.dataset.locate(object_idx)
+            ds = self.dataset.datasets[shard]
+        else:
+            ds = self.dataset
+        if ds.selection is not None:
+            object_idx = ds.selection[object_idx]
+        return ds, object_idx
+
+    def __call__(self, object_idx) -> tuple[int, list[tuple[int, int]]]:
+        """Return the file descriptor and the `(offset, length)` ranges of a batch."""
+        ds, rows = self.locate(object_idx)
+        opened = self.open(ds)
+        if opened is None:
+            return -1, []
+        f, fd = opened
+        names = {ext for name, ext in ds.input_map.items() if name not in ds.cache and ext in f}
+        ranges = []
+        for name in sorted(names):
+            ranges += get_byte_ranges(f[name], rows)
+        return fd, ranges
+
+    def close(self):
+        for f, fd in self.files.values():
+            f.close()
+            os.close(fd)
+        self.files = {}
+
+
+def get_byte_ranges(ds: h5py.Dataset, rows) -> list[tuple[int, int]]:
+    """Return the `(offset, length)` byte ranges in the file holding some rows of a dataset.
+
+    Parameters
+    ----------
+    ds : h5py.Dataset
+        Dataset to read from
+    rows
+        Slice or sorted array of row indices
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        Byte ranges, which are empty for compact datasets and unallocated chunks
+    """
+    if isinstance(rows, slice):
+        first, last = rows.start, rows.stop - 1
+    else:
+        if not len(rows):
+            return []
+        first, last = int(rows[0]), int(rows[-1])
+    if ds.chunks is None:
+        offset = ds.id.get_offset()
+        if offset is None:
+            return []
+        row_nbytes = ds.dtype.itemsize * math.prod(ds.shape[1:])
+        return [(offset + first * row_nbytes, (last + 1 - first) * row_nbytes)]
+
+    chunk_len = ds.chunks[0]
+    if isinstance(rows, slice):
+        chunk_ids = range(first // chunk_len, last // chunk_len + 1)
+    else:
+        chunk_ids = np.unique(np.asarray(rows) // chunk_len).tolist()
+    others = [range(0, s, c) for s, c in zip(ds.shape[1:], ds.chunks[1:], strict=True)]
+    ranges = []
+    for chunk_id, other in itertools.product(chunk_ids, itertools.product(*others)):
+        info = ds.id.get_chunk_info_by_coord((chunk_id * chunk_len, *other))
+        if info.byte_offset is not None:
+            ranges.append((info.byte_offset, info.size))
+    return ranges
+
+
+def advise(fd: int, ranges: list[tuple[int, int]]) -> int:
+    """Ask the kernel to read byte ranges of a file into the page cache.
+
+    Where `posix_fadvise` is not available, the ranges are read and discarded.
+
+    Returns
+    -------
+    int
+        Number of bytes advised
+    """
+    nbytes = 0
+    for offset, length in ranges:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        else:
+            os.pread(fd, length, offset)
+        nbytes += length
+    return nbytes
+
+
+class ReadaheadSampler(Sampler):
+    def __init__(
+        self,
+        sampler: Sampler,
+        dataset,
+        depth: int = 8,
+        prefetch: int = 0,
+        rank: int = 0,
+        num_replicas: int = 1,
+    ):
+        """Wrap a batch sampler to warm the page cache with the chunks of upcoming batches.
+
+        At the start of each epoch, a background thread is started which advises the
+        chunks of the batches this rank will read, up to `depth` batches ahead of those
+        already requested by the workers. The workers' progress is followed through
+        [`advance`][salt.data.ReadaheadSampler.advance], which must be called once
+        for each batch received from the dataloader. The sampler itself may be iterated
+        all at once, as Lightning's distributed sampler wrapper does.
+
+        The thread only uses the main process, and works with any sampler yielding
+        slices or sorted arrays of object indices. Remote and zarr inputs, and cached
+        input types, are skipped.
+
+        The `stats` attribute counts the batches requested by the workers, the batches
+        which were advised before the workers requested them (`ahead`), and the number
+        of bytes advised. Whether the advised chunks were still in the page cache when
+        they were read is not measured.
+
+        Parameters
+        ----------
+        sampler : Sampler
+            Batch sampler to wrap, e.g.
+            [`salt.data.RandomBatchSampler`][salt.data.RandomBatchSampler]
+        dataset
+            The dataset the batches are read from
+        depth : int, optional
+            Number of batches to read ahead of the workers, by default 8
+        prefetch : int, optional
+            Number of batches requested by the workers before they are received from
+            the dataloader, i.e. `num_workers * prefetch_factor`, by default 0
+        rank : int, optional
+            Rank of this process, by default 0
+        num_replicas : int, optional
+            If the batches are split between ranks by a
+            `torch.utils.data.DistributedSampler`, the number of ranks, by default 1
+        """
+        self.sampler = sampler
+        self.dataset = dataset
+        self.depth = depth
+        self.prefetch = prefetch
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.stats = {"batches": 0, "ahead": 0, "bytes": 0}
+        self.received = 0
+        self.cond = threading.Condition()
+        self.stop_event: threading.Event | None = None
+        self.thread: threading.Thread | None = None
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def __iter__(self):
+        batches = list(self.sampler)
+        self.start(split_batches(batches, self.rank, self.num_replicas))
+        yield from batches
+
+    @property
+    def requested(self) -> int:
+        """Number of batches of the epoch which the workers have been asked for."""
+        return self.received + self.prefetch
+
+    def start(self, batches: list):
+        """Start advising the batches read by this rank in an epoch."""
+        self.close()
+        with self.cond:
+            self.received = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, args=(batches, self.stop_event), daemon=True
+        )
+        self.thread.start()
+
+    def advance(self):
+        """Record that a batch has been received from the dataloader."""
+        with self.cond:
+            self.received += 1
+            self.cond.notify()
+
+    def close(self):
+        """Stop the background thread."""
+        if self.thread is None:
+            return
+        with self.cond:
+            self.stop_event.set()
+            self.cond.notify()
+        self.thread.join()
+        self.thread = None
+
+    def run(self, batches: list, stop: threading.Event):
+        ranges = ChunkRanges(self.dataset)
+        try:
+            for i, batch in enumerate(batches):
+                with self.cond:
+                    self.cond.wait_for(lambda i=i: stop.is_set() or i < self.requested + self.depth)
+                    if stop.is_set():
+                        return
+                    self.stats["batches"] += 1
+                    if i < self.requested:
+                        # already requested, too late to help
+                        continue
+                fd, byte_ranges = ranges(batch)
+                self.stats["bytes"] += advise(fd, byte_ranges)
+                with self.cond:
+                    self.stats["ahead"] += int(i >= self.requested)
+        finally:
+            ranges.close()
+
+    def report(self) -> str:
+        """Return a summary of the readahead counters."""
+        s = self.stats
+        rate = s["ahead"] / s["batches"] if s["batches"] else float("nan")
+        return (
+            f"Readahead: {s['ahead']:,} of {s['batches']:,} batches ({rate:.1%}) were advised"
+            f" before the workers requested them, {s['bytes'] / 1024**2:,.1f} MiB advised"
+        )
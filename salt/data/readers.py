@@ -0,0 +1,200 @@
+"""Readers for the input file formats supported by salt.
+
+HDF5 files are read with h5py. Zarr stores, written with `to_zarr`, keep each variable
+of a structured dataset as its own compressed array, so that only the requested
+variables are read and decompressed. They are wrapped in `ZarrFile` and `ZarrDataset`,
+which provide the subset of the `h5py.File` and `h5py.Dataset` interfaces used by
+[`salt.data.SaltDataset`][salt.data.SaltDataset].
+"""
+
+import glob
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from salt.data.remote import RemoteFile, is_remote
+
+FORMATS = {".h5": "hdf5", ".hdf5": "hdf5", ".zarr": "zarr"}
+
+
+def get_format(filename: str | Path) -> str:
+    """Return the format of an input file from its suffix, by default `hdf5`."""
+    return FORMATS.get(Path(filename).suffix, "hdf5")
+
+
+def expand_shards(filename: str | list[str]) -> list[str]:
+    """Expand a glob pattern or list of glob patterns into a sorted list of files."""
+    patterns = [filename] if isinstance(filename, str | Path) else list(filename)
+    filenames = []
+    for pattern in map(str, patterns):
+        if glob.has_magic(pattern):
+            filenames += sorted(glob.glob(pattern))  # noqa: PTH207
+        else:
+            filenames.append(pattern)
+    if not filenames:
+        raise FileNotFoundError(f"No input files found matching {filename}.")
+    return filenames
+
+
+def import_zarr():
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError(
+            "Reading and writing zarr inputs requires the zarr package, which must be installed"
+            " separately with `pip install 'zarr<3'`."
+        ) from e
+    return zarr
+
+
+def open_file(
+    filename: str | Path, num_threads: int = 0, remote_options: dict | None = None, **kwargs
+):
+    """Open an input file for reading.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Path to an h5 file, or a zarr store ending in `.zarr`. Remote h5 files, such
+        as `s3://bucket/file.h5`, are streamed with `salt.data.remote.RemoteFile`
+    num_threads : int, optional
+        Number of threads used to read the variables of a zarr dataset concurrently,
+        by default 0, which reads them one after another
+    remote_options : dict | None, optional
+        Keyword arguments for `salt.data.remote.RemoteFile`, by default None
+    **kwargs
+        Keyword arguments for `h5py.File`, such as the chunk cache settings. These are
+        ignored for zarr stores, which do not have a chunk cache
+
+    Returns
+    -------
+    h5py.File | ZarrFile
+        The opened file
+    """
+    if get_format(filename) == "zarr":
+        return ZarrFile(filename, num_threads)
+    if is_remote(filename):
+        filename = RemoteFile(str(filename), **(remote_options or {}))
+    return h5py.File(filename, "r", **kwargs)
+
+
+def is_dataset(obj) -> bool:
+    """Return True if an object read from an input file is a dataset."""
+    return isinstance(obj, h5py.Dataset | ZarrDataset)
+
+
+class ZarrFile:
+    def __init__(self, filename: str | Path, num_threads: int = 0):
+        """Read-only zarr store with a structured dataset in each top-level group.
+
+        Parameters
+        ----------
+        filename : str | Path
+            Path to the zarr store
+        num_threads : int, optional
+            Number of threads used to read the variables of a dataset concurrently.
+            Blosc only uses its own threads when called from the main thread, so each
+            variable is then decompressed by a single thread. By default 0
+        """
+        zarr = import_zarr()
+        self.filename = str(filename)
+        self.group = zarr.open_group(self.filename, mode="r")
+        self.attrs = dict(self.group.attrs)
+        self.pool = ThreadPoolExecutor(num_threads) if num_threads else None
+
+    def keys(self) -> list[str]:
+        return [k for k in self.group.group_keys() if "fields" in self.group[k].attrs]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.keys()
+
+    def __getitem__(self, name: str) -> "ZarrDataset":
+        return ZarrDataset(self.group[name], name, self.pool)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ZarrDataset:
+    def __init__(self, group, name: str, pool: ThreadPoolExecutor | None = None):
+        """Structured dataset stored as one zarr array per variable.
+
+        Parameters
+        ----------
+        group : zarr.Group
+            Group containing an array for each variable, with the ordered variable
+            names and the number of dimensions of the dataset in its attributes
+        name : str
+            Name of the dataset
+        pool : ThreadPoolExecutor | None, optional
+            Pool used to read variables concurrently, by default None
+        """
+        self.name = f"/{name}"
+        self.pool = pool
+        self.ndim = group.attrs["ndim"]
+        self.attrs = dict(group.attrs.get("attrs", {}))
+        self.columns = {n: group[n] for n in group.attrs["fields"]}
+        self.dtype = np.dtype([(n, c.dtype, c.shape[self.ndim :]) for n, c in self.columns.items()])
+        first = next(iter(self.columns.values()))
+        self.shape = first.shape[: self.ndim]
+        self.chunks = first.chunks[: self.ndim]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_columns(self, names: list[str], sel) -> list[np.ndarray]:
+        """Read the given variables for a slice or sorted array of rows."""
+
+        def read(column):
+            return column.oindex[sel] if isinstance(sel, np.ndarray) else column[sel]
+
+        columns = [self.columns[n] for n in names]
+        if self.pool is not None and len(columns) > 1:
+            return list(self.pool.map(read, columns))
+        return [read(c) for c in columns]
+
+    def read(self, names: list[str], sel) -> np.ndarray:
+        """Read a structured array with only the given variables."""
+        columns = self.read_columns(names, sel)
+        shape = columns[0].shape[: columns[0].ndim - len(self.dtype[names[0]].shape)]
+        out = np.empty(shape, dtype=[(n, self.dtype[n]) for n in names])
+        for n, column in zip(names, columns, strict=True):
+            out[n] = column
+        return out
+
+    def __getitem__(self, sel) -> np.ndarray:
+        return self.read(list(self.dtype.names), sel)
+
+    def fields(self, names: str | list[str]) -> "ZarrFields":
+        return ZarrFields(self, names)
+
+    def read_direct(self, dest: np.ndarray, source_sel=None):
+        """Read the variables in the dtype of `dest` into it, converting their types."""
+        names = list(dest.dtype.names)
+        sel = slice(None) if source_sel is None else source_sel
+        for n, column in zip(names, self.read_columns(names, sel), strict=True):
+            dest[n] = column
+
+
+class ZarrFields:
+    def __init__(self, ds: ZarrDataset, names: str | list[str]):
+        """Projection of a `ZarrDataset` onto some of its variables, as `h5py.Dataset.fields`."""
+        self.ds = ds
+        self.names = names
+
+    def __getitem__(self, sel) -> np.ndarray:
+        if isinstance(self.names, str):
+            return self.ds.read_columns([self.names], sel)[0]
+        return self.ds.read(list(self.names), sel)
@@ -0,0 +1,311 @@
+"""Rewrite an input file with a layout suited to salt's access pattern.
+
+The output is chunked along the first axis with one chunk per batch, so contiguous
+batches never decompress a chunk twice, and only contains the variables used by a
+training config. Chunks are read and compressed by a pool of threads, and written in
+order by the main thread.
+"""
+
+import argparse
+import itertools
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import h5py
+import numpy as np
+import yaml
+
+from salt.data.edge_features import EDGE_NODE_VARIABLES
+from salt.data.index import merge_chunks, scan_chunk
+from salt.data.parallel_read import read_slice
+from salt.data.readers import open_file
+
+HALF_MAX = float(np.finfo(np.float16).max)
+
+
+def get_config_variables(config: dict) -> tuple[dict, dict]:
+    """Return the input variables and labels used by a config for each h5 dataset.
+
+    Labels are taken from `data.labels`, which is filled in the config saved with
+    each training, or otherwise from the task configs.
+
+    Returns
+    -------
+    tuple[dict, dict]
+        Dicts of the input variables and of the labels for each dataset
+    """
+    data = config["data"]
+    global_object = data.get("global_object", "jets")
+    input_map = dict(data.get("input_map") or {k: k for k in data["variables"]})
+    input_map.update({"GLOBAL": global_object, "PARAMETERS": global_object})
+    if mf_config := data.get("mf_config"):
+        input_map["objects"] = mf_config["object"]["name"]
+
+    labels = data.get("labels")
+    if labels is None:
+        labels = {}
+        tasks = config["model"]["model"]["init_args"]["tasks"]["init_args"]["modules"]
+        for task in tasks:
+            task_args = task["init_args"]
+            this_labels = labels.setdefault(task_args["input_name"], [])
+            for key in ["label", "sample_weight", "targets", "target_denominators"]:
+                value = task_args.get(key) or []
+                this_labels += [value] if isinstance(value, str) else list(value)
+
+    inputs: dict = {global_object: []}
+    for input_name, variables in data["variables"].items():
+        name = input_map.get(input_name, input_name)
+        if input_name == "EDGE":
+            variables = [v for v in EDGE_NODE_VARIABLES if v != "valid"]  # noqa: PLW2901
+        inputs.setdefault(name, []).extend(variables)
+    targets: dict = {}
+    for input_name, this_labels in labels.items():
+        targets.setdefault(input_map.get(input_name, input_name), []).extend(this_labels)
+    return inputs, targets
+
+
+def parse_codec(codec: str) -> dict:
+    """Return h5py dataset compression arguments for a codec string.
+
+    Supported codecs are `none`, `lzf`, `gzip` and `gzip-<level>`.
+    """
+    if codec == "none":
+        return {}
+    if codec == "lzf":
+        return {"compression": "lzf"}
+    if codec == "gzip" or codec.startswith("gzip-"):
+        level = int(codec.split("-")[1]) if "-" in codec else 4
+        return {"compression": "gzip", "compression_opts": level}
+    raise ValueError(f"Unsupported codec '{codec}', choose from none, lzf, gzip, gzip-<level>.")
+
+
+def encode_chunk(chunk: np.ndarray, compression: dict, shuffle: bool) -> bytes | None:
+    """Apply the filter pipeline to a full chunk, or return None if HDF5 must do it."""
+    if compression.get("compression") == "lzf":
+        return None
+    data = chunk.tobytes()
+    itemsize = chunk.dtype.itemsize
+    if shuffle and itemsize > 1:
+        data = np.frombuffer(data, np.uint8).reshape(-1, itemsize).T.tobytes()
+    if compression.get("compression") == "gzip":
+        data = zlib.compress(data, compression["compression_opts"])
+    return data
+
+
+def get_output_dtype(
+    ds: h5py.Dataset, variables: list[str], labels: list[str], half: bool, stats: dict
+) -> np.dtype:
+    """Return the dtype of the rewritten dataset.
+
+    If `half` is set, float inputs which are not also labels are stored as float16,
+    provided their values fit in the float16 range.
+    """
+    keep = set(variables) | set(labels)
+    if "valid" in ds.dtype.names:
+        keep.add("valid")
+    if missing := keep - set(ds.dtype.names):
+        raise KeyError(f"Variables {missing} are missing from dataset '{ds.name}'.")
+
+    fields = []
+    for name in ds.dtype.names:
+        if name not in keep:
+            continue
+        dtype = ds.dtype[name]
+        s = stats.get(name)
+        is_input = name in variables and name not in labels
+        fits = s is not None and max(-s["min"], s["max"]) < HALF_MAX
+        if half and dtype.kind == "f" and is_input and fits:
+            dtype = np.dtype("f2")
+        fields.append((name, dtype))
+    return np.dtype(fields)
+
+
+def read_throughput(
+    filename: str | Path,
+    fields: dict,
+    batch_size: int,
+    num_batches: int = 50,
+    num_threads: int = 0,
+) -> float:
+    """Return the number of objects per second read in contiguous batches of the given fields.
+
+    Batches are read in a random order, as with the salt batch sampler. The file can be
+    in any format supported by `salt.data.readers.open_file`.
+    """
+    with open_file(filename, num_threads) as f:
+        num = min(len(f[name]) for name in fields)
+        starts = np.arange(0, num - batch_size + 1, batch_size)
+        starts = np.random.default_rng(42).permutation(starts)[:num_batches]
+        buffers = {
+            name: np.empty(
+                (batch_size,) + f[name].shape[1:], dtype=[(v, f[name].dtype[v]) for v in vs]
+            )
+            for name, vs in fields.items()
+        }
+        start_time = time.perf_counter()
+        for start in starts:
+            for name, buffer in buffers.items():
+                f[name].read_direct(buffer, np.s_[start : start + batch_size])
+        elapsed = time.perf_counter() - start_time
+    return len(starts) * batch_size / elapsed if elapsed > 0 else float("inf")
+
+
+def rechunk(
+    input_file: str | Path,
+    output_file: str | Path,
+    variables: dict,
+    labels: dict,
+    batch_size: int,
+    codec: str = "lzf",
+    shuffle: bool = False,
+    half: bool = False,
+    num_workers: int = 4,
+    stop: threading.Event | None = None,
+) -> dict | None:
+    """Rewrite a file with one chunk per batch, keeping only the requested variables.
+
+    Parameters
+    ----------
+    input_file : str | Path
+        Input h5 file
+    output_file : str | Path
+        Output h5 file
+    variables : dict
+        Input variables to keep for each dataset
+    labels : dict
+        Labels to keep for each dataset, which are never converted to float16
+    batch_size : int
+        Number of objects in each chunk
+    codec : str, optional
+        Compression, one of `none`, `lzf`, `gzip` or `gzip-<level>`, by default `lzf`
+    shuffle : bool, optional
+        Apply the shuffle filter before compression, by default False
+    half : bool, optional
+        Store float inputs as float16 where their range allows, by default False
+    num_workers : int, optional
+        Number of threads used to read and compress chunks, by default 4
+    stop : threading.Event | None, optional
+        If set during the rewrite, it is aborted between chunks and no output is
+        written, by default None
+
+    Returns
+    -------
+    dict | None
+        Output dtype of each dataset, or None if the rewrite was aborted
+    """
+    compression = parse_codec(codec)
+    if shuffle and compression:
+        compression["shuffle"] = True
+    shuffle = shuffle and bool(compression)
+    names = list(dict.fromkeys([*variables, *labels]))
+    dtypes = {}
+    stop = stop or threading.Event()
+    tmp = Path(output_file).with_name(f".{Path(output_file).name}.tmp")
+    with (
+        h5py.File(input_file, "r") as src,
+        h5py.File(tmp, "w") as dst,
+        ThreadPoolExecutor(num_workers) as pool,
+    ):
+        dst.attrs.update(src.attrs)
+        for name in names:
+            if stop.is_set():
+                break
+            ds = src[name]
+            stats: dict = {}
+            if half:
+                tasks = [
+                    (str(input_file), name, s, min(s + batch_size * 16, len(ds)))
+                    for s in range(0, len(ds), batch_size * 16)
+                ]
+                parts = list(pool.map(lambda t: scan_chunk(*t), tasks))
+                merged = merge_chunks(parts)
+                stats = {
+                    v: {"min": merged["min"][v], "max": merged["max"][v]} for v in merged["min"]
+                }
+
+            dtype = get_output_dtype(ds, variables.get(name, []), labels.get(name, []), half, stats)
+            dtypes[name] = dtype
+            chunks = (min(batch_size, max(len(ds), 1)),) + ds.shape[1:]
+            out = dst.create_dataset(
+                name, shape=ds.shape, dtype=dtype, chunks=chunks, **compression
+            )
+            out.attrs.update(ds.attrs)
+
+            def encode(start, ds=ds, dtype=dtype, chunks=chunks):
+                # read with the stored types, HDF5's conversion to float16 is inexact
+                end = min(start + chunks[0], len(ds))
+                buffer = np.zeros(chunks, dtype=[(n, ds.dtype[n]) for n in dtype.names])
+                read_slice(ds, buffer, slice(start, end), start)
+                chunk = buffer.astype(dtype)
+                return start, end, chunk, encode_chunk(chunk, compression, shuffle)
+
+            # keep a bounded number of chunks in flight, and write them in order
+            starts = iter(range(0, len(ds), chunks[0]))
+            pending = [pool.submit(encode, s) for s in itertools.islice(starts, 2 * num_workers)]
+            while pending:
+                if stop.is_set():
+                    for future in pending:
+                        future.cancel()
+                    break
+                start, end, chunk, data = pending.pop(0).result()
+                if (s := next(starts, None)) is not None:
+                    pending.append(pool.submit(encode, s))
+                if data is None:
+                    out[start:end] = chunk[: end - start]
+                else:
+                    out.id.write_direct_chunk((start,) + (0,) * (ds.ndim - 1), data)
+    if stop.is_set():
+        tmp.unlink(missing_ok=True)
+        return None
+    tmp.replace(output_file)
+    return dtypes
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Rewrite a salt input file with chunks aligned to the batch size."
+    )
+    parser.add_argument("input_file", help="Input h5 file.")
+    parser.add_argument("output_file", help="Output h5 file.")
+    parser.add_argument("-c", "--config", required=True, help="Salt config, e.g. a saved config.")
+    parser.add_argument("-b", "--batch_size", type=int, help="Defaults to data.batch_size.")
+    parser.add_argument("--codec", default="lzf", help="none, lzf, gzip or gzip-<level>.")
+    parser.add_argument("--shuffle", action="store_true", help="Use the shuffle filter.")
+    parser.add_argument("--half", action="store_true", help="Store float inputs as float16.")
+    parser.add_argument("-n", "--num_workers", type=int, default=4)
+    parser.add_argument(
+        "--extra", nargs="+", default=[], help="Extra variables to keep, as <dataset>.<variable>."
+    )
+    args = parser.parse_args(args)
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    batch_size = args.batch_size or config["data"]["batch_size"]
+    variables, labels = get_config_variables(config)
+    for extra in args.extra:
+        name, var = extra.split(".", 1)
+        labels.setdefault(name, []).append(var)
+
+    rechunk(
+        args.input_file,
+        args.output_file,
+        variables,
+        labels,
+        batch_size,
+        args.codec,
+        args.shuffle,
+        args.half,
+        args.num_workers,
+    )
+    with h5py.File(args.output_file) as f:
+        fields = {name: list(ds.dtype.names) for name, ds in f.items()}
+    before = read_throughput(args.input_file, fields, batch_size)
+    after = read_throughput(args.output_file, fields, batch_size)
+    print(f"Read throughput: {before:,.0f} objects/s before, {after:,.0f} objects/s after")
+
+
+if __name__ == "__main__":
+    main()
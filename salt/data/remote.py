@@ -0,0 +1,227 @@
+"""Stream remote input files with byte-range reads through a local block cache.
+
+Remote files, given as URLs such as `s3://bucket/file.h5`, are opened with fsspec and
+split into fixed-size blocks. Blocks are fetched on first use with ranged requests,
+and stored in an on-disk cache shared by all processes on the node, so that later
+epochs and runs read them locally. The cache is bounded in size, and the least
+recently used blocks are removed when it is full.
+"""
+
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import fsspec
+
+
+def is_remote(filename: str | Path) -> bool:
+    """Return True if a filename is a URL with a protocol, such as `s3://`."""
+    return "://" in str(filename)
+
+
+class BlockCache:
+    def __init__(self, cache_dir: str | Path, max_nbytes: int):
+        """On-disk least recently used cache of file blocks.
+
+        Each block is stored in its own file, and its modification time is updated
+        on each access. The order in which blocks were used is kept in memory, and when
+        the cache grows beyond `max_nbytes`, the least recently used blocks are removed.
+
+        Several processes can share a cache. Each only knows about the blocks written
+        by the others after scanning the cache directory, which it does on creation
+        and after each quarter of `max_nbytes` it has written, so the cost of the scans
+        does not grow with the number of blocks written.
+
+        Parameters
+        ----------
+        cache_dir : str | Path
+            Directory used to store the blocks
+        max_nbytes : int
+            Maximum total size of the cached blocks
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_nbytes = max_nbytes
+        self.lru: OrderedDict = OrderedDict()
+        self.nbytes = 0
+        self.written = 0
+        self.scan()
+
+    def blocks(self) -> list[tuple[float, int, Path]]:
+        """Return the modification time, size and path of each cached block."""
+        blocks = []
+        for key_dir in os.scandir(self.cache_dir):
+            if not key_dir.is_dir():
+                continue
+            for entry in os.scandir(key_dir.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                blocks.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        return blocks
+
+    def scan(self) -> None:
+        """Rebuild the order of use of the cached blocks from their modification times."""
+        self.lru = OrderedDict((path, size) for _, size, path in sorted(self.blocks()))
+        self.nbytes = sum(self.lru.values())
+        self.written = 0
+
+    def touch(self, path: Path, size: int) -> None:
+        """Mark a block as the most recently used."""
+        self.nbytes += size - self.lru.pop(path, 0)
+        self.lru[path] = size
+
+    def get(self, key: str, index: int) -> bytes | None:
+        """Return a cached block, or None if it is not in the cache."""
+        path = self.cache_dir / key / str(index)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self.touch(path, len(data))
+        return data
+
+    def put(self, key: str, index: int, data: bytes) -> None:
+        """Add a block to the cache, removing old blocks if it is full."""
+        path = self.cache_dir / key / str(index)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f"{index}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        self.touch(path, len(data))
+        self.written += len(data)
+        if self.written > self.max_nbytes // 4:
+            self.scan()
+        if self.nbytes > self.max_nbytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used blocks until the cache fits in `max_nbytes`."""
+        while self.nbytes > self.max_nbytes and self.lru:
+            path, size = self.lru.popitem(last=False)
+            path.unlink(missing_ok=True)
+            self.nbytes -= size
+
+
+class RemoteFile(io.RawIOBase):
+    def __init__(
+        self,
+        url: str,
+        cache_dir: str | Path | None = None,
+        cache_nbytes: int = 10 * 1024**3,
+        block_size: int = 4 * 1024**2,
+        memory_blocks: int = 16,
+    ):
+        """Read-only file object for a remote file, reading through a block cache.
+
+        Parameters
+        ----------
+        url : str
+            URL of the file, in any format supported by `fsspec`, e.g. `s3://bucket/file.h5`
+        cache_dir : str | Path | None, optional
+            Directory of the on-disk block cache, by default None, which only caches
+            blocks in memory
+        cache_nbytes : int, optional
+            Maximum size of the on-disk block cache, by default 10 GiB
+        block_size : int, optional
+            Size of each block in bytes, by default 4 MiB
+        memory_blocks : int, optional
+            Number of recently used blocks kept in memory, by default 16
+        """
+        super().__init__()
+        self.url = url
+        self.fs, self.path = fsspec.core.url_to_fs(url)
+        info = self.fs.info(self.path)
+        self.size = int(info["size"])
+        self.block_size = block_size
+        self.pos = 0
+
+        # identify the version of the file, so that changed files are fetched again
+        version = [url, self.size, block_size, str(info.get("ETag", info.get("mtime", "")))]
+        self.key = hashlib.sha1(json.dumps(version).encode()).hexdigest()[:16]  # noqa: S324
+        self.cache = BlockCache(cache_dir, cache_nbytes) if cache_dir is not None else None
+        self.memory: OrderedDict = OrderedDict()
+        self.memory_blocks = memory_blocks
+        self.fetched = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}.")
+        return self.pos
+
+    def readinto(self, buffer) -> int:
+        out = memoryview(buffer).cast("B")
+        stop = min(self.pos + len(out), self.size)
+        if stop <= self.pos:
+            return 0
+        first, last = self.pos // self.block_size, (stop - 1) // self.block_size
+        blocks = self.get_blocks(first, last)
+        n = 0
+        for index in range(first, last + 1):
+            block = blocks[index]
+            start = max(self.pos, index * self.block_size) - index * self.block_size
+            end = min(stop - index * self.block_size, len(block))
+            out[n : n + end - start] = block[start:end]
+            n += end - start
+        self.pos = stop
+        return n
+
+    def get_blocks(self, first: int, last: int) -> dict[int, bytes]:
+        """Return blocks `first` to `last`, fetching runs of missing blocks together."""
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self.memory.get(index)
+            if block is None and self.cache is not None:
+                block = self.cache.get(self.key, index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+
+        # fetch each run of consecutive missing blocks with a single ranged request
+        runs: list[list[int]] = []
+        for index in missing:
+            if runs and index == runs[-1][-1] + 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        for run in runs:
+            start = run[0] * self.block_size
+            stop = min((run[-1] + 1) * self.block_size, self.size)
+            data = self.fs.cat_file(self.path, start=start, end=stop)
+            self.fetched += len(data)
+            for index in run:
+                offset = index * self.block_size - start
+                blocks[index] = data[offset : offset + self.block_size]
+                if self.cache is not None:
+                    self.cache.put(self.key, index, blocks[index])
+
+        for index, block in blocks.items():
+            self.memory[index] = block
+            self.memory.move_to_end(index)
+        while len(self.memory) > self.memory_blocks:
+            self.memory.popitem(last=False)
+        return blocks
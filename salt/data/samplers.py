@@ -1,8 +1,25 @@
+import math
+import warnings
+
 import numpy as np
 import torch
 from torch.utils.data import Sampler
 
 
+def split_batches(batches: list, rank: int, num_replicas: int) -> list:
+    """Return the batches read by one rank, in the order of a non-shuffling
+    `torch.utils.data.DistributedSampler`.
+
+    The batches are padded by repeating the first few, so that each rank reads the
+    same number of batches.
+    """
+    if num_replicas == 1 or not batches:
+        return batches
+    total = math.ceil(len(batches) / num_replicas) * num_replicas
+    padded = (batches * math.ceil(total / len(batches)))[:total]
+    return padded[rank::num_replicas]
+
+
 class RandomBatchSampler(Sampler):
     def __init__(
         self,
@@ -10,12 +27,18 @@ class RandomBatchSampler(Sampler):
         batch_size: int,
         shuffle: bool = False,
         drop_last: bool = False,
+        align_chunks: bool = False,
+        max_reduction: float = 0.05,
     ):
         """Batch sampler for an h5 dataset.
 
         The batch sampler performs weak shuffling. Objects are batched first,
         and then batches are shuffled.
 
+        If the dataset is split into several files (see
+        [`salt.data.ShardedSaltDataset`][salt.data.ShardedSaltDataset]), each file is
+        batched separately so that no batch straddles a file boundary.
+
         Parameters
         ----------
         dataset : torch.data.Dataset
@@ -26,29 +49,191 @@ class RandomBatchSampler(Sampler):
             Shuffle the batches
         drop_last : bool
             Drop the last incomplete batch (if present)
+        align_chunks : bool
+            Adjust the batch size so that batch boundaries line up with the HDF5 chunks
+            of the datasets read from the file, see `salt.data.samplers.align_batch_size`.
+            The adjusted size is stored in `batch_size`, and a warning is issued if it
+            differs from the requested size
+        max_reduction : float
+            Largest fraction by which `align_chunks` may reduce the batch size
         """
+        if align_chunks:
+            requested = batch_size
+            batch_size = align_batch_size(batch_size, get_chunk_lengths(dataset), max_reduction)
+            if batch_size != requested:
+                warnings.warn(
+                    f"align_chunks reduced the batch size from {requested} to {batch_size}"
+                    f" ({1 - batch_size / requested:.1%} smaller), which changes the"
+                    " optimisation. Adjust the learning rate if needed.",
+                    stacklevel=2,
+                )
         self.batch_size = batch_size
         self.dataset_length = len(dataset)
-        self.n_batches = self.dataset_length / self.batch_size
-        self.nonzero_last_batch = int(self.n_batches) < self.n_batches
         self.drop_last = drop_last
         self.shuffle = shuffle
 
+        # full batches, and the incomplete last batch of each shard
+        self.starts = []
+        self.remainders = []
+        for start, stop in getattr(dataset, "shard_bounds", [(0, self.dataset_length)]):
+            n_full = (stop - start) // batch_size
+            self.starts += [start + i * batch_size for i in range(n_full)]
+            if start + n_full * batch_size < stop:
+                self.remainders.append(np.s_[start + n_full * batch_size : stop])
+        self.n_batches = len(self.starts)
+
     def __len__(self):
-        return int(self.n_batches) + int(not self.drop_last and self.nonzero_last_batch)
+        return self.n_batches + (0 if self.drop_last else len(self.remainders))
 
     def __iter__(self):
         if self.shuffle:
-            self.batch_ids = torch.randperm(int(self.n_batches))
+            self.batch_ids = torch.randperm(self.n_batches)
         else:
-            self.batch_ids = torch.arange(int(self.n_batches))
+            self.batch_ids = torch.arange(self.n_batches)
         # yield full batches from the dataset
         for batch_id in self.batch_ids:
-            start, stop = batch_id * self.batch_size, (batch_id + 1) * self.batch_size
-            yield np.s_[int(start) : int(stop)]
+            start = self.starts[batch_id]
+            yield np.s_[start : start + self.batch_size]
 
         # in case the batch size is not a perfect multiple of the number of samples,
         # yield the remaining samples
-        if not self.drop_last and self.nonzero_last_batch:
-            start, stop = int(self.n_batches) * self.batch_size, self.dataset_length
-            yield np.s_[int(start) : int(stop)]
+        if not self.drop_last:
+            yield from self.remainders
+
+
+def get_chunk_lengths(dataset: torch.utils.data.Dataset) -> dict[int, int]:
+    """Return the bytes per object read from datasets with each chunk length.
+
+    Only chunked datasets which are read from the input files are considered. Datasets
+    with an object selection are not read in contiguous batches, and are ignored.
+
+    Parameters
+    ----------
+    dataset : torch.utils.data.Dataset
+        A [`salt.data.SaltDataset`][salt.data.SaltDataset] or
+        [`salt.data.ShardedSaltDataset`][salt.data.ShardedSaltDataset]
+
+    Returns
+    -------
+    dict[int, int]
+        Number of bytes per object for each chunk length along the first axis
+    """
+    lengths: dict[int, int] = {}
+    for ds in getattr(dataset, "datasets", [dataset]):
+        if not hasattr(ds, "dss") or ds.selection is not None:
+            continue
+        for input_name, h5ds in ds.dss.items():
+            if input_name in ds.cache or h5ds.chunks is None:
+                continue
+            nbytes = h5ds.dtype.itemsize * math.prod(h5ds.shape[1:])
+            lengths[h5ds.chunks[0]] = lengths.get(h5ds.chunks[0], 0) + nbytes
+    return lengths
+
+
+def align_batch_size(
+    batch_size: int, chunk_lengths: dict[int, int], max_reduction: float = 0.05
+) -> int:
+    """Return a batch size at most `batch_size` whose batches line up with the chunks.
+
+    With batches starting at multiples of the batch size `b`, a dataset with chunk
+    length `c` is read without decompressing chunks which are only partly used if `b`
+    is a multiple of `c`, or `c` is a multiple of `b`. Batch sizes down to
+    `(1 - max_reduction) * batch_size` are considered, and the largest one maximising
+    the number of aligned bytes per object is returned. If no dataset can be aligned,
+    `batch_size` is returned unchanged.
+
+    Parameters
+    ----------
+    batch_size : int
+        Requested batch size
+    chunk_lengths : dict[int, int]
+        Bytes per object for each chunk length, see `get_chunk_lengths`
+    max_reduction : float, optional
+        Largest fraction by which the batch size may be reduced, by default 0.05
+
+    Returns
+    -------
+    int
+        Aligned batch size
+    """
+    best, best_score = batch_size, 0
+    lowest = max(math.ceil(batch_size * (1 - max_reduction)), 1)
+    for b in range(batch_size, lowest - 1, -1):
+        score = sum(n for c, n in chunk_lengths.items() if b % c == 0 or c % b == 0)
+        if score > best_score:
+            best, best_score = b, score
+    return best
+
+
+class BucketBatchSampler(Sampler):
+    def __init__(
+        self,
+        multiplicity: np.ndarray,
+        max_tokens: int,
+        num_buckets: int = 8,
+        shuffle: bool = False,
+    ):
+        """Batch sampler grouping objects of similar constituent multiplicity.
+
+        Objects are split into buckets using quantiles of their number of valid
+        constituents. Each bucket is split into variable-size batches with a roughly
+        constant total number of valid constituents (tokens). Objects without any valid
+        constituents count as a single token. Only if each batch is truncated to its
+        longest valid sequence, with `dynamic_truncation` in
+        [`salt.data.SaltDataset`][salt.data.SaltDataset], is the padding minimised and
+        the cost of each training step approximately the same. Otherwise, the large
+        batches of low multiplicity objects are padded to the full constituent width.
+
+        Batches are yielded as sorted arrays of object indices, which are gathered
+        from the file by [`salt.data.SaltDataset`][salt.data.SaltDataset]. As the
+        objects of a batch are spread over the file, each of them may be in a different
+        chunk, so up to a full chunk is decompressed for each object read.
+
+        Parameters
+        ----------
+        multiplicity : np.ndarray
+            Number of valid constituents for each object, see
+            [`salt.data.SaltDataset.get_multiplicity`][salt.data.SaltDataset.get_multiplicity]
+        max_tokens : int
+            Target number of valid constituents in each batch
+        num_buckets : int
+            Number of multiplicity buckets
+        shuffle : bool
+            Shuffle objects within each bucket, and the order of the batches
+        """
+        self.tokens = np.maximum(np.asarray(multiplicity), 1)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+
+        # assign objects to buckets of roughly equal size
+        quantiles = np.linspace(0, 1, num_buckets + 1)[1:-1]
+        edges = np.unique(np.quantile(self.tokens, quantiles)) if len(self.tokens) else []
+        bucket_ids = np.digitize(self.tokens, edges, right=True)
+        self.buckets = [np.flatnonzero(bucket_ids == i) for i in range(len(edges) + 1)]
+        self.buckets = [b for b in self.buckets if len(b)]
+
+        # fix the number of batches in each bucket
+        self.n_batches = [
+            min(len(b), int(np.ceil(self.tokens[b].sum() / self.max_tokens))) for b in self.buckets
+        ]
+
+    def __len__(self):
+        return sum(self.n_batches)
+
+    def __iter__(self):
+        batches = []
+        for bucket, n_batches in zip(self.buckets, self.n_batches, strict=True):
+            if self.shuffle:
+                bucket = bucket[torch.randperm(len(bucket)).numpy()]  # noqa: PLW2901
+            # split at equal fractions of the cumulative token count
+            cumsum = np.cumsum(self.tokens[bucket])
+            k = np.arange(1, n_batches)
+            splits = np.searchsorted(cumsum, cumsum[-1] * k / n_batches)
+            # ensure each batch contains at least one object
+            splits = np.maximum.accumulate(np.maximum(splits, k) - k) + k
+            splits = np.minimum(splits, len(bucket) - n_batches + k)
+            batches += [np.sort(b) for b in np.split(bucket, splits)]
+
+        order = torch.randperm(len(batches)) if self.shuffle else torch.arange(len(batches))
+        for i in order:
+            yield batches[i]
@@ -0,0 +1,94 @@
+"""Select a subset of objects in an input file using cuts, with an on-disk cache."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+from ftag import Cuts
+
+
+def get_selection_key(filename: str | Path, dataset: str, cuts: list[str]) -> str:
+    """Return a hash identifying the selection of a set of cuts on a file.
+
+    The key depends on the identity of the input file (resolved path, size and
+    modification time), the dataset name and the cuts.
+    """
+    path = Path(filename).resolve()
+    stat = path.stat()
+    info = [str(path), stat.st_size, stat.st_mtime_ns, dataset, list(cuts)]
+    return hashlib.sha1(json.dumps(info).encode()).hexdigest()[:16]  # noqa: S324
+
+
+def apply_cuts(ds: h5py.Dataset, cuts: list[str], chunk_size: int = 100_000) -> np.ndarray:
+    """Return the sorted indices of the rows of a dataset which pass a set of cuts.
+
+    Parameters
+    ----------
+    ds : h5py.Dataset
+        Structured dataset containing the cut variables
+    cuts : list[str]
+        Cuts in the format used by `ftag.Cuts.from_list`, e.g. `"pt > 20e3"`
+    chunk_size : int, optional
+        Number of rows to read at once, by default 100_000
+
+    Returns
+    -------
+    np.ndarray
+        Sorted int64 array of selected row indices
+    """
+    cuts = Cuts.from_list(cuts)
+    if missing := set(cuts.variables) - set(ds.dtype.names):
+        raise KeyError(f"Cut variables {missing} are missing from dataset '{ds.name}'.")
+    selected = []
+    for start in range(0, len(ds), chunk_size):
+        batch = ds.fields(cuts.variables)[start : start + chunk_size]
+        selected.append(start + cuts(batch).idx)
+    return np.concatenate(selected).astype(np.int64) if selected else np.empty(0, np.int64)
+
+
+def load_selection(
+    filename: str | Path,
+    ds: h5py.Dataset,
+    cuts: list[str],
+    cache_dir: str | Path | None = None,
+) -> np.ndarray:
+    """Return the selected rows for a set of cuts, reading them from the cache if possible.
+
+    The selection is computed once and written to `cache_dir`, or next to the input
+    file if `cache_dir` is not set. If neither is writable, the selection is not cached.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Input h5 file
+    ds : h5py.Dataset
+        Structured dataset to apply the cuts to
+    cuts : list[str]
+        Cuts in the format used by `ftag.Cuts.from_list`
+    cache_dir : str | Path | None, optional
+        Directory used to store the selection, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Sorted int64 array of selected row indices
+    """
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        cache_dir = Path(filename).parent
+    key = get_selection_key(filename, ds.name, cuts)
+    path = cache_dir / f"{Path(filename).stem}_selection_{key}.npy"
+    if path.exists():
+        return np.load(path)
+
+    selection = apply_cuts(ds, cuts)
+    if os.access(cache_dir, os.W_OK):
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp.npy")
+        np.save(tmp, selection)
+        tmp.replace(path)
+    return selection
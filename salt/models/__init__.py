@@ -1,5 +1,6 @@
 from salt.models.attention import GATv2Attention, MultiheadAttention, ScaledDotProductAttention
 from salt.models.dense import Dense
+from salt.models.edges import EdgeFeatures
 from salt.models.featurewise import FeaturewiseTransformation
 from salt.models.initnet import InitNet
 from salt.models.inputnorm import InputNorm
@@ -36,6 +37,7 @@ __all__ = [
     "ClassificationTask",
     "Dense",
     "DictCrossAttentionPooling",
+    "EdgeFeatures",
     "FeaturewiseTransformation",
     "GATv2Attention",
     "GaussianRegressionTask",
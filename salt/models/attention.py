@@ -191,6 +191,7 @@ class MultiheadAttention(nn.Module):
         kv_mask: BoolTensor | None = None,
         attn_mask: BoolTensor | None = None,
         attn_bias: Tensor | None = None,
+        edge_idx: Tensor | None = None,
     ) -> Tensor:
         """Full forward pass through the model.
 
@@ -212,6 +213,9 @@ class MultiheadAttention(nn.Module):
             Extra mask for the attention (adjacency) matrix, by default None
         attn_bias : Optional[Tensor], optional
             Extra values to further augment the attention matrix, by default None
+        edge_idx : Optional[Tensor], optional
+            Indices of the keys connected to each query, of shape (B,Lq,K). If provided,
+            edges are sparse with shape (B,Lq,K,F) and other pairs are masked, by default None
 
         Returns
         -------
@@ -230,6 +234,14 @@ class MultiheadAttention(nn.Module):
         # input shape
         b_size, _seq_len, _features = q.shape
 
+        # Sparse edges only connect each query to its neighbours
+        if edge_idx is not None:
+            adjacency = torch.ones(
+                (b_size, q.shape[1], k.shape[1]), dtype=torch.bool, device=q.device
+            )
+            adjacency = adjacency.scatter(2, edge_idx, False)
+            attn_mask = adjacency if attn_mask is None else attn_mask | adjacency
+
         # Work out the masking situation, with padding, peaking, etc
         attn_mask = merge_masks(q_mask, kv_mask, attn_mask, q.shape, k.shape, q.device)
 
@@ -240,6 +252,8 @@ class MultiheadAttention(nn.Module):
         if edges is not None:
             e = self.linear_e(edges)
             g = nn.functional.sigmoid(self.linear_g(edges))
+            if edge_idx is not None:
+                e, g = (self.scatter_edges(t, edge_idx, k.shape[1]) for t in (e, g))
             attn_bias = e if attn_bias is None else attn_bias + e
 
         # Calculate attention scores (B,H,Lq,Lk)
@@ -260,7 +274,11 @@ class MultiheadAttention(nn.Module):
         # update edges with dot product attention scores (if desired)
         edge_out = None
         if self.update_edges:
-            edge_out = self.linear_e_out(attn_scores.permute(0, 2, 3, 1))
+            attn_scores = attn_scores.permute(0, 2, 3, 1)
+            if edge_idx is not None:
+                idx = edge_idx.unsqueeze(-1).expand(-1, -1, -1, attn_scores.shape[-1])
+                attn_scores = torch.gather(attn_scores, 2, idx)
+            edge_out = self.linear_e_out(attn_scores)
 
         # Optional output layer
         if self.out_proj:
@@ -271,6 +289,12 @@ class MultiheadAttention(nn.Module):
 
         return out
 
+    @staticmethod
+    def scatter_edges(x: Tensor, edge_idx: Tensor, kv_len: int) -> Tensor:
+        """Scatter sparse per-head edge values (B,Lq,K,H) to a dense (B,Lq,Lk,H) tensor."""
+        dense = x.new_zeros((*x.shape[:2], kv_len, x.shape[-1]))
+        return dense.scatter(2, edge_idx.unsqueeze(-1).expand_as(x), x)
+
 
 class ScaledDotProductAttention(nn.Module):
     """Scaled dot product attention, commonly used in transformers.
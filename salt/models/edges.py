@@ -0,0 +1,122 @@
+import math
+
+import torch
+from torch import Tensor, nn
+
+
+class EdgeFeatures(nn.Module):
+    def __init__(self, variables: list[str], chunk_size: int = 128, knn: int | None = None):
+        """Compute pairwise edge features from per-node inputs.
+
+        This is the on-device equivalent of
+        `salt.data.edge_features.get_inputs_edge`, used when the dataset only provides
+        the per-node `eta`, `phi`, `pt`, `subjetIndex` and `valid` columns
+        (`data.lazy_edges=true`). Pairwise quantities are formed by broadcasting,
+        and the batch is processed in chunks to limit the size of intermediate tensors.
+
+        If `knn` is set, edges are only built from each node to its `knn` nearest
+        valid neighbours in dR, which always include the node itself.
+
+        Parameters
+        ----------
+        variables : list[str]
+            Edge features to compute, in order. Can be any of `dR`, `kt`, `z`,
+            `isSelfLoop` and `subjetIndex`
+        chunk_size : int, optional
+            Number of objects to process at once, by default 128
+        knn : int, optional
+            Number of nearest neighbours to keep for each node, by default None,
+            which keeps all pairs
+        """
+        super().__init__()
+        supported = {"dR", "kt", "z", "isSelfLoop", "subjetIndex"}
+        if unknown := set(variables) - supported:
+            raise ValueError(f"Edge features {unknown} not recognized")
+        self.variables = list(variables)
+        self.chunk_size = chunk_size
+        self.knn = knn
+
+    def forward(self, nodes: Tensor) -> Tensor | tuple[Tensor, Tensor]:
+        """Compute edge features.
+
+        Parameters
+        ----------
+        nodes : Tensor
+            Node inputs of shape `(batch_size, num_nodes, 5)`, with the columns
+            `eta`, `phi`, `pt`, `subjetIndex` and `valid`
+
+        Returns
+        -------
+        Tensor | tuple[Tensor, Tensor]
+            Edge features of shape `(batch_size, num_nodes, num_nodes, num_features)`.
+            If `knn` is set, edge features of shape `(batch_size, num_nodes, k, num_features)`
+            and the indices of the neighbours of each node, of shape
+            `(batch_size, num_nodes, k)`
+        """
+        batch_size, num_nodes, _ = nodes.shape
+        k = num_nodes if self.knn is None else min(self.knn, num_nodes)
+        edges = nodes.new_empty(batch_size, num_nodes, k, len(self.variables))
+        idx = None
+        if self.knn is not None:
+            idx = nodes.new_empty(batch_size, num_nodes, k, dtype=torch.long)
+        for start in range(0, batch_size, self.chunk_size):
+            stop = start + self.chunk_size
+            chunk = nodes[start:stop].float()
+            if idx is not None:
+                idx[start:stop] = self.neighbours(chunk, k)
+                edges[start:stop] = self.compute(chunk, idx[start:stop])
+            else:
+                edges[start:stop] = self.compute(chunk)
+        if idx is not None:
+            return edges, idx
+        return edges
+
+    @staticmethod
+    def neighbours(nodes: Tensor, k: int) -> Tensor:
+        """Return the indices of the k nearest valid neighbours of each node."""
+        eta, phi, _, _, valid = nodes.unbind(-1)
+        deta = eta.unsqueeze(1) - eta.unsqueeze(2)
+        dphi = torch.remainder(phi.unsqueeze(1) - phi.unsqueeze(2) + math.pi, 2 * math.pi)
+        dr2 = deta.square() + (dphi - math.pi).square()
+        dr2 = dr2.masked_fill(~valid.bool().unsqueeze(1), math.inf)
+        # always keep the self-loop
+        eye = torch.eye(nodes.shape[1], dtype=torch.bool, device=nodes.device)
+        dr2 = dr2.masked_fill(eye, -1.0)
+        return dr2.topk(k, dim=-1, largest=False).indices
+
+    def compute(self, nodes: Tensor, idx: Tensor | None = None) -> Tensor:
+        eta, phi, pt, subjet, _ = nodes.unbind(-1)
+
+        # element [b, i, j] is computed from node i and its j-th neighbour
+        def pair(x: Tensor) -> tuple[Tensor, Tensor]:
+            if idx is None:
+                return x.unsqueeze(2), x.unsqueeze(1)
+            return x.unsqueeze(2), torch.gather(x.unsqueeze(1).expand(-1, x.shape[1], -1), 2, idx)
+
+        if "dR" in self.variables or "kt" in self.variables:
+            (eta_i, eta_j), (phi_i, phi_j) = pair(eta), pair(phi)
+            dphi = phi_j - phi_i
+            dphi = dphi - (dphi > math.pi) * 2 * math.pi
+            dr = torch.sqrt((eta_j - eta_i).square() + dphi.square())
+        pt_i, pt_j = pair(pt)
+        pt_min = torch.minimum(pt_i, pt_j)
+
+        features = []
+        for variable in self.variables:
+            if variable == "dR":
+                x = torch.log(dr)
+            elif variable == "kt":
+                x = torch.log(pt_min * dr)
+            elif variable == "z":
+                x = torch.log(pt_min / (pt_i + pt_j))
+            elif variable == "isSelfLoop":
+                if idx is None:
+                    x = torch.eye(nodes.shape[1], dtype=nodes.dtype, device=nodes.device)
+                else:
+                    x = idx == torch.arange(nodes.shape[1], device=nodes.device).view(1, -1, 1)
+            elif variable == "subjetIndex":
+                subjet_i, subjet_j = pair(subjet)
+                x = (subjet_i == subjet_j) & (subjet_j >= 0)
+            features.append(x.to(nodes.dtype).expand(pt_min.shape))
+
+        return torch.nan_to_num(torch.stack(features, -1), nan=0.0, posinf=0.0, neginf=0.0)
@@ -1,6 +1,7 @@
 from torch import nn
 
 from salt.models import Dense, FeaturewiseTransformation
+from salt.models.edges import EdgeFeatures
 from salt.models.posenc import PositionalEncoder
 from salt.stypes import Tensors, Vars
 from salt.utils.tensor_utils import attach_context
@@ -17,6 +18,7 @@ class InitNet(nn.Module):
         pos_enc: PositionalEncoder | None = None,
         muP: bool = False,
         featurewise: FeaturewiseTransformation | None = None,
+        knn: int | None = None,
     ):
         """Initial input embedding network.
 
@@ -44,6 +46,9 @@ class InitNet(nn.Module):
         featurewise: FeaturewiseTransformation, optional
             Networks to apply featurewise transformations to inputs, set automatically by
             the framework
+        knn: int, optional
+            Only build edges between each constituent and its `knn` nearest neighbours
+            in dR. Only used for the `EDGE` input, and requires `data.lazy_edges`.
         """
         super().__init__()
 
@@ -65,11 +70,26 @@ class InitNet(nn.Module):
         if muP:
             self.net.reset_parameters()
         self.featurewise = featurewise
+        self.knn = knn
+        self.edge_features = None
+        if input_name == "EDGE":
+            self.edge_features = EdgeFeatures(variables[input_name], knn=knn)
+        elif knn is not None:
+            raise ValueError("knn can only be used for the EDGE input")
 
     def forward(self, inputs: Tensors):
         # get the inputs for this init net
         x = inputs[self.input_name]
 
+        # compute edge features from per-node inputs
+        edge_idx = None
+        if self.edge_features is not None and x.ndim == 3:
+            x = self.edge_features(x)
+            if self.knn is not None:
+                x, edge_idx = x
+        elif self.knn is not None:
+            raise ValueError("Sparse kNN edges require per-node inputs, set data.lazy_edges=true")
+
         # add global features
         if self.attach_global:
             x = attach_context(x, inputs[self.global_object])
@@ -91,4 +111,7 @@ class InitNet(nn.Module):
             input_indices = [this_vars.index(v) for v in self.pos_enc.variables]
             x += self.pos_enc(inputs[self.input_name][..., input_indices])
 
+        if edge_idx is not None:
+            return x, edge_idx
+
         return x
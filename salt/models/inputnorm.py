@@ -79,5 +79,8 @@ class InputNorm(nn.Module):
         for k, x in inputs.items():
             if k in self.NO_NORM:
                 continue
-            inputs[k] = (x - getattr(self, f"{k}_means")) / getattr(self, f"{k}_stds")
+            means = getattr(self, f"{k}_means")
+            stds = getattr(self, f"{k}_stds")
+            # half precision inputs from the dataloader are upcast here, on the device
+            inputs[k] = (x.to(means.dtype) - means) / stds
         return inputs
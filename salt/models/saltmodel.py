@@ -117,6 +117,8 @@ class SaltModel(nn.Module):
         # handle edge features if present
         edge_x = xs.pop("EDGE", None)
         kwargs = {} if edge_x is None else {"edge_x": edge_x}
+        if isinstance(edge_x, tuple):
+            kwargs = {"edge_x": edge_x[0], "edge_idx": edge_x[1]}
 
         if isinstance(self.merge_dict, dict):
             for merge_name, merge_types in self.merge_dict.items():
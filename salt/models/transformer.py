@@ -92,6 +92,7 @@ class TransformerEncoderLayer(nn.Module):
         context: Tensor | None = None,
         attn_mask: BoolTensor | None = None,
         attn_bias: Tensor | None = None,
+        edge_idx: Tensor | None = None,
     ) -> Tensor:
         if edge_x is not None:
             xi, edge_xi = self.mha(
@@ -100,6 +101,7 @@ class TransformerEncoderLayer(nn.Module):
                 q_mask=pad_mask,
                 attn_mask=attn_mask,
                 attn_bias=attn_bias,
+                edge_idx=edge_idx,
             )
         else:
             xi = self.mha(
@@ -0,0 +1,729 @@
+import importlib.util
+import os
+import threading
+import time
+from copy import deepcopy
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+import torch
+import yaml
+
+from salt.data import (
+    BatchCache,
+    BucketBatchSampler,
+    DeviceDataset,
+    RandomBatchSampler,
+    SaltDataset,
+    ShardedSaltDataset,
+    ShardWorkerDataset,
+    ShuffleBufferDataset,
+)
+from salt.data.affinity import (
+    WorkerInit,
+    assign_cpus,
+    format_cpulist,
+    get_worker_init,
+    parse_cpulist,
+    set_affinity,
+)
+from salt.data.batch_cache import RankSampler
+from salt.data.chunk_cache import ChunkCacheStats, format_report
+from salt.data.convert import main as to_zarr_main
+from salt.data.index import build_index, load_index
+from salt.data.index import main as index_main
+from salt.data.norm_dict import build_norm_dict
+from salt.data.norm_dict import main as norm_dict_main
+from salt.data.parallel_read import get_filters, read_slice
+from salt.data.readahead import ReadaheadSampler, get_byte_ranges
+from salt.data.rechunk import main as rechunk_main
+from salt.data.remote import BlockCache, RemoteFile
+from salt.data.samplers import align_batch_size, split_batches
+from salt.models import InputNorm
+from salt.utils.file_utils import stage_file
+from salt.utils.inputs import write_dummy_file, write_dummy_norm_dict
+
+VARIABLES = {
+    "jets": ["pt_btagJes", "eta_btagJes"],
+    "tracks": ["d0", "z0SinTheta", "dphi", "deta", "qOverP"],
+}
+LABELS = {
+    "jets": ["flavour_label"],
+    "tracks": ["ftagTruthOriginLabel", "ftagTruthVertexIndex"],
+}
+
+
+@pytest.fixture
+def dummy_file(tmp_path):
+    nd_path = tmp_path / "norm_dict.yaml"
+    cd_path = tmp_path / "class_dict.yaml"
+    fname = tmp_path / "dummy.h5"
+    write_dummy_norm_dict(nd_path, cd_path)
+    write_dummy_file(fname, nd_path)
+    return fname, nd_path
+
+
+def get_dataset(dummy_file, **kwargs):
+    fname, nd_path = dummy_file
+    return SaltDataset(
+        filename=str(fname),
+        norm_dict=str(nd_path),
+        variables={k: list(v) for k, v in VARIABLES.items()},
+        labels={k: list(v) for k, v in LABELS.items()},
+        stage="fit",
+        **kwargs,
+    )
+
+
+def assert_batches_equal(a, b):
+    for x, y in zip(a, b, strict=True):
+        assert x.keys() == y.keys()
+        for k in x:
+            if isinstance(x[k], dict):
+                assert_batches_equal((x[k],), (y[k],))
+            else:
+                assert torch.equal(x[k], y[k]), k
+
+
+@pytest.mark.parametrize("num_inputs", [None, {"tracks": 10}])
+def test_cache(dummy_file, tmp_path, num_inputs):
+    ds = get_dataset(dummy_file, num_inputs=num_inputs)
+    cached = get_dataset(dummy_file, num_inputs=num_inputs, cache_dir=tmp_path / "cache")
+    assert len(list((tmp_path / "cache").iterdir())) == 4
+    for idx in [np.s_[0:100], np.s_[350:500]]:
+        assert_batches_equal(ds[idx], cached[idx])
+
+    # second instance reuses the existing cache
+    cached = get_dataset(dummy_file, num_inputs=num_inputs, cache_dir=tmp_path / "cache")
+    assert len(list((tmp_path / "cache").iterdir())) == 4
+    assert_batches_equal(ds[np.s_[0:100]], cached[np.s_[0:100]])
+
+
+def test_cache_half(dummy_file, tmp_path):
+    ds = get_dataset(dummy_file)
+    cached = get_dataset(dummy_file, cache_dir=tmp_path, cache_dtype="float16")
+    inputs, _, _ = ds[np.s_[0:100]]
+    cached_inputs, _, _ = cached[np.s_[0:100]]
+    assert cached_inputs["tracks"].dtype == torch.float32
+    assert torch.allclose(inputs["tracks"], cached_inputs["tracks"], atol=1e-3)
+
+
+@pytest.mark.parametrize("input_dtype", ["float16", "bfloat16"])
+def test_input_dtype(dummy_file, tmp_path, input_dtype):
+    ds = get_dataset(dummy_file)
+    half = get_dataset(dummy_file, input_dtype=input_dtype)
+    inputs, pad_masks, labels = ds[np.s_[0:100]]
+    half_inputs, half_pad_masks, half_labels = half[np.s_[0:100]]
+    for k, x in inputs.items():
+        assert half_inputs[k].dtype == getattr(torch, input_dtype)
+        assert torch.allclose(x, half_inputs[k].float(), rtol=1e-2, atol=1e-3)
+    assert_batches_equal((pad_masks, labels), (half_pad_masks, half_labels))
+
+    # half precision cached inputs are returned without conversion
+    cached = get_dataset(
+        dummy_file, cache_dir=tmp_path, cache_dtype="float16", input_dtype="float16"
+    )
+    assert cached[np.s_[0:100]][0]["tracks"].dtype == torch.float16
+
+    # inputs are upcast by the normalisation
+    norm = InputNorm(dummy_file[1], {k: list(v) for k, v in VARIABLES.items()}, "jets", None)
+    assert norm(dict(half_inputs))["tracks"].dtype == torch.float32
+
+    with pytest.raises(ValueError, match="input_dtype"):
+        get_dataset(dummy_file, input_dtype="float64")
+
+    # variables outside the float16 range are refused
+    norm_dict = yaml.safe_load(Path(dummy_file[1]).read_text())
+    norm_dict["jets"]["pt_btagJes"]["mean"] = 1e5
+    nd_path = tmp_path / "norm_dict.yaml"
+    nd_path.write_text(yaml.dump(norm_dict))
+    with pytest.raises(ValueError, match=r"jets.pt_btagJes.*bfloat16"):
+        get_dataset((dummy_file[0], nd_path), input_dtype="float16")
+    get_dataset((dummy_file[0], nd_path), input_dtype="bfloat16")
+
+
+def test_read_indices(dummy_file):
+    ds = get_dataset(dummy_file)
+    idx = np.array([3, 4, 5, 250, 251, 999])
+    inputs, _, labels = ds[idx]
+    for i, j in enumerate(idx):
+        ref_inputs, _, ref_labels = ds[np.s_[j : j + 1]]
+        assert torch.equal(inputs["tracks"][i], ref_inputs["tracks"][0])
+        assert labels["jets"]["flavour_label"][i] == ref_labels["jets"]["flavour_label"][0]
+
+
+@pytest.mark.parametrize("exact", [False, True])
+def test_shuffle_buffer(dummy_file, exact):
+    ds = get_dataset(dummy_file)
+    shuffled = ShuffleBufferDataset(ds, batch_size=100, buffer_batches=3, exact=exact)
+    batches = list(shuffled)
+    assert len(batches) == len(shuffled) == 10
+
+    # all objects are used exactly once, in a different order
+    pts = torch.cat([inputs["jets"][:, 0] for inputs, _, _ in batches])
+    ref = ds[np.s_[0:1000]][0]["jets"][:, 0]
+    assert torch.equal(pts.sort().values, ref.sort().values)
+    assert not torch.equal(pts, ref)
+
+
+def test_dynamic_truncation(dummy_file):
+    ds = get_dataset(dummy_file)
+    trunc = get_dataset(dummy_file, dynamic_truncation=True)
+    idx = np.s_[0:10]
+    inputs, pad_masks, labels = ds[idx]
+    t_inputs, t_pad_masks, t_labels = trunc[idx]
+
+    seq_len = t_inputs["tracks"].shape[1]
+    assert seq_len == int((~pad_masks["tracks"]).sum(-1).max())
+    assert seq_len < inputs["tracks"].shape[1]
+    assert torch.equal(t_inputs["tracks"], inputs["tracks"][:, :seq_len])
+    assert torch.equal(t_pad_masks["tracks"], pad_masks["tracks"][:, :seq_len])
+    assert (pad_masks["tracks"][:, seq_len:]).all()
+    for label, x in labels["tracks"].items():
+        assert torch.equal(t_labels["tracks"][label], x[:, :seq_len])
+    assert torch.equal(t_inputs["jets"], inputs["jets"])
+
+
+def test_bucket_sampler(dummy_file):
+    ds = get_dataset(dummy_file)
+    multiplicity = ds.get_multiplicity("tracks")
+    valid = ds.file["tracks"].fields("valid")[:]
+    assert np.array_equal(multiplicity, valid.sum(-1))
+
+    sampler = BucketBatchSampler(multiplicity, max_tokens=2000, num_buckets=4, shuffle=True)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+
+    # all objects are used exactly once
+    idx = np.concatenate(batches)
+    assert np.array_equal(np.sort(idx), np.arange(len(ds)))
+    tokens = [np.maximum(multiplicity[b], 1).sum() for b in batches]
+    assert max(tokens) < 2 * 2000
+
+    inputs, _, _ = ds[batches[0]]
+    assert len(inputs["jets"]) == len(batches[0])
+
+
+def test_sharded_dataset(dummy_file, tmp_path):
+    _, nd_path = dummy_file
+    for i in range(3):
+        write_dummy_file(tmp_path / f"shard_{i}.h5", nd_path)
+    ds = ShardedSaltDataset(
+        filename=str(tmp_path / "shard_*.h5"),
+        num=2500,
+        norm_dict=str(nd_path),
+        variables={k: list(v) for k, v in VARIABLES.items()},
+        labels={k: list(v) for k, v in LABELS.items()},
+        stage="fit",
+    )
+    assert len(ds) == 2500
+    assert ds.shard_bounds == [(0, 1000), (1000, 2000), (2000, 2500)]
+
+    # global indices map onto the correct shard
+    inputs, _, _ = ds[np.s_[1100:1200]]
+    ref_inputs, _, _ = ds.datasets[1][np.s_[100:200]]
+    assert torch.equal(inputs["tracks"], ref_inputs["tracks"])
+    with pytest.raises(IndexError, match="straddles"):
+        ds[np.s_[950:1050]]
+
+    # batches never straddle shards, and cover all objects once
+    for batches in [
+        list(RandomBatchSampler(ds, batch_size=300, shuffle=True)),
+        [b for _, b in ShardWorkerDataset(ds, batch_size=300)._batches()],  # noqa: SLF001,
+    ]:
+        assert len(batches) == 10
+        idx = np.concatenate([np.arange(b.start, b.stop) for b in batches])
+        assert np.array_equal(np.sort(idx), np.arange(2500))
+        for b in batches:
+            ds.locate(b)
+    assert len(list(ShardWorkerDataset(ds, batch_size=300, drop_last=True))) == 7
+
+
+def test_lazy_file(dummy_file):
+    ds = get_dataset(dummy_file, rdcc_nbytes=16 * 1024**2, rdcc_nslots=10007, rdcc_w0=1.0)
+    _, nslots, nbytes, w0 = ds.file.id.get_access_plist().get_cache()
+    assert (nslots, nbytes, w0) == (10007, 16 * 1024**2, 1.0)
+
+    # handles are dropped when sending the dataset to a worker, and reopened on use
+    copied = deepcopy(ds)
+    assert copied._file is None  # noqa: SLF001
+    assert_batches_equal(ds[np.s_[0:100]], copied[np.s_[0:100]])
+    assert "contiguous" in format_report(copied.new_chunk_stats())
+
+
+def test_chunk_cache_stats(tmp_path):
+    with h5py.File(tmp_path / "chunked.h5", "w") as f:
+        ds = f.create_dataset("x", shape=(1000, 10), dtype="f4", chunks=(100, 5))
+        stats = ChunkCacheStats(ds, rdcc_nbytes=8000)
+    assert stats.capacity == 2
+
+    for idx in [np.s_[0:50], np.s_[50:150], np.s_[0:10], np.s_[500:600], np.array([101, 102])]:
+        stats.record(idx)
+    assert (stats.hits, stats.misses) == (2, 4)
+    assert stats.requested == 262
+    assert stats.amplification == pytest.approx(400 / 262)
+    assert "chunked" not in format_report({"x": stats})
+
+
+@pytest.mark.parametrize("compression", [{"compression": "gzip", "shuffle": True}, {}])
+def test_read_threads(dummy_file, tmp_path, compression):
+    fname, nd_path = dummy_file
+    chunked = tmp_path / "chunked.h5"
+    with h5py.File(fname) as src, h5py.File(chunked, "w") as dst:
+        dst.create_dataset("jets", data=src["jets"][:], chunks=(64,), compression="lzf")
+        tracks = src["tracks"][:]
+        dst.create_dataset("tracks", data=tracks, chunks=(64, 16), **compression)
+
+    kwargs = {"num_inputs": {"tracks": 30}}
+    ds = get_dataset((chunked, nd_path), **kwargs)
+    threaded = get_dataset((chunked, nd_path), read_threads=3, **kwargs)
+    for idx in [np.s_[0:100], np.s_[130:131], np.s_[900:1000], np.s_[960:1000]]:
+        assert_batches_equal(ds[idx], threaded[idx])
+
+    # index arrays fall back to sequential reads
+    idx = np.array([3, 70, 71, 500])
+    assert_batches_equal(ds[idx], threaded[idx])
+
+
+def test_read_slice_layout(tmp_path):
+    rng = np.random.default_rng(0)
+    padded = np.dtype({"names": ["a", "b"], "formats": ["<f4", "<i2"], "itemsize": 12})
+    data = {
+        "native": np.zeros(100, dtype=[("a", "<f4"), ("b", "<i2")]),
+        "big_endian": np.zeros(100, dtype=[("a", ">f4"), ("b", "<i2")]),
+        "padded": np.zeros(100, dtype=padded),
+    }
+    with h5py.File(tmp_path / "layout.h5", "w") as f:
+        for name, x in data.items():
+            x["a"], x["b"] = rng.normal(size=100), rng.integers(-100, 100, 100)
+            f.create_dataset(name, data=x, chunks=(16,), compression="gzip")
+    with h5py.File(tmp_path / "layout.h5") as f:
+        # chunks stored in a different layout are read through HDF5
+        assert get_filters(f["native"]) is not None
+        assert get_filters(f["big_endian"]) is None
+        assert get_filters(f["padded"]) is None
+        for name, x in data.items():
+            out = np.empty(50, dtype=[("a", "f4"), ("b", "i2")])
+            read_slice(f[name], out, np.s_[10:60], 10)
+            assert np.array_equal(out["a"], x["a"][10:60])
+            assert np.array_equal(out["b"], x["b"][10:60])
+
+
+def test_align_chunks(dummy_file, tmp_path):
+    fname, nd_path = dummy_file
+    chunked = tmp_path / "chunked.h5"
+    with h5py.File(fname) as src, h5py.File(chunked, "w") as dst:
+        dst.create_dataset("jets", data=src["jets"][:], chunks=(64,))
+        dst.create_dataset("tracks", data=src["tracks"][:], chunks=(128, 40))
+
+    assert align_batch_size(300, {1000: 10}, max_reduction=0.5) == 250
+    assert align_batch_size(300, {64: 10, 100: 1}, max_reduction=0.5) == 256
+    assert align_batch_size(300, {64: 10, 100: 1}) == 300
+    assert align_batch_size(5, {7: 1}, max_reduction=0.5) == 5
+
+    ds = get_dataset((chunked, nd_path))
+    assert RandomBatchSampler(ds, batch_size=300, align_chunks=True).batch_size == 300
+    with pytest.warns(UserWarning, match="from 300 to 256"):
+        sampler = RandomBatchSampler(
+            ds, batch_size=300, shuffle=True, align_chunks=True, max_reduction=0.5
+        )
+    assert sampler.batch_size == 256
+    batches = list(sampler)
+    assert len(batches) == 4
+    assert all(b.start % 128 == 0 for b in batches)
+    assert batches[-1] == np.s_[768:1000]
+
+    # contiguous files are left unchanged
+    assert RandomBatchSampler(get_dataset(dummy_file), 300, align_chunks=True).batch_size == 300
+
+
+def test_readahead(dummy_file, tmp_path):
+    fname, nd_path = dummy_file
+    chunked = tmp_path / "chunked.h5"
+    with h5py.File(fname) as src, h5py.File(chunked, "w") as dst:
+        dst.create_dataset("jets", data=src["jets"][:], chunks=(64,))
+        dst.create_dataset("tracks", data=src["tracks"][:], chunks=(128, 40))
+
+    # contiguous datasets give the bytes of the rows
+    with h5py.File(fname) as f:
+        jets = f["jets"]
+        (offset, length), *rest = get_byte_ranges(jets, np.s_[10:20])
+        expected = jets[10:20].tobytes()
+    with open(fname, "rb") as f:
+        f.seek(offset)
+        assert not rest
+        assert f.read(length) == expected
+
+    # chunked datasets give each chunk holding the rows once
+    with h5py.File(chunked) as f:
+        tracks = f["tracks"]
+        ranges = get_byte_ranges(tracks, np.array([5, 100, 130, 900]))
+        chunks = [tracks.id.get_chunk_info_by_coord((i, 0)) for i in (0, 128, 896)]
+        assert ranges == [(c.byte_offset, c.size) for c in chunks]
+
+    ds = get_dataset((chunked, nd_path))
+    sampler = RandomBatchSampler(ds, batch_size=100, shuffle=False)
+    readahead = ReadaheadSampler(sampler, ds, depth=2)
+    threads = threading.active_count()
+
+    # the sampler may be used up at once, the readahead waits for the received batches
+    assert list(readahead) == list(sampler)
+    for _ in range(100):
+        if readahead.stats["batches"] == 2:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert readahead.stats["batches"] == readahead.stats["ahead"] == 2
+    for _ in range(10):
+        readahead.advance()
+    readahead.thread.join()
+    assert readahead.stats["batches"] == 10
+    assert 0 < readahead.stats["bytes"] <= chunked.stat().st_size
+    assert "Readahead" in readahead.report()
+
+    # with a distributed sampler, only the batches of this rank are advised
+    readahead = ReadaheadSampler(sampler, ds, depth=2, rank=1, num_replicas=3)
+    list(readahead)
+    for _ in range(4):
+        readahead.advance()
+    readahead.thread.join()
+    assert readahead.stats["batches"] == 4
+    assert split_batches(list(range(10)), 1, 3) == [1, 4, 7, 0]
+
+    # closing stops the background thread
+    list(readahead)
+    readahead.close()
+    assert threading.active_count() == threads
+
+
+def test_affinity(monkeypatch):
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpulist([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+
+    # 2 NUMA nodes with 8 cores each, 4 ranks with 2 workers each
+    nodes = [list(range(8)), list(range(8, 16))]
+    main, workers = assign_cpus("numa", nodes, 1, 4, 2)
+    assert main == [4]
+    assert workers == [[5, 6], [7]]
+    main, workers = assign_cpus("numa", nodes, 2, 4, 2)
+    assert main == [8]
+    assert workers == [[9, 10], [11]]
+    main, workers = assign_cpus("exclusive", nodes, 1, 4, 2)
+    assert main == [4]
+    assert workers[0] == workers[1] == [c for c in range(16) if c % 4]
+
+    # too few cores are shared between the workers
+    assert assign_cpus("numa", [[0, 1]], 0, 1, 3) == ([0], [[1], [1], [1]])
+    with pytest.raises(ValueError, match="worker_affinity"):
+        assign_cpus("spread", nodes, 0, 1, 1)
+
+    # ranks are placed on the NUMA node of their GPU if it is known
+    main, workers = assign_cpus("numa", nodes, 0, 4, 2, rank_nodes=[1, 1, 0, 0])
+    assert main == [8]
+    assert workers == [[9, 10], [11]]
+    monkeypatch.setattr("salt.data.affinity.get_numa_nodes", lambda: nodes)
+    assert get_worker_init("numa", 1, 4, 2).cpus == [[5, 6], [7]]
+    monkeypatch.setattr("salt.data.affinity.get_device_node", lambda d, _: [1, 1, 0, 0][d])
+    assert get_worker_init("numa", 0, 4, 2, devices=[0, 1, 2, 3]).cpus == [[9, 10], [11]]
+
+    cpus = os.sched_getaffinity(0)
+    num_threads = torch.get_num_threads()
+    try:
+        # threads which are already running are pinned too
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        WorkerInit([[min(cpus)]], [1])(0)
+        assert os.sched_getaffinity(0) == {min(cpus)}
+        assert os.sched_getaffinity(thread.native_id) == {min(cpus)}
+        assert torch.get_num_threads() == 1
+        stop.set()
+        thread.join()
+    finally:
+        set_affinity(cpus)
+        torch.set_num_threads(num_threads)
+
+
+def test_device_dataset(dummy_file):
+    fname, nd_path = dummy_file
+    ds = SaltDataset(
+        filename=str(fname),
+        norm_dict=str(nd_path),
+        variables={"jets": VARIABLES["jets"]},
+        labels={"jets": LABELS["jets"]},
+        stage="fit",
+    )
+    device_ds = DeviceDataset(ds, batch_size=300, chunk_size=250)
+    assert len(device_ds) == 4
+    batches = list(device_ds)
+    assert_batches_equal(batches[0], ds[np.s_[0:300]])
+    assert len(batches[-1][0]["jets"]) == 100
+
+    # shuffled batches cover each object once
+    device_ds = DeviceDataset(ds, batch_size=300, shuffle=True, drop_last=True)
+    batches = list(device_ds)
+    assert len(batches) == 3
+    inputs = torch.cat([b[0]["jets"] for b in batches])
+    matches = (inputs[:, None] == ds[np.s_[0:1000]][0]["jets"][None]).all(-1)
+    assert matches.any(-1).all()
+    assert len(torch.unique(matches.int().argmax(-1))) == 900
+
+    with pytest.raises(ValueError, match="global object"):
+        DeviceDataset(get_dataset(dummy_file), batch_size=300)
+
+
+@pytest.mark.parametrize("to_disk", [False, True])
+def test_batch_cache(dummy_file, tmp_path, to_disk):
+    ds = get_dataset(dummy_file)
+    sampler = RandomBatchSampler(ds, batch_size=300, shuffle=False)
+    loader = torch.utils.data.DataLoader(ds, batch_size=None, sampler=sampler)
+    cache = BatchCache(loader, tmp_path / "val" if to_disk else None)
+    assert len(cache) == 4
+
+    # incomplete passes are cached as well, and later passes read the remaining batches
+    first = next(iter(cache))
+    assert len(cache.batches) == 1
+    assert not cache.cached
+    expected = list(cache)
+    assert cache.cached
+    assert len(cache.batches) == 4
+    assert_batches_equal(first, expected[0])
+    if to_disk:
+        assert not list((tmp_path / "val").iterdir())
+
+    cache.loader = None
+    for _ in range(2):
+        batches = list(cache)
+        assert len(batches) == len(expected)
+        for a, b in zip(batches, expected, strict=True):
+            assert_batches_equal(a, b)
+        # replayed batches are copies
+        batches[0][0]["jets"].zero_()
+
+
+def test_rank_sampler(monkeypatch):
+    sampler = RankSampler(list(range(5)))
+    assert list(sampler) == list(range(5))
+
+    # batches are split between ranks, padded to the same number on each rank
+    for rank, expected in enumerate([[0, 2, 4], [1, 3, 0]]):
+        monkeypatch.setattr(ShuffleBufferDataset, "_rank", staticmethod(lambda r=rank: (r, 2)))
+        assert len(sampler) == 3
+        assert list(sampler) == expected
+
+
+def test_zarr(dummy_file, tmp_path, capsys):
+    if importlib.util.find_spec("zarr") is None:
+        pytest.skip("zarr not available")
+    fname, nd_path = dummy_file
+    store = tmp_path / "dummy.zarr"
+    to_zarr_main([str(fname), str(store), "--chunk_size", "128", "--benchmark"])
+    assert "Read throughput" in capsys.readouterr().out
+
+    # batches and gathers match the h5 file, with and without concurrent reads
+    ds = get_dataset(dummy_file)
+    for zarr_ds in [get_dataset((store, nd_path)), get_dataset((store, nd_path), read_threads=2)]:
+        assert zarr_ds.dss["tracks"].chunks == (128, 40)
+        for idx in [np.s_[0:100], np.s_[900:1000], np.array([3, 70, 71, 500])]:
+            assert_batches_equal(ds[idx], zarr_ds[idx])
+        assert np.array_equal(ds.get_multiplicity("tracks"), zarr_ds.get_multiplicity("tracks"))
+    with pytest.raises(KeyError, match="missing"):
+        SaltDataset(str(store), str(nd_path), {"jets": ["not_a_variable"]}, stage="fit")
+
+
+def test_remote(dummy_file, tmp_path):
+    fname, nd_path = dummy_file
+    url = f"file://{fname}"
+    cache_dir = tmp_path / "blocks"
+    kwargs = {"block_cache_dir": str(cache_dir), "block_size": 64 * 1024}
+
+    # remote files are read through the block cache
+    ds = get_dataset(dummy_file)
+    remote = get_dataset((url, nd_path), **kwargs)
+    for idx in [np.s_[0:100], np.s_[900:1000], np.array([3, 70, 71, 500])]:
+        assert_batches_equal(ds[idx], remote[idx])
+    assert any(cache_dir.rglob("*"))
+
+    # a new reader finds every block in the on-disk cache
+    f = RemoteFile(url, cache_dir, block_size=64 * 1024)
+    assert f.read() == Path(fname).read_bytes()
+    f = RemoteFile(url, cache_dir, block_size=64 * 1024)
+    f.seek(1000)
+    assert f.read(10) == Path(fname).read_bytes()[1000:1010]
+    assert f.fetched == 0
+
+    # least recently used blocks are evicted
+    cache = BlockCache(cache_dir, max_nbytes=256 * 1024)
+    cache.put("key", 0, b"x" * 1024)
+    assert sum(size for _, size, _ in cache.blocks()) <= 256 * 1024
+    assert cache.get("key", 0) is not None
+    cache = BlockCache(tmp_path / "lru", max_nbytes=10_000)
+    for i in range(10):
+        cache.put("key", i, b"x" * 1000)
+    assert cache.get("key", 0) is not None
+    cache.put("key", 10, b"x" * 1000)
+    assert cache.get("key", 1) is None
+    assert all(cache.get("key", i) is not None for i in (0, 2, 10))
+    assert cache.nbytes == 10_000
+
+    with pytest.raises(ValueError, match="local input file"):
+        get_dataset((url, nd_path), cuts=["pt_btagJes > 0"])
+
+
+@pytest.mark.parametrize("columns", [None, {"jets": ["pt_btagJes"], "tracks": ["d0"]}])
+def test_staging(dummy_file, tmp_path, columns):
+    fname, _ = dummy_file
+    staged = tmp_path / "staged" / "dummy.h5"
+    ds = get_dataset(dummy_file, staged_file=str(staged))
+    ds.check_staged(interval=0)
+    assert ds.filename == str(fname)
+
+    assert stage_file(fname, staged, threading.Event(), columns, batch_size=100)
+    ds.check_staged(interval=0)
+    assert ds.filename == str(staged)
+    if columns is not None:
+        assert set(ds.file["tracks"].dtype.names) == {"d0", "valid"}
+    else:
+        assert_batches_equal(get_dataset(dummy_file)[np.s_[0:100]], ds[np.s_[0:100]])
+
+    # an aborted copy leaves nothing behind
+    stop = threading.Event()
+    stop.set()
+    assert not stage_file(fname, tmp_path / "aborted.h5", stop, columns, batch_size=100)
+    assert not list(tmp_path.glob("*aborted*"))
+
+
+def test_index(dummy_file, tmp_path):
+    fname, _ = dummy_file
+    with h5py.File(fname, "a") as f:
+        tracks = f["tracks"]
+        row = tracks[7]
+        row["d0"][0] = np.nan
+        row["valid"][0] = True
+        tracks[7] = row
+
+    index_main([str(fname), "--chunk_size=300", "--num_workers=2"])
+    index = load_index(fname)
+    assert set(index) >= {"jets", "tracks"}
+    assert index["tracks"]["nonfinite_rows"].tolist() == [7]
+    assert index["tracks"]["stats"]["d0"]["nonfinite"] == 1
+    assert sum(index["jets"]["counts"]["flavour_label"].values()) == 1000
+
+    ds = get_dataset(dummy_file)
+    assert ds.finite_inputs == {"jets"}
+    expected = ds.dss["tracks"].fields("valid")[:].sum(-1)
+    assert np.array_equal(ds.get_multiplicity("tracks"), expected)
+
+    # stale indices are ignored
+    build_index(fname, tmp_path / "other.index")
+    ds.file.close()
+    with h5py.File(fname, "a") as f:
+        f.attrs["touched"] = True
+    with pytest.warns(UserWarning, match="out of date"):
+        assert load_index(fname) is None
+
+
+def test_norm_dict(dummy_file, tmp_path):
+    fname, _ = dummy_file
+    other = tmp_path / "other.h5"
+    write_dummy_file(other, dummy_file[1])
+    nd_path, cd_path = tmp_path / "nd.yaml", tmp_path / "cd.yaml"
+    args = [str(fname), f"-n={nd_path}", f"-c={cd_path}", "--chunk_size=300"]
+    args += ["-d", "jets", "tracks", "-l", "jets.flavour_label", "--num_workers=2"]
+    norm_dict_main(args)
+
+    # add a second file incrementally
+    build_norm_dict(
+        [str(fname), str(other)], nd_path, cd_path, ["jets.flavour_label"], ["jets", "tracks"]
+    )
+    with open(nd_path) as f:
+        nd = yaml.safe_load(f)
+    with open(cd_path) as f:
+        cd = yaml.safe_load(f)
+
+    tracks = np.concatenate([h5py.File(fn)["tracks"][:] for fn in [fname, other]])
+    d0 = tracks["d0"][tracks["valid"]]
+    assert nd["tracks"]["d0"]["mean"] == pytest.approx(d0.mean(), rel=1e-5)
+    assert nd["tracks"]["d0"]["std"] == pytest.approx(d0.std(), rel=1e-5)
+    assert "valid" not in nd["tracks"]
+    assert min(cd["jets"]["flavour_label"]) == 1.0
+
+    # the output can be used for normalisation
+    InputNorm(nd_path, {k: list(v) for k, v in VARIABLES.items()}, "jets", None)
+
+    # a modified file replaces its earlier contribution, rather than adding to it
+    with h5py.File(other, "r+") as f:
+        tracks = f["tracks"][:]
+        tracks["valid"][:100] = False
+        f["tracks"][...] = tracks
+    os.utime(other, ns=(0, 0))
+    state = build_norm_dict(
+        [str(fname), str(other)], nd_path, cd_path, ["jets.flavour_label"], ["jets", "tracks"]
+    )
+    tracks = np.concatenate([h5py.File(fn)["tracks"][:] for fn in [fname, other]])
+    assert state["moments"]["tracks"]["d0"][0] == tracks["valid"].sum()
+
+    # constant variables are given a unit std
+    const = tmp_path / "const.h5"
+    jets = np.zeros(100, dtype=[("pt", "f4")])
+    jets["pt"] = 3.0
+    with h5py.File(const, "w") as f:
+        f.create_dataset("jets", data=jets)
+    build_norm_dict([str(const)], tmp_path / "const.yaml", datasets=["jets"])
+    with open(tmp_path / "const.yaml") as f:
+        assert yaml.safe_load(f)["jets"]["pt"] == {"mean": 3.0, "std": 1.0}
+
+
+def test_cuts(dummy_file, tmp_path):
+    fname, _ = dummy_file
+    with h5py.File(fname) as f:
+        jets = f["jets"][:]
+        valid = f["tracks"].fields("valid")[:]
+    cuts = ["pt_btagJes > 0", "eta_btagJes < 1"]
+    expected = np.flatnonzero((jets["pt_btagJes"] > 0) & (jets["eta_btagJes"] < 1))
+
+    ds = get_dataset(dummy_file, cuts=cuts, cache_dir=str(tmp_path / "cache"))
+    assert np.array_equal(ds.selection, expected)
+    assert len(ds) == len(expected)
+    assert len(list((tmp_path / "cache").glob("*_selection_*.npy"))) == 1
+
+    # batches are gathered from the selected objects
+    full = get_dataset(dummy_file)
+    assert_batches_equal(ds[np.s_[10:60]], full[expected[10:60]])
+    assert np.array_equal(ds.get_multiplicity("tracks"), valid.sum(-1)[expected])
+
+    # the selection is read from the cache, and can be limited with num
+    ds = get_dataset(dummy_file, cuts=cuts, cache_dir=str(tmp_path / "cache"), num=20)
+    assert np.array_equal(ds.selection, expected[:20])
+    with pytest.raises(ValueError, match="No objects"):
+        get_dataset(dummy_file, cuts=["pt_btagJes < -1e9"])
+
+
+@pytest.mark.parametrize("codec", ["gzip-1", "lzf", "none"])
+def test_rechunk(dummy_file, tmp_path, codec):
+    fname, nd_path = dummy_file
+    output = tmp_path / "rechunked.h5"
+    config = Path(__file__).parent.parent / "configs" / "GN2.yaml"
+    args = [str(fname), str(output), f"-c={config}", "-b=128", f"--codec={codec}"]
+    rechunk_main([*args, "--shuffle", "--half", "--extra", "jets.n_tracks"])
+
+    with h5py.File(output) as f:
+        assert f["tracks"].chunks == (128, 40)
+        assert f["tracks"].dtype["d0"] == np.float16
+        assert f["jets"].dtype["flavour_label"] == np.int32
+        assert "n_tracks" in f["jets"].dtype.names
+        assert "HadronConeExclTruthLabelID" not in f["jets"].dtype.names
+
+    # the rewritten file gives the same batches, up to float16 precision
+    for x, y in zip(
+        get_dataset(dummy_file)[np.s_[100:300]],
+        get_dataset((output, nd_path))[np.s_[100:300]],
+        strict=True,
+    ):
+        for k in x:
+            if isinstance(x[k], dict):
+                assert all(torch.equal(x[k][label], y[k][label]) for label in x[k])
+            else:
+                assert torch.allclose(x[k].float(), y[k].float(), rtol=1e-3, atol=1e-3)
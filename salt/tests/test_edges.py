@@ -1,6 +1,10 @@
+import numpy as np
+import pytest
 import torch
 
+from salt.data.edge_features import get_inputs_edge, get_inputs_edge_nodes
 from salt.models import (
+    EdgeFeatures,
     MultiheadAttention,
     ScaledDotProductAttention,
     TransformerEncoder,
@@ -136,3 +140,73 @@ def test_edge_updates():
 
     _, edges_out = net(x, edges)
     assert torch.all(edges == edges_out)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 128])
+def test_edge_features(chunk_size):
+    rng = np.random.default_rng(42)
+    variables = ["dR", "z", "kt", "subjetIndex", "isSelfLoop"]
+    dtype = np.dtype([(n, "f4") for n in ["eta", "phi", "pt", "subjetIndex"]] + [("valid", "?")])
+    batch = np.zeros((5, 8), dtype=dtype)
+    batch["eta"] = rng.uniform(-2.5, 2.5, batch.shape)
+    batch["phi"] = rng.uniform(-np.pi, np.pi, batch.shape)
+    batch["pt"] = rng.uniform(1, 100, batch.shape)
+    batch["subjetIndex"] = rng.integers(-1, 2, batch.shape)
+    batch["valid"] = True
+    batch[:, 6:] = 0  # padding
+
+    expected = torch.from_numpy(get_inputs_edge(batch, variables))
+    nodes = torch.from_numpy(get_inputs_edge_nodes(batch))
+    edges = EdgeFeatures(variables, chunk_size=chunk_size)(nodes)
+    assert edges.shape == expected.shape
+    assert torch.allclose(edges, expected, atol=1e-5)
+
+
+def test_edge_features_knn():
+    rng = np.random.default_rng(42)
+    variables = ["dR", "z", "kt", "subjetIndex", "isSelfLoop"]
+    dtype = np.dtype([(n, "f4") for n in ["eta", "phi", "pt", "subjetIndex"]] + [("valid", "?")])
+    batch = np.zeros((5, 8), dtype=dtype)
+    batch["eta"] = rng.uniform(-2.5, 2.5, batch.shape)
+    batch["phi"] = rng.uniform(-np.pi, np.pi, batch.shape)
+    batch["pt"] = rng.uniform(1, 100, batch.shape)
+    batch["subjetIndex"] = rng.integers(-1, 2, batch.shape)
+    batch["valid"] = True
+    batch[:, 6:] = 0  # padding
+
+    nodes = torch.from_numpy(get_inputs_edge_nodes(batch))
+    dense = EdgeFeatures(variables)(nodes)
+    edges, idx = EdgeFeatures(variables, chunk_size=2, knn=4)(nodes)
+    assert edges.shape == (5, 8, 4, len(variables))
+    assert idx.shape == (5, 8, 4)
+
+    # the self-loop is always the nearest neighbour, padded tracks are never neighbours
+    assert torch.all(idx[..., 0] == torch.arange(8))
+    assert torch.all(idx[:, :6, 1:] < 6)
+
+    # sparse features are the dense features of the neighbours
+    expected = torch.gather(dense, 2, idx.unsqueeze(-1).expand(-1, -1, -1, len(variables)))
+    assert torch.allclose(edges, expected, atol=1e-5)
+
+    # k larger than the number of tracks
+    edges, idx = EdgeFeatures(variables, knn=20)(nodes)
+    assert edges.shape == (5, 8, 8, len(variables))
+
+
+def test_mha_sparse_edges():
+    n_batch, n_trk, n_dim, knn = 3, 6, 8, 3
+    x = torch.rand((n_batch, n_trk, n_dim))
+    edges = torch.rand((n_batch, n_trk, knn, n_dim))
+    idx = torch.stack([torch.randperm(n_trk)[:knn] for _ in range(n_batch * n_trk)])
+    idx = idx.view(n_batch, n_trk, knn)
+
+    net = TransformerEncoderLayer(
+        embed_dim=n_dim,
+        mha_config={"num_heads": 2, "attention": ScaledDotProductAttention()},
+        edge_embed_dim=n_dim,
+        update_edges=True,
+    )
+    out, edges_out = net(x, edges, pad_mask=get_random_mask(n_batch, n_trk), edge_idx=idx)
+    assert out.shape == x.shape
+    assert edges_out.shape == edges.shape
+    assert not torch.isnan(out).any()
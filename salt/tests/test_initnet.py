@@ -46,3 +46,23 @@ def test_init_net_forward(dense_config, variables, pos_enc, attach_global):
     # Assert output shape is correct
     expected_output_shape = dense_config["output_size"]
     assert output.shape[-1] == expected_output_shape
+
+
+def test_init_net_knn(dense_config):
+    variables = {"EDGE": ["dR", "z", "isSelfLoop"], "global_object": ["pt", "eta"]}
+    net = InitNet(
+        input_name="EDGE",
+        dense_config=dense_config,
+        variables=variables,
+        global_object="global_object",
+        attach_global=False,
+        knn=4,
+    )
+    nodes = torch.rand(10, 6, 5)
+    x, edge_idx = net({"EDGE": nodes})
+    assert x.shape == (10, 6, 4, dense_config["output_size"])
+    assert edge_idx.shape == (10, 6, 4)
+
+    # dense edge inputs can't be made sparse
+    with pytest.raises(ValueError, match="lazy_edges"):
+        net({"EDGE": torch.rand(10, 6, 6, 3)})
@@ -1,7 +1,9 @@
+from types import SimpleNamespace
+
 import pytest
 import torch
 
-from salt.utils.mask_utils import indices_from_mask, mask_from_indices
+from salt.utils.mask_utils import add_target_masks, indices_from_mask, mask_from_indices
 
 
 @pytest.fixture
@@ -77,3 +79,22 @@ def test_indices_from_mask_empty():
     ])
     indices = indices_from_mask(mask)
     assert torch.all(indices == torch.tensor([[-1, 0], [-1, -1]]))
+
+
+def test_add_target_masks(mask_3d):
+    mf_config = SimpleNamespace(
+        object=SimpleNamespace(id_label="barcode"),
+        constituent=SimpleNamespace(name="tracks", id_label="barcode"),
+    )
+    labels = {
+        "objects": {"barcode": torch.tensor([[11, 12], [21, 22]])},
+        "tracks": {"barcode": torch.tensor([[11, 12, 12], [21, 21, 22]])},
+    }
+    add_target_masks(labels, mf_config)
+    assert torch.equal(labels["objects"]["masks"], mask_3d)
+
+    # padded objects never match
+    labels["objects"]["barcode"][1, 1] = -1
+    labels["tracks"]["barcode"][1, 2] = -1
+    add_target_masks(labels, mf_config)
+    assert not labels["objects"]["masks"][1, 1].any()
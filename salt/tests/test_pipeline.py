@@ -1,9 +1,12 @@
+import importlib.util
+import os
 import sys
 from pathlib import Path
 
 import h5py
 import pytest
 
+from salt.data.convert import main as to_zarr
 from salt.main import main
 from salt.to_onnx import main as to_onnx
 from salt.utils.get_onnx_metadata import main as get_onnx_metadata
@@ -175,6 +178,12 @@ def test_GN2XE(tmp_path) -> None:
     run_combined(tmp_path, "GN2XE.yaml", do_onnx=False, do_xbb=True)
 
 
+@pytest.mark.filterwarnings(w)
+def test_GN2XE_lazy_edges(tmp_path) -> None:
+    args = ["--data.lazy_edges=true"]
+    run_combined(tmp_path, "GN2XE.yaml", do_onnx=False, do_xbb=True, train_args=args)
+
+
 @pytest.mark.filterwarnings(w)
 def test_GN1_GATv2(tmp_path) -> None:
     args = [f"--config={Path(__file__).parent.parent / 'configs' / 'GATv2.yaml'}"]
@@ -191,6 +200,12 @@ def test_DL1(tmp_path) -> None:
     run_combined(tmp_path, "DL1.yaml", do_eval=True, do_onnx=False)
 
 
+@pytest.mark.filterwarnings(w)
+def test_DL1_device_data(tmp_path) -> None:
+    args = ["--data.device_data=true"]
+    run_combined(tmp_path, "DL1.yaml", do_eval=True, do_onnx=False, train_args=args)
+
+
 @pytest.mark.filterwarnings(w)
 def test_regression(tmp_path) -> None:
     run_combined(tmp_path, "regression.yaml", do_eval=True, do_onnx=False)
@@ -223,6 +238,38 @@ def test_train_dev(tmp_path) -> None:
     run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
 
 
+def write_inputs(tmp_path) -> Path:
+    """Write a separate input file, for tests which train on a converted copy of it."""
+    input_dir = Path(tmp_path) / "inputs"
+    input_dir.mkdir()
+    nd_path = input_dir / "norm_dict.yaml"
+    write_dummy_norm_dict(nd_path, input_dir / "class_dict.yaml")
+    write_dummy_file(input_dir / "inputs.h5", nd_path)
+    return input_dir / "inputs.h5"
+
+
+@pytest.mark.filterwarnings(w)
+def test_train_zarr(tmp_path) -> None:
+    if importlib.util.find_spec("zarr") is None:
+        pytest.skip("zarr not available")
+    store = write_inputs(tmp_path).with_suffix(".zarr")
+    to_zarr([str(store.with_suffix(".h5")), str(store)])
+    args = [f"--data.train_file={store}", f"--data.val_file={store}"]
+    run_combined(tmp_path, CONFIG, do_eval=True, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_train_remote(tmp_path) -> None:
+    url = f"file://{write_inputs(tmp_path)}"
+    args = [
+        f"--data.train_file={url}",
+        f"--data.val_file={url}",
+        f"--data.block_cache_dir={Path(tmp_path) / 'blocks'}",
+    ]
+    run_combined(tmp_path, CONFIG, do_eval=True, do_onnx=False, train_args=args)
+    assert any((Path(tmp_path) / "blocks").rglob("*"))
+
+
 @pytest.mark.filterwarnings(w)
 def test_train_movefilestemp(tmp_path) -> None:
     tmp_path = Path(tmp_path)
@@ -232,6 +279,55 @@ def test_train_movefilestemp(tmp_path) -> None:
     assert not Path(move_path).exists()
 
 
+@pytest.mark.filterwarnings(w)
+def test_val_cache(tmp_path) -> None:
+    tmp_path = Path(tmp_path)
+    args = [
+        "--data.val_cache=true",
+        f"--data.val_cache_dir={tmp_path / 'val_cache'}",
+        "--trainer.max_epochs=2",
+    ]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+@pytest.mark.parametrize("stage_columns", [False, True])
+def test_background_staging(tmp_path, stage_columns) -> None:
+    tmp_path = Path(tmp_path)
+    move_path = tmp_path / "dev" / "shm"
+    args = [
+        f"--data.move_files_temp={move_path}",
+        "--data.background_staging=true",
+        f"--data.stage_columns={stage_columns}",
+    ]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+    assert not Path(move_path).exists()
+
+
+@pytest.mark.filterwarnings(w)
+def test_shared_staging(tmp_path) -> None:
+    tmp_path = Path(tmp_path)
+    move_path = tmp_path / "dev" / "shm"
+    args = [
+        f"--data.move_files_temp={move_path}",
+        "--data.shared_staging=true",
+        "--data.readahead=4",
+    ]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+    assert not [p for p in move_path.iterdir() if p.is_dir()]
+
+
+@pytest.mark.filterwarnings(w)
+@pytest.mark.parametrize("policy", ["numa", "exclusive"])
+def test_worker_affinity(tmp_path, policy) -> None:
+    cpus = os.sched_getaffinity(0)
+    args = [f"--data.worker_affinity={policy}"]
+    try:
+        run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+    finally:
+        os.sched_setaffinity(0, cpus)
+
+
 @pytest.mark.filterwarnings(w)
 def test_train_distributed(tmp_path) -> None:
     args = ["--trainer.devices=2", "--data.num_workers=2", "--model.lrs_config.pct_start=0.2"]
@@ -244,6 +340,71 @@ def test_truncate_inputs(tmp_path) -> None:
     run_combined(tmp_path, CONFIG, do_eval=True, do_onnx=False, train_args=args)
 
 
+@pytest.mark.filterwarnings(w)
+@pytest.mark.parametrize("config", [CONFIG, "MaskFormer.yaml"])
+def test_dynamic_truncation(tmp_path, config) -> None:
+    args = ["--data.dynamic_truncation=true"]
+    run_combined(tmp_path, config, do_eval=True, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_cache_inputs(tmp_path) -> None:
+    args = [f"--data.cache_dir={tmp_path / 'cache'}"]
+    run_combined(tmp_path, CONFIG, do_eval=True, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+@pytest.mark.parametrize("shuffle_mode", ["buffer", "exact"])
+def test_shuffle_mode(tmp_path, shuffle_mode) -> None:
+    args = [f"--data.shuffle_mode={shuffle_mode}", "--data.buffer_batches=2"]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_bucket_sampler(tmp_path) -> None:
+    args = ["--data.max_tokens=2000", "--data.num_buckets=4", "--data.dynamic_truncation=true"]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+@pytest.mark.parametrize("pin_shards", [False, True])
+def test_sharded_inputs(tmp_path, pin_shards) -> None:
+    args = [f"--data.train_file={tmp_path}/dummy_train_*.h5", f"--data.pin_shards={pin_shards}"]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_chunk_cache(tmp_path) -> None:
+    args = [
+        "--data.rdcc_nbytes=16777216",
+        "--data.chunk_cache_report=true",
+        "--data.align_chunks=true",
+    ]
+    args += ["--data.num_workers=2"]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_cuts(tmp_path) -> None:
+    args = ["--data.cuts=[pt_btagJes > 0]"]
+    run_combined(tmp_path, CONFIG, do_eval=False, do_onnx=False, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_read_threads(tmp_path) -> None:
+    args = ["--data.read_threads=2", "--data.num_workers=2"]
+    run_combined(tmp_path, "GN2XE.yaml", do_onnx=False, do_xbb=True, train_args=args)
+
+
+@pytest.mark.filterwarnings(w)
+def test_shm_dir(tmp_path) -> None:
+    shm_dir = tmp_path / "shm"
+    args = [f"--data.shm_dir={shm_dir}", "--data.num_workers=2"]
+    run_combined(tmp_path, CONFIG, do_eval=True, do_onnx=False, train_args=args)
+    assert shm_dir.exists()
+    assert not list(shm_dir.iterdir())
+
+
 @pytest.mark.filterwarnings(w)
 def test_truncate_inputs_error(tmp_path) -> None:
     args = ["--data.num_inputs.this_should_error=10"]
@@ -262,6 +423,12 @@ def test_maskformer(tmp_path) -> None:
     run_combined(tmp_path, "MaskFormer.yaml", train_args=None)
 
 
+@pytest.mark.filterwarnings(w)
+def test_maskformer_compact_masks(tmp_path) -> None:
+    args = ["--data.compact_masks=true"]
+    run_combined(tmp_path, "MaskFormer.yaml", do_onnx=False, train_args=args)
+
+
 @pytest.mark.filterwarnings(w)
 def test_param_concat(tmp_path) -> None:
     args = [f"--config={Path(__file__).parent.parent / 'tests' / 'configs' / 'param_concat.yaml'}"]
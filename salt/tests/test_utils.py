@@ -1,13 +1,21 @@
+import hashlib
+import io
+import os
+import socket
 import tempfile
 from pathlib import Path
 
+import numpy as np
 import pytest
 import torch
+from botocore.exceptions import NoCredentialsError
 from ftag import get_mock_file
 
 from salt.utils import clean_logs, compare_models, repair_ckpt
+from salt.utils.file_utils import download_S3, get_md5_etag, is_downloaded
 from salt.utils.inputs import inputs_concat
 from salt.utils.scalers import RegressionTargetScaler
+from salt.utils.staging import StagingCache, get_fingerprint
 
 
 def test_compare_models():
@@ -121,3 +129,118 @@ def test_repair_checkpoint(capsys):
             ), "Expected key rename message missing"
         else:
             assert "No need to repair" in output, "Expected 'No need to repair' message missing"
+
+
+class LocalS3:
+    """S3 client serving objects from a local directory."""
+
+    def __init__(self, root, fail_at=None):
+        self.root = Path(root)
+        self.fail_at = fail_at
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):  # noqa: ARG002
+        data = (self.root / Key).read_bytes()
+        return {"ContentLength": len(data), "ETag": f'"{hashlib.md5(data).hexdigest()}"'}  # noqa: S324
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        assert IfMatch == self.head_object(Bucket, Key)["ETag"]
+        start, stop = map(int, Range.removeprefix("bytes=").split("-"))
+        if start == self.fail_at:
+            raise ConnectionError("interrupted")
+        self.ranges.append(start)
+        body = io.BytesIO((self.root / Key).read_bytes()[start : stop + 1])
+        body.iter_chunks = lambda size: iter(lambda: body.read(size), b"")
+        return {"Body": body}
+
+
+def test_download_S3(tmp_path):
+    data = np.random.default_rng(0).bytes(300_000)
+    (tmp_path / "data.h5").write_bytes(data)
+    target = tmp_path / "local" / "data.h5"
+    target.parent.mkdir()
+    part_size = 64 * 1024
+
+    # an interrupted download resumes from the completed parts
+    client = LocalS3(tmp_path, fail_at=3 * part_size)
+    with pytest.raises(ConnectionError):
+        download_S3(client, "bucket", "/data.h5", target, 0, part_size, num_threads=1)
+    assert not target.exists()
+    assert Path(f"{target}.part.json").exists()
+    client = LocalS3(tmp_path)
+    download_S3(client, "bucket", "/data.h5", target, 0, part_size, num_threads=2)
+    assert client.ranges == [3 * part_size]
+    assert target.read_bytes() == data
+    assert not Path(f"{target}.part").exists()
+    assert is_downloaded(client, "bucket", "/data.h5", target)
+
+    # without access to S3, the recorded size is trusted
+    def offline(**kwargs):  # noqa: ARG001
+        raise NoCredentialsError
+
+    client.head_object = offline
+    assert is_downloaded(client, "bucket", "/data.h5", target)
+    with open(target, "ab") as f:
+        f.write(b"x")
+    assert not is_downloaded(client, "bucket", "/data.h5", target)
+
+    # local files are checked against the object, not just by name
+    client = LocalS3(tmp_path)
+    Path(f"{target}.s3.json").unlink()
+    target.write_bytes(data[:-1] + b"x")
+    assert not is_downloaded(client, "bucket", "/data.h5", target)
+    assert get_md5_etag(tmp_path / "data.h5", part_size).endswith("-5")
+
+    # files without metadata are used as they are if S3 can't be reached
+    client.head_object = offline
+    with pytest.warns(UserWarning, match="without verifying"):
+        assert is_downloaded(client, "bucket", "/data.h5", target)
+
+
+def test_shared_staging(tmp_path):
+    file_a, file_b = tmp_path / "a.h5", tmp_path / "b.h5"
+    file_a.write_bytes(b"a" * 1000)
+    file_b.write_bytes(b"b" * 2000)
+    cache = StagingCache(tmp_path / "cache", max_nbytes=2500)
+
+    # the same file is staged once, and removed when its last user releases it
+    staged = cache.acquire(file_a)
+    assert staged != file_a
+    assert staged.read_bytes() == file_a.read_bytes()
+    assert cache.acquire(file_a) == staged
+    cache.release(staged)
+    assert staged.exists()
+
+    # leases of exited processes are ignored
+    dead = staged.parent / "leases" / f"{socket.gethostname()}-{2**31 - 1}"
+    dead.touch()
+    cache.release(staged)
+    assert not staged.parent.exists()
+
+    # retained files are evicted when space is needed
+    cache.retain = True
+    staged_a = cache.acquire(file_a)
+    cache.release(staged_a)
+    assert staged_a.exists()
+    staged_b = cache.acquire(file_b)
+    assert staged_b.exists()
+    assert not staged_a.exists()
+
+    # files in use are not evicted, and the original is used if there is no space
+    assert cache.acquire(file_a) == file_a
+    assert staged_b.exists()
+
+
+def test_fingerprint(tmp_path):
+    data = bytearray(4 * 1024**2)
+    path = tmp_path / "data.h5"
+    path.write_bytes(data)
+    (tmp_path / "link.h5").symlink_to(path)
+    assert get_fingerprint(tmp_path / "link.h5") == get_fingerprint(path)
+
+    # regenerated files differ, even if only in bytes which are not sampled
+    before = get_fingerprint(path)
+    data[1024**2 + 1] = 1
+    path.write_bytes(data)
+    os.utime(path, ns=(0, 0))
+    assert get_fingerprint(path) != before
@@ -46,17 +46,27 @@ def listify(maybe_list):
     return [maybe_list]
 
 
-def maybe_pad(src: np.ndarray, tgt: np.ndarray) -> np.ndarray:
-    """Pad src to the shape of tgt if necessary."""
+def maybe_pad(src: np.ndarray, tgt: np.ndarray, value=0) -> np.ndarray:
+    """Pad the second dimension of src to that of tgt if necessary."""
     if src.shape == tgt.shape:
         return src
     seq_len = tgt.shape[1] if tgt.ndim == 2 else None
     if seq_len and seq_len != src.shape[1]:
-        n_pad = seq_len - src.shape[1]
-        src = np.pad(src, ((0, 0), (0, n_pad)), mode="constant")
+        src = pad_last(src, seq_len, value)
     return src
 
 
+def pad_last(src: np.ndarray, length: int, value=0) -> np.ndarray:
+    """Pad the last dimension of src to length with a constant value."""
+    n_pad = length - src.shape[-1]
+    if n_pad <= 0:
+        return src
+    pad_width = [(0, 0)] * (src.ndim - 1) + [(0, n_pad)]
+    if src.dtype.names is None:
+        return np.pad(src, pad_width, mode="constant", constant_values=value)
+    return np.pad(src, pad_width, mode="constant")
+
+
 def maybe_copy(src: np.ndarray):
     """Return a copy of src if it is not C-contiguous."""
     if src.flags.c_contiguous:
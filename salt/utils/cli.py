@@ -2,7 +2,6 @@ import re
 from datetime import datetime
 from pathlib import Path
 
-import h5py
 import numpy as np
 import torch
 import yaml
@@ -10,6 +9,7 @@ from ftag.git_check import check_for_uncommitted_changes, create_and_push_tag
 from jsonargparse.typing import register_type
 from lightning.pytorch.cli import LightningCLI
 
+from salt.data.readers import expand_shards, open_file
 from salt.utils.array_utils import listify
 
 
@@ -267,8 +267,9 @@ class SaltCLI(LightningCLI):
             if isinstance(n_devices, list) and len(n_devices) > 1:
                 raise ValueError("Testing requires --trainer.devices=1")
 
-            # disable move_files_temp
+            # disable move_files_temp and shared-memory inputs
             sc["data.move_files_temp"] = None
+            sc["data.shm_dir"] = None
 
             print("-" * 100 + "\n")
 
@@ -284,11 +285,18 @@ class SaltCLI(LightningCLI):
             ):
                 return
             name = sc.data.input_map[t_args.input_name] if sc.data.input_map else t_args.input_name
-            with h5py.File(sc.data.train_file) as f:
+            train_file = expand_shards(sc.data.train_file)[0]
+            remote_options = {
+                "cache_dir": sc["data"].get("block_cache_dir"),
+                "cache_nbytes": sc["data"].get("block_cache_nbytes"),
+                "block_size": sc["data"].get("block_size"),
+            }
+            remote_options = {k: v for k, v in remote_options.items() if v is not None}
+            with open_file(train_file, remote_options=remote_options) as f:
                 if t_args.label in f[name].attrs:
                     t_args.class_names = f[name].attrs[t_args.label]
                 else:
                     raise ValueError(
                         f"'{t_args.label}' not found in the h5 attrs of group '{name}' in file "
-                        f"{sc.data.train_file}. Specify class_names manually."
+                        f"{train_file}. Specify class_names manually."
                     )
@@ -1,10 +1,18 @@
+import hashlib
+import json
+import math
 import os
 import shutil
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
 from pathlib import Path
 
 import boto3
+import h5py
 import yaml
+from botocore.exceptions import BotoCoreError, ClientError
 from tqdm import tqdm
 
 
@@ -22,7 +30,8 @@ def copy_file(in_path: Path, out_path: Path):
 
 
 def remove_file(path: Path):
-    """Remove a file if it exists."""
+    """Remove a file, and its staging marker, if it exists."""
+    get_staged_marker(path).unlink(missing_ok=True)
     if path.is_file():
         path.unlink()
     else:
@@ -35,6 +44,14 @@ def remove_files_temp(train_temp_path, val_temp_path):
     val_temp_path.parent.rmdir()
 
 
+def remove_cache_files(cache: dict):
+    """Remove the files backing memory-mapped cache arrays."""
+    for arrays in cache.values():
+        for array in arrays:
+            if array is not None and getattr(array, "filename", None):
+                Path(array.filename).unlink(missing_ok=True)
+
+
 def move_files_temp(move_files_temp: str, train_path: str, val_path: str):
     """Move training files to a temporary location before training.
 
@@ -47,6 +64,118 @@ def move_files_temp(move_files_temp: str, train_path: str, val_path: str):
     copy_file(Path(val_path), temp_val_path)
 
 
+def get_staged_marker(path: Path | str) -> Path:
+    """Return the path of the marker written once a staged file is complete."""
+    return Path(f"{path}.staged")
+
+
+def is_staged(path: Path | str) -> bool:
+    """Return True if a file has been completely staged by `stage_file`."""
+    return get_staged_marker(path).is_file()
+
+
+def stage_file(
+    in_path: Path,
+    out_path: Path,
+    stop: threading.Event,
+    columns: dict | None = None,
+    batch_size: int | None = None,
+) -> bool:
+    """Copy a file, then validate it and write its marker.
+
+    Parameters
+    ----------
+    in_path : Path
+        File to copy
+    out_path : Path
+        Destination of the copy
+    stop : threading.Event
+        Abort the copy when set
+    columns : dict | None, optional
+        If set, only copy these variables of each h5 dataset, using
+        `salt.data.rechunk.rechunk` with one chunk per batch. By default None, which
+        copies the whole file
+    batch_size : int | None, optional
+        Chunk length when copying only some columns, by default None
+
+    Returns
+    -------
+    bool
+        True if the file was staged
+    """
+    in_path, out_path = Path(in_path), Path(out_path)
+    if in_path == out_path or is_staged(out_path):
+        return True
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(f".{out_path.name}.tmp")
+    if columns is None:
+        with open(in_path, "rb") as src, open(tmp, "wb") as dst:
+            while not stop.is_set() and (data := src.read(64 * 1024**2)):
+                dst.write(data)
+        if stop.is_set():
+            tmp.unlink(missing_ok=True)
+            return False
+        valid = tmp.stat().st_size == in_path.stat().st_size
+    else:
+        from salt.data.rechunk import rechunk
+
+        if rechunk(in_path, tmp, columns, {}, batch_size, "lzf", num_workers=2, stop=stop) is None:
+            return False
+        with h5py.File(in_path, "r") as src, h5py.File(tmp, "r") as dst:
+            valid = all(len(dst[name]) == len(src[name]) for name in columns)
+    if not valid:
+        tmp.unlink(missing_ok=True)
+        raise OSError(f"Staged copy of {in_path} does not match the original.")
+    tmp.replace(out_path)
+    get_staged_marker(out_path).write_text(str(in_path.resolve()))
+    return True
+
+
+class BackgroundStager:
+    def __init__(
+        self, files: list[tuple[Path, Path]], columns: dict | None = None, batch_size=None
+    ):
+        """Stage files in background threads, one per file.
+
+        Datasets created with `staged_file` switch to the staged copy once it is
+        complete, see [`salt.data.SaltDataset`][salt.data.SaltDataset]. If staging
+        fails, a warning is printed and training continues with the original files.
+
+        Parameters
+        ----------
+        files : list[tuple[Path, Path]]
+            Pairs of original and staged paths
+        columns : dict | None, optional
+            Variables to copy for each h5 dataset, see `stage_file`, by default None
+        batch_size : int | None, optional
+            Chunk length when copying only some columns, by default None
+        """
+        self.stop_event = threading.Event()
+        # the same file may be used for training and validation
+        files = {Path(dst): Path(src) for src, dst in files}
+        self.threads = [
+            threading.Thread(target=self.run, args=(src, dst, columns, batch_size), daemon=True)
+            for dst, src in files.items()
+        ]
+
+    def run(self, src, dst, columns, batch_size):
+        try:
+            if stage_file(src, dst, self.stop_event, columns, batch_size):
+                print(f"Staged {src} to {dst}")
+        except Exception as e:  # noqa: BLE001
+            print(f"Staging {src} failed, training continues with the original file: {e}")
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Abort any unfinished copies and wait for the threads to finish."""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+
 def convert_path_to_S3url(path: Path | str):
     path = str(path)
     s3_start = "s3://"
@@ -66,31 +195,197 @@ def convert_path_to_S3url(path: Path | str):
     return s3_start + path
 
 
-def download_S3(session, bucket, file_to_load, store_path, count):
+def get_md5_etag(path: Path, part_size: int | None = None) -> str:
+    """Return the S3 ETag of a file uploaded in parts of `part_size` bytes.
+
+    If `part_size` is None, return the ETag of a single part upload, which is the MD5
+    checksum of the file.
+    """
+    md5s = []
+    with open(path, "rb") as f:
+        while True:
+            md5 = hashlib.md5()  # noqa: S324
+            nbytes = 0
+            while nbytes < (part_size or math.inf):
+                data = f.read(int(min(1024**2, (part_size or math.inf) - nbytes)))
+                if not data:
+                    break
+                md5.update(data)
+                nbytes += len(data)
+            if not nbytes:
+                break
+            md5s.append(md5)
+    if part_size is None:
+        return md5s[0].hexdigest() if md5s else hashlib.md5().hexdigest()  # noqa: S324
+    digest = hashlib.md5(b"".join(m.digest() for m in md5s)).hexdigest()  # noqa: S324
+    return f"{digest}-{len(md5s)}"
+
+
+def verify_S3(path: Path, size: int, etag: str) -> bool:
+    """Check a local file against the size and ETag of an S3 object.
+
+    ETags of objects uploaded in a single part are their MD5 checksum. For multipart
+    uploads, the ETag depends on the part size, which is not stored, so common part
+    sizes are tried. If none of them gives the expected number of parts, only the
+    size is checked.
+    """
+    path = Path(path)
+    if not path.is_file() or path.stat().st_size != size:
+        return False
+    etag = etag.strip('"')
+    if "-" not in etag:
+        return get_md5_etag(path) == etag
+    num_parts = int(etag.split("-")[1])
+    part_sizes = [s * 1024**2 for s in [8, 5, 16, 15, 32, 64, 100, 128, 256, 512]]
+    part_sizes = [s for s in part_sizes if math.ceil(size / s) == num_parts]
+    if not part_sizes:
+        return True
+    return any(get_md5_etag(path, s) == etag for s in part_sizes)
+
+
+def download_S3(
+    session,
+    bucket,
+    file_to_load,
+    store_path,
+    count,
+    part_size: int = 64 * 1024**2,
+    num_threads: int = 8,
+):
+    """Download an S3 object in concurrent ranged parts, resuming interrupted downloads.
+
+    Parts are written to `<store_path>.part`, and the completed parts are recorded in
+    `<store_path>.part.json`, so that an interrupted download only fetches the missing
+    parts when restarted. Each part is requested with the ETag of the object, so a
+    changed object is never mixed with earlier parts. The complete file is checked
+    with [`verify_S3`][salt.utils.file_utils.verify_S3] before it is moved to
+    `store_path`, and its size and ETag are saved in `<store_path>.s3.json`.
+    """
     file_to_load = file_to_load[1:] if file_to_load[0] == "/" else file_to_load
+    store_path = Path(store_path)
     meta_data = session.head_object(Bucket=bucket, Key=file_to_load)
     total_length = int(meta_data.get("ContentLength", 0))
-    with tqdm(
-        total=total_length,
-        desc=f"Downloading s3://{bucket}/{file_to_load}",
-        position=count,
-        unit="B",
-        unit_scale=True,
-        unit_divisor=1024,
-    ) as t:
-        session.download_file(bucket, file_to_load, str(store_path), Callback=t.update)
-
-
-def download_script_S3(bucket, local_path, key, file, count):
+    etag = meta_data["ETag"]
+
+    part_path = Path(f"{store_path}.part")
+    progress_path = Path(f"{store_path}.part.json")
+    progress = {"etag": etag, "size": total_length, "part_size": part_size, "done": []}
+    if part_path.is_file() and progress_path.is_file():
+        with open(progress_path) as f:
+            previous = json.load(f)
+        if {k: v for k, v in previous.items() if k != "done"} == {
+            k: v for k, v in progress.items() if k != "done"
+        }:
+            progress = previous
+    if not progress["done"]:
+        with open(part_path, "wb") as f:
+            f.truncate(total_length)
+
+    num_parts = max(math.ceil(total_length / part_size), 1)
+    done = set(progress["done"])
+    todo = [i for i in range(num_parts) if i not in done]
+    lock = threading.Lock()
+    with (
+        tqdm(
+            total=total_length,
+            initial=sum(min(part_size, total_length - i * part_size) for i in done),
+            desc=f"Downloading s3://{bucket}/{file_to_load}",
+            position=count,
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+        ) as t,
+        open(part_path, "r+b") as out,
+    ):
+
+        def download_part(i):
+            start = i * part_size
+            stop = min(start + part_size, total_length)
+            response = session.get_object(
+                Bucket=bucket, Key=file_to_load, Range=f"bytes={start}-{stop - 1}", IfMatch=etag
+            )
+            offset = start
+            for data in response["Body"].iter_chunks(1024**2):
+                os.pwrite(out.fileno(), data, offset)
+                offset += len(data)
+                t.update(len(data))
+            if offset != stop:
+                raise OSError(f"Part {i} of s3://{bucket}/{file_to_load} is incomplete.")
+            with lock:
+                progress["done"].append(i)
+                tmp = progress_path.with_name(f"{progress_path.name}.tmp")
+                with open(tmp, "w") as f:
+                    json.dump(progress, f)
+                tmp.replace(progress_path)
+
+        with ThreadPoolExecutor(num_threads) as pool:
+            for future in [pool.submit(download_part, i) for i in todo]:
+                future.result()
+
+    if not verify_S3(part_path, total_length, etag):
+        part_path.unlink()
+        progress_path.unlink(missing_ok=True)
+        raise OSError(f"Downloaded s3://{bucket}/{file_to_load} does not match its ETag {etag}.")
+    part_path.replace(store_path)
+    progress_path.unlink(missing_ok=True)
+    with open(f"{store_path}.s3.json", "w") as f:
+        json.dump({"etag": etag, "size": total_length}, f)
+
+
+def is_downloaded(session, bucket, file_to_load, store_path) -> bool:
+    """Check whether a local file is a complete copy of the current S3 object.
+
+    If S3 can't be reached, a local file is trusted if its size matches the metadata
+    recorded when it was downloaded. Files downloaded by earlier versions, which have no
+    metadata, are then used as they are, with a warning.
+    """
+    store_path = Path(store_path)
+    meta_path = Path(f"{store_path}.s3.json")
+    if not store_path.is_file():
+        return False
+    meta = None
+    if meta_path.is_file():
+        with open(meta_path) as f:
+            meta = json.load(f)
+    file_to_load = file_to_load[1:] if file_to_load[0] == "/" else file_to_load
+    try:
+        head = session.head_object(Bucket=bucket, Key=file_to_load)
+    except (BotoCoreError, ClientError) as e:
+        if meta is not None:
+            return store_path.stat().st_size == meta["size"]
+        warnings.warn(
+            f"Could not check {store_path} against s3://{bucket}/{file_to_load} ({e}),"
+            " using the local file without verifying it.",
+            stacklevel=2,
+        )
+        return True
+    size, etag = int(head.get("ContentLength", 0)), head["ETag"]
+    if meta is not None:
+        return meta == {"etag": etag, "size": size} and store_path.stat().st_size == size
+    # files downloaded by earlier versions are checked once, then recorded
+    if not verify_S3(store_path, size, etag):
+        return False
+    with open(meta_path, "w") as f:
+        json.dump({"etag": etag, "size": size}, f)
+    return True
+
+
+def download_script_S3(bucket, local_path, key, file, count, part_size=64 * 1024**2, num_threads=8):
     target_path = Path(local_path, file.split("/")[-1])
-    if not target_path.is_file():
-        session = boto3.client("s3")
-        download_S3(session, bucket, file, target_path, count)
+    session = boto3.client("s3")
+    if not is_downloaded(session, bucket, file, target_path):
+        download_S3(session, bucket, file, target_path, count, part_size, num_threads)
     else:
         print(f'- "{file}" found locally and not downloaded.')
     return key, str(target_path)
 
 
+def get_part_args(config_S3: dict) -> tuple[int, int]:
+    """Return the part size and number of threads for downloads from `config_S3`."""
+    part_size = int(config_S3.get("download_part_size", 64 * 1024**2))
+    return part_size, int(config_S3.get("download_threads", 8))
+
+
 def import_data_S3(config_path):
     with open(config_path) as file:
         cfg = yaml.safe_load(file)
@@ -106,7 +401,14 @@ def import_data_S3(config_path):
         print("-" * 100)
         print(f"S3 download in progress at local path: {local_path}")
         args = [
-            (config_S3["bucket"], local_path, key, cfg["data"][key], count)
+            (
+                config_S3["bucket"],
+                local_path,
+                key,
+                cfg["data"][key],
+                count,
+                *get_part_args(config_S3),
+            )
             for count, key in enumerate(config_S3["download_files"])
         ]
         with Pool() as pool:
@@ -141,7 +443,7 @@ def setup_S3_CLI(sc_data):
 
         # Parallelise the download
         args = [
-            (config_S3["bucket"], local_path, key, sc_data[key], count)
+            (config_S3["bucket"], local_path, key, sc_data[key], count, *get_part_args(config_S3))
             for count, key in enumerate(config_S3["download_files"])
         ]
         with Pool() as pool:
@@ -30,6 +30,32 @@ def build_target_masks(object_ids, input_ids, shuffle=False):
     return input_ids.unsqueeze(-2) == object_ids.unsqueeze(-1)
 
 
+def add_target_masks(labels: dict, mf_config) -> dict:
+    """Add the MaskFormer truth masks to the labels of a batch.
+
+    The masks are built from the object ids and the per-constituent object ids, which
+    are both already part of the labels.
+
+    Parameters
+    ----------
+    labels : dict
+        Labels for each input type
+    mf_config : MaskformerConfig
+        Config for Maskformer matching
+
+    Returns
+    -------
+    dict
+        The labels, with the dense `(batch, num_objects, num_constituents)` masks
+        added as `labels["objects"]["masks"]`
+    """
+    labels["objects"]["masks"] = build_target_masks(
+        labels["objects"][mf_config.object.id_label],
+        labels[mf_config.constituent.name][mf_config.constituent.id_label],
+    )
+    return labels
+
+
 def mask_from_indices(indices: Tensor, num_masks: int | None = None) -> BoolTensor:
     """Convert a dense index tensor to a sparse bool mask.
 
@@ -0,0 +1,190 @@
+"""Node-local cache of staged input files, shared by all jobs and ranks on a node.
+
+Each staged file is stored in a directory named after a fingerprint of the source file,
+so the same file is only copied once, even when it is referred to through symlinks.
+Every process using a staged file holds a lease, which is a file named after the
+host and process ID. Leases of processes which have exited without releasing them
+(e.g. killed jobs) are ignored. A staged file is removed when its last lease is
+released, unless `retain` is set, in which case unused files are kept for later jobs
+and the least recently used are evicted when space is needed.
+
+All changes to the cache are made while holding an exclusive `fcntl` lock on the
+cache directory, except for the copy itself, which only holds a lock for that file.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import socket
+import threading
+from pathlib import Path
+
+from salt.utils.file_utils import is_staged, stage_file
+
+SAMPLE_NBYTES = 1024**2
+
+
+def get_fingerprint(path: Path | str) -> str:
+    """Return a fingerprint of a file's identity and contents.
+
+    Hashing the full contents of large files would take as long as copying them, so
+    the fingerprint is computed from the real path, inode, modification time and size of
+    the file, and three samples of its contents. A file regenerated in place therefore
+    gets a new fingerprint, even if the samples are unchanged.
+    """
+    path = Path(path)
+    stat = path.stat()
+    size = stat.st_size
+    key = f"{os.path.realpath(path)}:{stat.st_ino}:{stat.st_mtime_ns}:{size}"
+    sha = hashlib.sha1(key.encode())  # noqa: S324
+    with open(path, "rb") as f:
+        for offset in (0, max(size // 2 - SAMPLE_NBYTES // 2, 0), max(size - SAMPLE_NBYTES, 0)):
+            f.seek(offset)
+            sha.update(f.read(SAMPLE_NBYTES))
+    return sha.hexdigest()[:16]
+
+
+@contextlib.contextmanager
+def file_lock(path: Path):
+    """Hold an exclusive lock on a lock file."""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def is_alive(lease: Path) -> bool:
+    """Check whether the process holding a lease is still running on this host."""
+    host, _, pid = lease.name.rpartition("-")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StagingCache:
+    def __init__(self, cache_dir: Path | str, max_nbytes: int | None = None, retain: bool = False):
+        """Shared node-local cache of staged files.
+
+        Parameters
+        ----------
+        cache_dir : Path | str
+            Node-local directory, e.g. under `/dev/shm` or local scratch
+        max_nbytes : int | None, optional
+            Maximum total size of the staged files. If staging a new file would exceed
+            this, unused files are evicted, least recently used first. If there is still
+            not enough space, the file is not staged. By default None, which only
+            checks the free space on the filesystem
+        retain : bool, optional
+            Keep files after their last lease is released, so that later jobs can use
+            them, by default False
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_nbytes = max_nbytes
+        self.retain = retain
+        self.lock_path = self.cache_dir / ".lock"
+        self.lease_name = f"{socket.gethostname()}-{os.getpid()}"
+        self.leases: dict[Path, Path] = {}
+        self.users: dict[Path, int] = {}
+
+    def entries(self) -> list[Path]:
+        return [p for p in self.cache_dir.iterdir() if p.is_dir()]
+
+    def live_leases(self, entry: Path) -> list[Path]:
+        """Return the leases on an entry held by running processes, removing the others."""
+        leases = []
+        for lease in (entry / "leases").glob("*"):
+            if is_alive(lease):
+                leases.append(lease)
+            else:
+                lease.unlink(missing_ok=True)
+        return leases
+
+    def staged_path(self, entry: Path) -> Path | None:
+        return next((p for p in entry.glob("*") if is_staged(p)), None)
+
+    def nbytes(self, entry: Path) -> int:
+        return sum(p.stat().st_size for p in entry.glob("*") if p.is_file())
+
+    def make_space(self, nbytes: int) -> bool:
+        """Evict unused entries until `nbytes` can be staged. Must hold the cache lock."""
+        entries = self.entries()
+        used = sum(self.nbytes(e) for e in entries)
+
+        def fits():
+            free = shutil.disk_usage(self.cache_dir).free
+            within = self.max_nbytes is None or used + nbytes <= self.max_nbytes
+            return within and nbytes <= free
+
+        # processes staging a file hold a lease on it
+        unused = [e for e in entries if not self.live_leases(e)]
+        for entry in sorted(unused, key=lambda e: e.stat().st_mtime):
+            if fits():
+                break
+            used -= self.nbytes(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+        return fits()
+
+    def acquire(self, path: Path | str) -> Path:
+        """Return a staged copy of a file, staging it if needed, and take a lease on it.
+
+        If the file cannot be staged, a warning is printed and the original path is
+        returned without a lease.
+        """
+        path = Path(path)
+        entry = self.cache_dir / get_fingerprint(path)
+        staged = entry / path.name
+        with file_lock(self.lock_path):
+            entry.mkdir(exist_ok=True)
+            (entry / "leases").mkdir(exist_ok=True)
+            lease = entry / "leases" / self.lease_name
+            lease.touch()
+            entry.touch()
+
+        # only one process copies each file, the others wait for the copy lock
+        with file_lock(entry / ".staging"):
+            current = self.staged_path(entry)
+            if current is None:
+                with file_lock(self.lock_path):
+                    ok = self.make_space(path.stat().st_size)
+                if ok:
+                    print(f"Staging {path} to {staged}")
+                    stage_file(path, staged, threading.Event())
+                    current = staged
+        if current is None:
+            print(f"Not enough space to stage {path} in {self.cache_dir}, using the original")
+            self.release_lease(lease)
+            return path
+        # the same file may be used several times by one process, e.g. for training and
+        # validation, so the process keeps its own count of users for its lease
+        self.leases[current] = lease
+        self.users[current] = self.users.get(current, 0) + 1
+        return current
+
+    def release(self, path: Path | str) -> None:
+        """Release the lease on a staged file, removing it if it was the last one."""
+        path = Path(path)
+        if path not in self.leases:
+            return
+        self.users[path] -= 1
+        if not self.users[path]:
+            del self.users[path]
+            self.release_lease(self.leases.pop(path))
+
+    def release_lease(self, lease: Path) -> None:
+        entry = lease.parent.parent
+        with file_lock(self.lock_path):
+            lease.unlink(missing_ok=True)
+            if self.retain or self.live_leases(entry):
+                return
+            shutil.rmtree(entry, ignore_errors=True)